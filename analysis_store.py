@@ -0,0 +1,57 @@
+"""
+一站式分析结果的持久化存储（SQLite）
+
+以 (PDF 内容哈希, 分析版本) 为键保存一次全量分析产出的全部产物：
+深度概览、BibTeX、术语表、实验数据、逻辑导图，以及生成它们的分片笔记。
+分析版本由 System Prompt（读者水平）与模型决定，换读者水平会重新分析。
+"""
+import json
+import time
+import zlib
+
+from sqlite_store import SqliteLruStore
+
+
+class AnalysisStore(SqliteLruStore):
+    """(file_hash, variant) -> 压缩后的 {"artifacts": {...}, "notes": [...], "meta": {...}}"""
+
+    MAX_BYTES = 200 * 1024 * 1024
+    TABLE = "analyses"
+    COLUMNS = """
+        file_hash TEXT NOT NULL,
+        variant TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (file_hash, variant)
+    """
+
+    def get(self, file_hash, variant):
+        """返回 {"artifacts": {...}, "notes": [...], "meta": {...}}，不存在时返回 None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload FROM analyses WHERE file_hash = ? AND variant = ?",
+                (file_hash, variant),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE analyses SET accessed_at = ? WHERE file_hash = ? AND variant = ?",
+                (time.time(), file_hash, variant),
+            )
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, file_hash, variant, analysis):
+        payload = zlib.compress(json.dumps(analysis, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO analyses
+                    (file_hash, variant, payload, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (file_hash, variant, payload, len(payload), now, now),
+            )
+            self._evict(conn)
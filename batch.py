@@ -0,0 +1,215 @@
+"""
+无界面批处理：一次处理整个目录的论文
+
+    python batch.py papers/ --out batch_out --workers 2
+
+对目录下每个 PDF 做一次一站式分析（深度概览、BibTeX、术语表、实验数据、逻辑导图），
+复用页面版的全部核心流程（解析结果存储、分析结果存储、响应缓存、并行 Map-Reduce）。输出：
+- <out>/results.jsonl：每篇论文一行 JSON，边处理边追加
+- <out>/<文件名>.md：每篇论文一份 Markdown 研读笔记
+- 成功的论文连同研读产物加入个人文库（页面【📚 我的文库】可跨论文检索、提问），--no-library 关闭
+
+可断点续跑：results.jsonl 里已经成功的论文（按内容哈希识别）会被跳过，失败的会重试；
+--force 忽略已有结果全部重跑。结束时输出吞吐量（篇/分钟）。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from paper_core import (
+    ANALYSIS_ARTIFACTS, DEFAULT_READER_LEVEL, MAP_MAX_WORKERS, QwenCallError, add_to_library, analyze_paper,
+    default_system_instruction, extract_pdf_document, get_content_hash, get_usage_tracker, set_api_key,
+)
+from pdf_extract import BACKENDS, DEFAULT_BACKEND
+from sections import section_text
+from usage_tracker import UsageTotals
+
+logger = logging.getLogger("paperagent.batch")
+
+RESULTS_FILE = "results.jsonl"
+# 同时处理的论文数；每篇论文内部还有 Map 阶段的并发，总在途请求数约为两者之积
+DEFAULT_PAPER_WORKERS = 2
+
+
+def find_pdfs(input_dir, recursive=False):
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(".pdf"))
+        if not recursive:
+            break
+    return sorted(paths)
+
+
+def load_done_hashes(results_path):
+    """读取已成功处理的论文哈希；末尾被中断写了一半的行直接忽略"""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["file_hash"])
+    return done
+
+
+def render_markdown(record):
+    md = f"# 论文研读笔记：{record['file']}\n日期: {record['processed_at']}\n\n"
+    md += f"## 深度概览\n{record['summary']}\n\n"
+    md += f"## BibTeX\n```bibtex\n{record['bibtex']}\n```\n\n"
+    md += f"## 核心术语表\n{record['terms']}\n\n"
+    md += f"## 实验数据\n{record['experiment']}\n\n"
+    md += f"## 逻辑导图\n```mermaid\n{record['mindmap']}\n```\n"
+    return md
+
+
+def process_paper(path, system_instruction, map_workers, pdf_backend=DEFAULT_BACKEND, library=True):
+    """处理单篇论文，返回结果记录；任何一步失败都抛出异常"""
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        data = f.read()
+    doc = extract_pdf_document(data, os.path.basename(path), pdf_backend)
+    text, ocr = doc["text"], doc["ocr"]
+    if not text.strip():
+        raise ValueError(f"未能提取到文本（可能是扫描版 PDF）：{ocr['error'] or 'OCR 未识别出文字'}")
+
+    # 每篇论文单独记账，明细同样写入 usage.jsonl（会话标识为 batch:<哈希前缀>）
+    file_hash = get_content_hash(data)
+    usage = UsageTotals()
+    tracker = get_usage_tracker()
+    session_id = f"batch:{file_hash[:12]}"
+
+    # 一次遍历产出全部产物；页面版或上次批处理分析过的论文直接读取已保存的结果
+    # 参考文献、致谢等章节不参与分析
+    analysis = analyze_paper(section_text(text, doc["sections"], "overview"), system_instruction,
+                             max_workers=map_workers, meter=tracker.meter("analysis", session_id, usage),
+                             file_hash=file_hash)
+    if analysis["errors"]:
+        raise QwenCallError("；".join(f"{name}: {error}" for name, error in analysis["errors"].items()))
+    artifacts = analysis["artifacts"]
+    if library:
+        add_to_library(file_hash, os.path.basename(path), text, doc["page_starts"], doc["sections"],
+                       artifacts={name: artifacts[name] for name in ANALYSIS_ARTIFACTS})
+    return {
+        "file": os.path.basename(path),
+        "path": path,
+        "file_hash": file_hash,
+        "status": "ok",
+        "summary": artifacts["overview"],
+        "bibtex": artifacts["bibtex"],
+        "terms": artifacts["terms"],
+        "experiment": artifacts["experiment"],
+        "mindmap": artifacts["mindmap"],
+        "chars": len(text),
+        "pages": len(doc["page_starts"]),
+        "pdf_backend": doc["backend"],
+        "timed_out_pages": doc["timed_out"],
+        "ocr_pages": ocr["pages"],
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cost": round(usage.cost, 6),
+        "elapsed": round(time.perf_counter() - start, 3),
+        "processed_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def run_batch(input_dir, out_dir, workers=DEFAULT_PAPER_WORKERS, map_workers=MAP_MAX_WORKERS,
+              reader_level=DEFAULT_READER_LEVEL, recursive=False, force=False, pdf_backend=DEFAULT_BACKEND,
+              library=True):
+    """返回统计 dict：total / skipped / ok / failed / elapsed / papers_per_minute / tokens / cost"""
+    os.makedirs(out_dir, exist_ok=True)
+    results_path = os.path.join(out_dir, RESULTS_FILE)
+    done = set() if force else load_done_hashes(results_path)
+
+    # 先按内容哈希去重并跳过已完成的论文（同一篇论文换个文件名也只处理一次）
+    pending, skipped = {}, 0
+    paths = find_pdfs(input_dir, recursive)
+    for path in paths:
+        with open(path, "rb") as f:
+            file_hash = get_content_hash(f.read())
+        if file_hash in done or file_hash in pending.values():
+            skipped += 1
+            continue
+        pending[path] = file_hash
+    logger.info("found %d PDFs: %d to process, %d skipped", len(paths), len(pending), skipped)
+
+    system_instruction = default_system_instruction(reader_level)
+    write_lock = threading.Lock()
+    stats = {"total": len(paths), "skipped": skipped, "ok": 0, "failed": 0}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(process_paper, path, system_instruction, map_workers, pdf_backend, library): path
+                   for path in pending}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                logger.error("failed: %s (%s)", path, e)
+                record = {"file": os.path.basename(path), "path": path, "file_hash": pending[path],
+                          "status": "failed", "error": str(e),
+                          "processed_at": datetime.now().isoformat(timespec="seconds")}
+                stats["failed"] += 1
+            else:
+                md_name = os.path.splitext(record["file"])[0] + ".md"
+                with open(os.path.join(out_dir, md_name), "w", encoding="utf-8") as f:
+                    f.write(render_markdown(record))
+                stats["ok"] += 1
+                logger.info("done: %s (%.1fs)", path, record["elapsed"])
+            # 每篇论文一完成就落盘，进程中断后可以从这里续跑
+            with write_lock, open(results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    elapsed = time.perf_counter() - start
+    stats["elapsed"] = round(elapsed, 3)
+    stats["papers_per_minute"] = round(stats["ok"] / elapsed * 60, 2) if stats["ok"] and elapsed > 0 else 0.0
+    usage = get_usage_tracker().totals.snapshot()
+    stats["tokens"] = usage["total_tokens"]
+    stats["cost"] = round(usage["cost"], 4)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PaperAgent 批处理：为目录下的所有 PDF 生成概览、BibTeX、术语表、实验数据与逻辑导图")
+    parser.add_argument("input_dir", help="论文 PDF 所在目录")
+    parser.add_argument("--out", default="batch_out", help="输出目录（默认 batch_out）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_PAPER_WORKERS, help="同时处理的论文数")
+    parser.add_argument("--map-workers", type=int, default=MAP_MAX_WORKERS, help="每篇论文 Map 阶段的并发请求数")
+    parser.add_argument("--reader-level", default=DEFAULT_READER_LEVEL, help="读者水平（影响 System Prompt）")
+    parser.add_argument("--api-key", default=os.environ.get("DASHSCOPE_API_KEY"),
+                        help="DashScope API Key（默认读取环境变量 DASHSCOPE_API_KEY）")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    parser.add_argument("--force", action="store_true", help="忽略已有结果，全部重新处理")
+    parser.add_argument("--pdf-backend", choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f"PDF 解析引擎（默认 {DEFAULT_BACKEND}，失败时自动回退）")
+    parser.add_argument("--no-library", action="store_true", help="不把处理过的论文加入个人文库")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not args.api_key:
+        parser.error("缺少 API Key：请使用 --api-key 或设置环境变量 DASHSCOPE_API_KEY")
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"目录不存在：{args.input_dir}")
+    set_api_key(args.api_key)
+
+    stats = run_batch(args.input_dir, args.out, args.workers, args.map_workers,
+                      args.reader_level, args.recursive, args.force, args.pdf_backend,
+                      library=not args.no_library)
+    print(f"共 {stats['total']} 篇：成功 {stats['ok']}，失败 {stats['failed']}，跳过 {stats['skipped']}；"
+          f"耗时 {stats['elapsed']:.1f}s，吞吐量 {stats['papers_per_minute']} 篇/分钟；"
+          f"共 {stats['tokens']:,} Token，约 ¥{stats['cost']}")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
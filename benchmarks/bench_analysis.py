@@ -0,0 +1,168 @@
+"""
+全量分析基准：逐个点击五个按钮 vs 一站式分析（一次遍历）
+
+用法：
+    python benchmarks/bench_analysis.py --synthetic-pages 40
+    python benchmarks/bench_analysis.py paper.pdf [more.pdf ...]
+    python benchmarks/bench_analysis.py paper.pdf --live   # 需要 DASHSCOPE_API_KEY，实测 Token 与耗时
+
+离线模式按两条路径实际会发送的 Prompt 统计输入 Token（笔记长度按 --note-tokens 模拟，
+每次调用的输出按 QWEN_OUTPUT_TOKENS_ESTIMATE 计），并给出关键路径上的串行调用轮数。
+--live 模式在临时缓存目录下真实执行两条路径（不命中响应缓存），读取 usage 与墙钟时间。
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chat_context import load_pdf_text, synthetic_paper  # noqa: E402
+
+# --live 不能命中之前留下的响应缓存，必须在导入 paper_core 之前指定缓存目录
+os.environ.setdefault("PAPERAGENT_CACHE_DIR", tempfile.mkdtemp(prefix="bench_analysis_"))
+
+from chunking import estimate_tokens  # noqa: E402
+from paper_core import (  # noqa: E402
+    EXPERIMENT_PROMPT, MAP_MAX_WORKERS, QWEN_OUTPUT_TOKENS_ESTIMATE, REDUCE_INPUT_TOKENS, analyze_paper,
+    build_analysis_map_prompt, build_bibtex_from_notes_prompt, build_bibtex_prompt, build_chat_messages,
+    build_experiment_from_notes_prompt, build_mermaid_prompt, build_mindmap_prompt, build_paper_prefix,
+    build_terms_from_notes_prompt, build_terms_prompt, default_system_instruction, estimate_summary_tokens,
+    generate_bibtex, generate_mindmap_code, get_usage_tracker, request_qwen, split_for_summary,
+    summarize_paper, truncate_to_tokens,
+)
+
+NOTE_FILLER = "模型 方法 数据集 提升 baseline accuracy "
+
+
+def reduce_rounds(n_summaries):
+    """树形 Reduce 的层数（含最终汇总），与 estimate_summary_tokens 的分组方式一致"""
+    rounds, pending = 1, n_summaries
+    while pending * QWEN_OUTPUT_TOKENS_ESTIMATE > REDUCE_INPUT_TOKENS and pending > 1:
+        groups = max(1, -(-pending * QWEN_OUTPUT_TOKENS_ESTIMATE // REDUCE_INPUT_TOKENS))
+        pending = groups if groups < pending else -(-pending // 2)
+        rounds += 1
+    return rounds
+
+
+def reduce_stage_tokens(chunks):
+    """概览 Map 之后的树形 Reduce（含最终汇总）输入 + 输出，两条路径相同"""
+    if len(chunks) == 1:
+        return 0
+    text_tokens = sum(estimate_tokens(c) for c in chunks)
+    return estimate_summary_tokens("\n".join(chunks)) - text_tokens - len(chunks) * QWEN_OUTPUT_TOKENS_ESTIMATE
+
+
+def call_tokens(prompt, sys_tokens):
+    return estimate_tokens(prompt) + sys_tokens + QWEN_OUTPUT_TOKENS_ESTIMATE
+
+
+def offline_old(text, system_instruction):
+    """五个按钮各自的调用：概览（Map-Reduce）、BibTeX、术语表、实验数据（全文）、逻辑导图。返回 (总 Token, 调用数, 串行轮数)"""
+    chunks = split_for_summary(text)
+    sys_tokens = estimate_tokens(system_instruction)
+    experiment = build_chat_messages(build_paper_prefix(system_instruction, text), EXPERIMENT_PROMPT)
+    total = (
+        sum(estimate_tokens(c) + sys_tokens + QWEN_OUTPUT_TOKENS_ESTIMATE for c in chunks)
+        + reduce_stage_tokens(chunks)
+        + call_tokens(build_bibtex_prompt(text), sys_tokens)
+        + call_tokens(build_terms_prompt(text), sys_tokens)
+        + sum(estimate_tokens(m["content"]) for m in experiment) + QWEN_OUTPUT_TOKENS_ESTIMATE
+        + call_tokens(build_mindmap_prompt(text), sys_tokens)
+    )
+    if len(chunks) == 1:
+        calls, rounds = 5, 5
+    else:
+        levels = reduce_rounds(len(chunks))
+        calls = len(chunks) + levels + 4
+        rounds = math.ceil(len(chunks) / MAP_MAX_WORKERS) + levels + 4
+    return total, calls, rounds
+
+
+def offline_new(text, system_instruction, note_tokens):
+    chunks = split_for_summary(text)
+    sys_tokens = estimate_tokens(system_instruction)
+    note = truncate_to_tokens(NOTE_FILLER * note_tokens, note_tokens)
+    notes = truncate_to_tokens("\n\n".join(note for _ in chunks), REDUCE_INPUT_TOKENS)
+    total = (
+        sum(call_tokens(build_analysis_map_prompt(c, i, len(chunks)), sys_tokens) for i, c in enumerate(chunks))
+        + reduce_stage_tokens(chunks)
+        + call_tokens(build_bibtex_from_notes_prompt(note), sys_tokens)
+        + call_tokens(build_terms_from_notes_prompt(notes), sys_tokens)
+        + call_tokens(build_experiment_from_notes_prompt(notes), sys_tokens)
+        + call_tokens(build_mermaid_prompt(notes), sys_tokens)
+    )
+    # 单分片时概览也由笔记派生，多一次小调用；多分片时最终汇总已计入 reduce_stage_tokens
+    levels = reduce_rounds(len(chunks)) if len(chunks) > 1 else 0
+    if len(chunks) == 1:
+        total += call_tokens(notes, sys_tokens)
+    calls = len(chunks) + max(levels - 1, 0) + 5
+    rounds = math.ceil(len(chunks) / MAP_MAX_WORKERS) + max(levels - 1, 0) + 1
+    return total, calls, rounds
+
+
+def live_old(text, system_instruction):
+    summarize_paper(text, system_instruction)
+    generate_bibtex(text, system_instruction)
+    request_qwen([{"role": "system", "content": system_instruction},
+                  {"role": "user", "content": build_terms_prompt(text)}])
+    request_qwen(build_chat_messages(build_paper_prefix(system_instruction, text), EXPERIMENT_PROMPT))
+    generate_mindmap_code(text, system_instruction)
+
+
+def live_new(text, system_instruction):
+    analyze_paper(text, system_instruction)
+
+
+def measure_live(fn, text, system_instruction):
+    totals = get_usage_tracker().totals
+    before = totals.snapshot()
+    start = time.perf_counter()
+    fn(text, system_instruction)
+    elapsed = time.perf_counter() - start
+    after = totals.snapshot()
+    return (after["prompt_tokens"] - before["prompt_tokens"],
+            after["completion_tokens"] - before["completion_tokens"],
+            after["calls"] - before["calls"], elapsed)
+
+
+def bench(name, text, args):
+    system_instruction = default_system_instruction()
+    chunks = split_for_summary(text)
+    print(f"\n== {name}: {len(text):,} chars, ~{estimate_tokens(text):,} tokens, {len(chunks)} chunks")
+    if args.live:
+        for label, fn in (("five buttons", live_old), ("one pass", live_new)):
+            prompt, completion, calls, elapsed = measure_live(fn, text, system_instruction)
+            print(f"  {label:<13} input {prompt:>8,}  output {completion:>7,}  calls {calls:>3}  wall {elapsed:6.1f}s")
+        return
+    old = offline_old(text, system_instruction)
+    new = offline_new(text, system_instruction, args.note_tokens)
+    for label, (tokens, calls, rounds) in (("five buttons", old), ("one pass", new)):
+        print(f"  {label:<13} ~{tokens:>8,} tokens  calls {calls:>3}  serial rounds {rounds:>3}")
+    print(f"  saving: {1 - new[0] / old[0]:.0%} tokens, {old[2] - new[2]} fewer serial rounds")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--synthetic-pages", type=int, default=40)
+    parser.add_argument("--note-tokens", type=int, default=150, help="离线模式下每个分片每类笔记的模拟长度")
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+    if args.live:
+        import dashscope
+
+        dashscope.api_key = os.environ["DASHSCOPE_API_KEY"]
+
+    if args.pdfs:
+        for path in args.pdfs:
+            bench(os.path.basename(path), load_pdf_text(path), args)
+    else:
+        for pages in sorted({4, args.synthetic_pages}):
+            bench(f"synthetic {pages} pages", synthetic_paper(pages), args)
+
+
+if __name__ == "__main__":
+    main()
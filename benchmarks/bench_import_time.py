@@ -0,0 +1,86 @@
+"""
+导入耗时基准（python -X importtime）：核心模块懒加载前后对比
+
+用法：
+    python benchmarks/bench_import_time.py                 # 默认各跑 5 次取中位数
+    python benchmarks/bench_import_time.py --repeat 10 --top 8
+
+每次测量都在全新的子进程里执行，避免 sys.modules 缓存的影响：
+- core：         import paper_core（批处理 / 其他脚本复用核心流程时的导入开销）
+- core (eager)： 再加上 dashscope、pdfplumber、fpdf —— 拆分前 main.py 顶层就会导入的重依赖
+- app：          main.py 启动时实际执行的导入（streamlit + 本地模块）
+- app (eager)：  app 再加上上述重依赖，即拆分前的冷启动导入集合
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ["dashscope", "pdfplumber", "fpdf"]
+APP = ["streamlit", "streamlit.components.v1", "chunking", "retrieval", "paper_core",
+       "static_assets", "vendor_assets"]
+
+SCENARIOS = {
+    "core": ["paper_core"],
+    "core (eager)": ["paper_core"] + HEAVY,
+    "app": APP,
+    "app (eager)": APP + HEAVY,
+}
+
+
+def _importtime(code):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    top = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # 只统计顶层导入（没有缩进），依赖已经计入其累计耗时
+        if not name.startswith("  "):
+            top[name.strip()] = int(cumulative) / 1000
+    return top
+
+
+# 解释器启动本身就会导入的模块（encodings、site 等），不计入任何场景
+_STARTUP = set(_importtime("pass"))
+
+
+def measure(modules):
+    """返回 (总耗时 ms, {顶层模块: 累计耗时 ms})"""
+    top = _importtime("; ".join(f"import {m}" for m in modules))
+    top = {name: ms for name, ms in top.items() if name not in _STARTUP}
+    return sum(top.values()), top
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="列出耗时最多的前 N 个顶层导入")
+    args = parser.parse_args()
+
+    results = {}
+    for label, modules in SCENARIOS.items():
+        runs = [measure(modules) for _ in range(args.repeat)]
+        totals = [total for total, _ in runs]
+        results[label] = statistics.median(totals)
+        breakdown = runs[totals.index(sorted(totals)[len(totals) // 2])][1]
+        heaviest = sorted(breakdown.items(), key=lambda kv: -kv[1])[:args.top]
+        print(f"{label:<14} median {results[label]:8.1f} ms  "
+              f"(min {min(totals):.1f}, max {max(totals):.1f})")
+        for name, ms in heaviest:
+            print(f"    {name:<28} {ms:8.1f} ms")
+
+    print()
+    for label in ("core", "app"):
+        eager, lazy = results[f"{label} (eager)"], results[label]
+        print(f"{label:<5} {eager:8.1f} ms -> {lazy:8.1f} ms  (-{eager - lazy:.1f} ms, {eager / lazy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
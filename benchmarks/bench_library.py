@@ -0,0 +1,83 @@
+"""
+文库检索基准：几百篇论文规模下的入库吞吐与检索延迟
+
+用法：
+    python benchmarks/bench_library.py --papers 300 --pages 12
+    python benchmarks/bench_library.py paper.pdf [more.pdf ...]
+
+在临时目录建一个文库，逐篇加入（合成论文或真实 PDF），然后对关键词查询与短语查询各跑多轮，
+输出入库耗时、索引大小、合并后与合并前（多段）的检索延迟 p50 / p95。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chat_context import load_pdf_text, synthetic_paper  # noqa: E402
+from library import PaperLibrary  # noqa: E402
+
+QUERIES = [
+    "ImageNet baseline accuracy",
+    '"ResNet baselines"',
+    "数据集 对比 提升",
+    '"accuracy improves by 2.1%"',
+    "transformer7 attention12",
+]
+
+
+def timed_searches(library, rounds):
+    latencies = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(rounds):
+            t = time.perf_counter()
+            hits = library.search(query, top_k=8)
+            samples.append((time.perf_counter() - t) * 1000)
+        samples.sort()
+        latencies[query] = (statistics.median(samples), samples[int(len(samples) * 0.95) - 1], len(hits))
+    return latencies
+
+
+def report(title, latencies):
+    print(f"\n{title}")
+    for query, (p50, p95, hits) in latencies.items():
+        print(f"  {query:<32} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms   命中 {hits}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--papers", type=int, default=300, help="合成论文篇数（未给出 PDF 时）")
+    parser.add_argument("--pages", type=int, default=12, help="每篇合成论文的页数")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.pdfs:
+        papers = [(os.path.basename(p), load_pdf_text(p)) for p in args.pdfs]
+    else:
+        papers = [(f"synthetic-{i}.pdf", synthetic_paper(args.pages, seed=i)) for i in range(args.papers)]
+
+    with tempfile.TemporaryDirectory(prefix="bench_library_") as root:
+        library = PaperLibrary(root)
+        t = time.perf_counter()
+        for i, (name, text) in enumerate(papers):
+            library.add(f"{i:064x}", name, text)
+        elapsed = time.perf_counter() - t
+        stats = library.stats()
+        print(f"入库 {stats['papers']} 篇 / {stats['passages']} 个段落：{elapsed:.1f}s"
+              f"（{stats['papers'] / elapsed:.1f} 篇/秒），索引 {stats['index_bytes'] / 1024 / 1024:.1f} MB，"
+              f"{stats['segments']} 段")
+
+        report(f"检索（{stats['segments']} 段）", timed_searches(library, args.rounds))
+        t = time.perf_counter()
+        library.optimize()
+        print(f"\n合并为 1 段：{time.perf_counter() - t:.2f}s")
+        report("检索（1 段）", timed_searches(library, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+PDF 抽取后端对比：pdfium（快速）/ pdfminer（均衡）/ pdfplumber（高保真）
+
+用法：
+    python benchmarks/bench_pdf_backends.py papers/                 # 目录下所有 PDF（递归）
+    python benchmarks/bench_pdf_backends.py a.pdf b.pdf --repeat 3
+    python benchmarks/bench_pdf_backends.py                         # 没有样本时用 10/100 页合成 PDF
+
+对语料中的每个 PDF 串行运行各后端（不开进程池，只比较引擎本身），输出：
+- 耗时（--repeat 次取中位数）与相对 pdfplumber 的加速比
+- 与 pdfplumber 输出的词级一致度（词袋 F1，中日韩文字按字计；衡量有没有丢字/乱码，不衡量换行与空格差异）
+- 识别到的章节数（版面信息是否足够章节识别使用）
+无法打开的 PDF 记为失败，不中断整个基准。
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pdf_extract import make_pdf  # noqa: E402
+from pdf_extract import BACKENDS, extract_pages  # noqa: E402
+from sections import detect_sections  # noqa: E402
+
+REFERENCE = "pdfplumber"
+# 英文/数字按词，中日韩等其他文字按单字（这些文字词间没有空格，各引擎插入空格的位置不同）
+_WORD_RE = re.compile(r"[0-9a-z]+|[^\W0-9a-z_]")
+
+
+def find_pdfs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(".pdf"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def word_f1(text, reference):
+    """词袋 F1：两份文本的词（CJK 按字）多重集合的重合程度"""
+    a, b = Counter(_WORD_RE.findall(text.lower())), Counter(_WORD_RE.findall(reference.lower()))
+    overlap = sum((a & b).values())
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / sum(a.values()), overlap / sum(b.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def run_backend(data, backend, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages, layout, _timed_out = extract_pages(data, max_workers=1, backend=backend)
+        times.append(time.perf_counter() - start)
+    text = "".join(p + "\n" for p in pages if p)
+    return statistics.median(times), text, detect_sections(text, layout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="PDF 文件或目录")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100], help="没有样本时合成 PDF 的页数")
+    args = parser.parse_args()
+
+    if args.paths:
+        docs = [(os.path.basename(p), open(p, "rb").read()) for p in find_pdfs(args.paths)]
+    else:
+        docs = [(f"synthetic {n}p", make_pdf(n)) for n in args.pages]
+
+    backends = list(BACKENDS)
+    totals = {b: 0.0 for b in backends}
+    failures = Counter()
+    print(f"{'document':<28}{'backend':<12}{'time s':>8}{'speedup':>9}{'chars':>9}{'word F1':>9}{'sections':>10}")
+    for name, data in docs:
+        results = {}
+        for backend in backends:
+            try:
+                results[backend] = run_backend(data, backend, args.repeat)
+            except Exception as e:
+                failures[backend] += 1
+                print(f"{name[:27]:<28}{backend:<12}  failed: {type(e).__name__}: {str(e)[:60]}")
+        reference = results.get(REFERENCE)
+        for backend, (elapsed, text, sections) in results.items():
+            totals[backend] += elapsed
+            speedup = f"{reference[0] / elapsed:8.1f}x" if reference else f"{'-':>9}"
+            f1 = f"{word_f1(text, reference[1]):9.3f}" if reference else f"{'-':>9}"
+            print(f"{name[:27]:<28}{backend:<12}{elapsed:>8.2f}{speedup}{len(text):>9,}{f1}{len(sections):>10}")
+
+    print(f"\n{len(docs)} documents")
+    for backend in backends:
+        ratio = totals[REFERENCE] / totals[backend] if totals[backend] and totals[REFERENCE] else 0
+        print(f"  {backend:<12} total {totals[backend]:7.2f}s  vs {REFERENCE} {ratio:5.1f}x  failures {failures[backend]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+多轮问答的前缀稳定性基准：旧消息布局 vs 固定前缀布局
+
+用法：
+    python benchmarks/bench_prompt_prefix.py --synthetic-pages 4
+    python benchmarks/bench_prompt_prefix.py paper.pdf
+    python benchmarks/bench_prompt_prefix.py paper.pdf --live   # 需要 DASHSCOPE_API_KEY，实测缓存命中与首字延迟
+
+服务端上下文缓存只对“与之前请求逐字节相同的前缀”生效。离线模式统计每一轮请求中
+与上一轮请求相同的前缀占比（可缓存上限）；--live 模式读取 usage 里的 cached_tokens 与首字延迟。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chat_context import QUESTIONS, load_pdf_text, synthetic_paper  # noqa: E402
+from paper_core import build_chat_messages, build_paper_prefix, default_system_instruction  # noqa: E402
+
+ANSWER = "（模拟回答）论文在实验部分对比了多个基线方法，并给出了具体的指标提升。" * 3
+
+
+def old_layout(system_instruction, text, history, question):
+    """旧布局：每轮把整篇论文和问题拼进一条新的用户消息，历史只保留最近 4 条"""
+    messages = [{"role": "system", "content": system_instruction}]
+    messages.extend(history[-4:])
+    messages.append({"role": "user", "content": f"基于论文内容：\n{text}\n\n用户问题：{question}"})
+    return messages
+
+
+def new_layout(system_instruction, text, history, question):
+    return build_chat_messages(build_paper_prefix(system_instruction, text), question, turns=history)
+
+
+def shared_prefix_chars(prev, cur):
+    """两次请求按消息序列化后的公共前缀长度（字符）"""
+    a = "".join(f"{m['role']}:{m['content']}\x00" for m in prev)
+    b = "".join(f"{m['role']}:{m['content']}\x00" for m in cur)
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n, len(b)
+
+
+def live_call(messages):
+    from dashscope import Generation
+
+    start = time.perf_counter()
+    ttft, usage = None, None
+    for response in Generation.call(model="qwen-turbo", messages=messages, result_format="message",
+                                    stream=True, incremental_output=True):
+        if ttft is None and response.output and response.output.choices[0]["message"]["content"]:
+            ttft = time.perf_counter() - start
+        usage = response.usage or usage
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return ttft, (usage or {}).get("input_tokens", 0), details.get("cached_tokens", 0)
+
+
+def bench(name, text, live):
+    system_instruction = default_system_instruction()
+    print(f"\n== {name}: {len(text):,} chars")
+    for label, layout in (("old", old_layout), ("prefix", new_layout)):
+        history, prev = [], None
+        for i, question in enumerate(QUESTIONS):
+            messages = layout(system_instruction, text, history, question)
+            line = f"  {label:<6} turn {i + 1}"
+            if prev is not None:
+                shared, total = shared_prefix_chars(prev, messages)
+                line += f"  reusable prefix {shared / total:6.1%} of {total:,} chars"
+            if live:
+                ttft, input_tokens, cached = live_call(messages)
+                line += f"  | ttft {ttft:.2f}s  input {input_tokens:,}  cached {cached:,}"
+            print(line)
+            history = history + [{"role": "user", "content": question}, {"role": "assistant", "content": ANSWER}]
+            prev = messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--synthetic-pages", type=int, default=4)
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+    if args.live:
+        import dashscope
+
+        dashscope.api_key = os.environ["DASHSCOPE_API_KEY"]
+
+    if args.pdfs:
+        for path in args.pdfs:
+            bench(os.path.basename(path), load_pdf_text(path), args.live)
+    else:
+        bench(f"synthetic {args.synthetic_pages} pages", synthetic_paper(args.synthetic_pages), args.live)
+
+
+if __name__ == "__main__":
+    main()
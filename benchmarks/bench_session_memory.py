@@ -0,0 +1,124 @@
+"""
+多会话内存基准：每个会话各存一份 vs 内存账本（共享 + 空闲会话写盘）
+
+用法：
+    python benchmarks/bench_session_memory.py --sessions 50 --papers 5 --synthetic-pages 40
+    python benchmarks/bench_session_memory.py paper.pdf --sessions 50
+
+模拟 N 个会话打开 M 篇论文（轮流分配），每个会话保存全文、检索索引、概览和若干轮对话。
+用 tracemalloc 统计两种方式下的进程内存峰值与最终占用；账本模式下把上限设为 --budget-mb，
+并让除最后 --active 个以外的会话进入空闲状态，观察驱逐后的占用与会话恢复耗时。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chat_context import load_pdf_text, synthetic_paper  # noqa: E402
+from chunking import split_text_into_chunks  # noqa: E402
+from retrieval import BM25Index  # noqa: E402
+from session_memory import MemoryAccountant  # noqa: E402
+
+PRIVATE_KEYS = ("chat_history", "paper_summary")
+SHARED_KEYS = ("raw_text", "paper_index")
+MB = 1024 * 1024
+IDLE_SECONDS = 0.5
+
+
+class FakeSessionState(dict):
+    """代替 Streamlit 的 SessionState（账本只保存弱引用，普通 dict 不支持）"""
+
+
+def build_index(text):
+    return BM25Index(split_text_into_chunks(text, max_tokens=400, overlap_tokens=50))
+
+
+def fill_private(state, i):
+    state["paper_summary"] = f"（会话 {i} 的概览）" + "概览内容 " * 800
+    state["chat_history"] = [{"role": "user" if t % 2 == 0 else "assistant", "content": f"第 {t} 轮 " * 300}
+                             for t in range(10)]
+
+
+def run_copies(texts, n_sessions):
+    """旧方式：每个会话自己解析、自己建索引"""
+    sessions = []
+    for i in range(n_sessions):
+        state = FakeSessionState()
+        text = texts[i % len(texts)]
+        state["raw_text"] = "".join(text)  # 每个会话各自解析出一份新字符串
+        state["paper_index"] = build_index(state["raw_text"])
+        fill_private(state, i)
+        sessions.append(state)
+    return sessions, None
+
+
+def run_accountant(texts, n_sessions, budget_mb, active):
+    accountant = MemoryAccountant(tempfile.mkdtemp(prefix="bench_memory_"), budget_mb * MB, idle_seconds=IDLE_SECONDS)
+    sessions = []
+    for i in range(n_sessions):
+        state = FakeSessionState()
+        sid = f"s{i}"
+        accountant.checkin(sid, state, PRIVATE_KEYS, SHARED_KEYS)
+        paper = i % len(texts)
+        state["raw_text"] = accountant.shared("text", paper, lambda: "".join(texts[paper]), sid)
+        state["paper_index"] = accountant.shared("index", paper, lambda: build_index(state["raw_text"]), sid)
+        fill_private(state, i)
+        sessions.append(state)
+    # 所有会话先空闲一段时间，最近活跃的几个会话再运行一次：登记私有占用，超出上限时驱逐其余空闲会话
+    time.sleep(IDLE_SECONDS * 1.2)
+    for i in range(max(0, n_sessions - active), n_sessions):
+        accountant.checkin(f"s{i}", sessions[i], PRIVATE_KEYS, SHARED_KEYS)
+    return sessions, accountant
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    sessions, accountant = fn(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sessions, accountant, current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--papers", type=int, default=5, help="合成论文篇数（不传 PDF 时）")
+    parser.add_argument("--synthetic-pages", type=int, default=40)
+    parser.add_argument("--budget-mb", type=int, default=16)
+    parser.add_argument("--active", type=int, default=5, help="保持活跃（不会被驱逐）的会话数")
+    args = parser.parse_args()
+
+    if args.pdfs:
+        texts = [load_pdf_text(path) for path in args.pdfs]
+    else:
+        texts = [synthetic_paper(args.synthetic_pages, seed=i) for i in range(args.papers)]
+    print(f"{args.sessions} sessions over {len(texts)} papers "
+          f"({sum(len(t) for t in texts) / len(texts):,.0f} chars each on average)")
+
+    _, _, current, peak, elapsed = measure(run_copies, texts, args.sessions)
+    print(f"  per-session copies  retained {current / MB:7.1f} MB  peak {peak / MB:7.1f} MB  setup {elapsed:5.1f}s")
+
+    sessions, accountant, current, peak, elapsed = measure(
+        run_accountant, texts, args.sessions, args.budget_mb, args.active
+    )
+    stats = accountant.stats()
+    print(f"  accountant          retained {current / MB:7.1f} MB  peak {peak / MB:7.1f} MB  setup {elapsed:5.1f}s  "
+          f"(accounted {stats['total_bytes'] / MB:.1f} MB, budget {args.budget_mb} MB, "
+          f"{stats['spilled_sessions']} sessions / {stats['spilled_objects']} shared objects spilled)")
+
+    # 被驱逐的会话回来时的恢复耗时
+    start = time.perf_counter()
+    accountant.checkin("s0", sessions[0], PRIVATE_KEYS, SHARED_KEYS)
+    restored = all(k in sessions[0] for k in PRIVATE_KEYS + SHARED_KEYS)
+    print(f"  restore idle session: {(time.perf_counter() - start) * 1000:.1f} ms (complete: {restored})")
+
+
+if __name__ == "__main__":
+    main()
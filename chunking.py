@@ -0,0 +1,174 @@
+"""
+长文本处理工具：分片切分与 Token 估算
+"""
+import re
+
+_CJK_RE = re.compile(r'[一-龥]')
+
+# 切分单元：到句末标点、英文句点（后接空白）、换行或文本末尾为止
+_UNIT_RE = re.compile(r'.*?(?:[。！？；!?;]+[”’"\')\]）】]*|\.(?=\s)|\n|\Z)', re.S)
+_SENTENCE_END_RE = re.compile(r'[。！？；!?;.][”’"\')\]）】]*\s*$')
+# 章节标题行：编号标题、罗马数字标题、常见英文章节名、中文章节名
+_HEADING_RE = re.compile(
+    r'\s*(?:\d+(?:\.\d+)*\.?\s+\S'
+    r'|[IVX]+\.\s+\S'
+    r'|(?=[A-Z])(?i:abstract|introduction|related work|background|methods?|methodology|approach'
+    r'|experiments?|evaluation|results|discussion|conclusions?|references|bibliography'
+    r'|acknowledge?ments?|appendix)\b'
+    r'|摘\s*要|引\s*言|结\s*论|参考文献|致\s*谢|附\s*录|第[一二三四五六七八九十\d]+[章节])'
+)
+_HEADING_MAX_LEN = 80
+
+# 切分点优先级：章节 > 段落/句末换行 > 句内标点 > 普通折行
+_SCORE_SECTION, _SCORE_PARAGRAPH, _SCORE_SENTENCE, _SCORE_NONE = 3, 2, 1, 0
+
+
+# 估算权重用整数计：中文每字 14、其余字符每个 5（即 0.7 与 0.25 token 的 20 倍），
+# 切分时累加、比较都没有浮点误差，分片的估算值与 estimate_tokens 完全一致
+_WEIGHT_SCALE = 20
+_CJK_UNITS = 14
+_OTHER_UNITS = 5
+
+
+def _token_weight(text):
+    cjk = len(_CJK_RE.findall(text))
+    return cjk * _CJK_UNITS + (len(text) - cjk) * _OTHER_UNITS
+
+
+def estimate_tokens(text):
+    """
+    粗略估算 Qwen 系列模型的 Token 数（无需加载分词器）：
+    中文约 0.7 token/字，其余字符约 4 字符/token
+    """
+    if not text:
+        return 0
+    return _token_weight(text) // _WEIGHT_SCALE + 1
+
+
+def _hard_cut(text, s, e, budget):
+    """把超出预算的单元按累计权重逐字切开，每段权重都小于 budget，返回 [(起点, 终点), ...]"""
+    pieces, ps, acc = [], s, 0
+    for pos in range(s, e):
+        w = _CJK_UNITS if "一" <= text[pos] <= "龥" else _OTHER_UNITS
+        if acc + w >= budget and pos > ps:
+            pieces.append((ps, pos))
+            ps, acc = pos, 0
+        acc += w
+    pieces.append((ps, e))
+    return pieces
+
+
+def _split_units(text, budget):
+    """
+    把文本切成首尾相接的最小单元，返回 (起点列表, 终点列表, 权重列表, 边界得分列表)。
+    score[k] 表示第 k 个单元之后切开的优先级。权重达到 budget 的单个单元（如超长公式行）按累计权重硬切。
+    """
+    starts, ends, weights, scores = [], [], [], []
+    for m in _UNIT_RE.finditer(text):
+        s, e = m.span()
+        if s == e:
+            if e >= len(text):
+                break
+            continue
+        unit = text[s:e]
+        weight = _token_weight(unit)
+
+        if unit.endswith("\n"):
+            # 空行（段落）或句末恰好换行，视为段落边界；句中折行不宜切开
+            if unit.strip() == "" or _SENTENCE_END_RE.search(unit):
+                score = _SCORE_PARAGRAPH
+            else:
+                score = _SCORE_NONE
+            # 标题行须紧跟在段落边界之后，避免把句中折行误判为标题
+            line_end = text.find("\n", e)
+            line_len = (line_end if line_end != -1 else len(text)) - e
+            if score == _SCORE_PARAGRAPH and line_len <= _HEADING_MAX_LEN and _HEADING_RE.match(text, e):
+                score = _SCORE_SECTION
+        else:
+            score = _SCORE_SENTENCE if _SENTENCE_END_RE.search(unit) else _SCORE_NONE
+
+        if weight >= budget:
+            # 中英文混排时权重在字符间分布不均，按字符数等分会超预算；中间的切点不带任何优先级
+            for ps, pe in _hard_cut(text, s, e, budget):
+                starts.append(ps)
+                ends.append(pe)
+                weights.append(_token_weight(text[ps:pe]))
+                scores.append(score if pe == e else _SCORE_NONE)
+        else:
+            starts.append(s)
+            ends.append(e)
+            weights.append(weight)
+            scores.append(score)
+    return starts, ends, weights, scores
+
+
+def split_text_into_spans(text, max_tokens=1200, overlap_tokens=150, min_fill=0.6):
+    """
+    按模型 Token 预算切分，返回 [(start, end), ...] 字符区间。
+
+    - 每片的 estimate_tokens 不超过 max_tokens，优先在章节、段落、句子边界处切开，
+      只在预算的 min_fill 之后寻找切点，保证分片足够“满”
+    - 相邻分片重叠约 overlap_tokens，重叠部分也从完整单元开始
+    - 双指针 + 前缀和，整体线性时间；无论 overlap 取何值都保证向前推进
+    """
+    if not text:
+        return []
+    max_tokens = max(1, max_tokens)
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+
+    # 以下都用整数权重：一片的权重小于 budget 当且仅当它的 estimate_tokens 不超过 max_tokens
+    budget = max_tokens * _WEIGHT_SCALE
+    overlap = overlap_tokens * _WEIGHT_SCALE
+    starts, ends, weights, scores = _split_units(text, budget)
+    n = len(weights)
+    prefix = [0] * (n + 1)
+    for k, w in enumerate(weights):
+        prefix[k + 1] = prefix[k] + w
+
+    spans = []
+    i, j = 0, 0
+    while i < n:
+        # 1. 从 i 出发尽量向后扩，找到不超预算的最远位置 j（j 只增不减）
+        j = max(j, i + 1)
+        while j < n and prefix[j + 1] - prefix[i] < budget:
+            j += 1
+        if j >= n:
+            spans.append((starts[i], ends[n - 1]))
+            break
+
+        # 2. 在 [min_fill, 满额] 范围内挑优先级最高、位置最靠后的切点
+        cut, best = j, -1
+        floor = prefix[i] + budget * min_fill
+        for b in range(j, i, -1):
+            if prefix[b] < floor:
+                break
+            if scores[b - 1] > best:
+                cut, best = b, scores[b - 1]
+                if best == _SCORE_SECTION:
+                    break
+        spans.append((starts[i], ends[cut - 1]))
+
+        # 3. 回退 overlap_tokens 作为下一片的起点，但必须严格前进，且给切点后的单元留出位置
+        #    （否则紧跟着一个接近满额的单元时，下一片只剩重叠部分，与本片完全重复）
+        k, room = cut, budget - weights[cut]
+        while k > i + 1 and prefix[cut] - prefix[k - 1] <= overlap and prefix[cut] - prefix[k - 1] < room:
+            k -= 1
+        i = max(k, i + 1)
+    return spans
+
+
+def split_text_into_chunks(text, max_tokens=1200, overlap_tokens=150):
+    """
+    结构感知的分片函数（按 Token 预算，尽量在章节/段落/句子边界切开）
+    max_tokens: 每个分片的 Token 上限（估算值）
+    overlap_tokens: 相邻分片的重叠量，防止上下文在切分处断裂
+    """
+    return [text[s:e] for s, e in split_text_into_spans(text, max_tokens, overlap_tokens)]
+
+
+def truncate_to_tokens(text, max_tokens):
+    """截取不超过 max_tokens（估算值）的前缀，尽量在章节/段落/句子边界处截断"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    spans = split_text_into_spans(text, max(1, max_tokens), overlap_tokens=0)
+    return text[:spans[0][1]] if spans else ""
@@ -0,0 +1,426 @@
+"""
+Mermaid flowchart 本地校验与自动修复
+
+模型生成的导图常见几类语法错误：ID 用了中文或保留字（end）、标签里的引号和括号不成对、
+未加引号的标签里出现括号、用了全角括号或 "->"、"→" 之类 Mermaid 不认识的箭头。
+这些错误以前要到浏览器渲染时才暴露，用户只能再点一次、再付一次完整调用的费用。
+
+这里按 flowchart 语法逐条解析语句，能确定原意的地方直接改写成规范形式：
+- 节点一律写成 ID["标签"]（保留原来的形状），标签里的双引号转义为 #quot;
+- 不合法的 ID 换成 N1、N2…，原 ID 作为标签；同一个 ID 在全图中映射一致
+- 未闭合的引号、括号在语句末尾补齐；多余的 end 删除，缺少的 end 补在末尾
+- 全角括号、Unicode 箭头、单横线箭头换成 Mermaid 语法
+解析不了的语句原样保留并报告，由调用方决定是否让模型定向修正，或者直接删掉（drop_invalid）。
+只处理 flowchart / graph，其他图类型原样返回。
+"""
+import re
+
+DIRECTIONS = ("TD", "TB", "BT", "LR", "RL")
+# 作为节点 ID 会让 Mermaid 解析出错的关键字（小写比较）
+RESERVED_IDS = {"end", "graph", "flowchart", "subgraph", "direction", "style", "classdef", "class", "click",
+                "linkstyle", "default"}
+# 独占一行、原样保留的语句
+PASSTHROUGH_KEYWORDS = ("classDef", "class", "style", "linkStyle", "click")
+OTHER_DIAGRAMS = ("sequenceDiagram", "stateDiagram", "classDiagram", "erDiagram", "journey", "gantt", "pie",
+                  "mindmap", "timeline", "gitGraph", "quadrantChart")
+
+# 节点形状：开括号 -> 可接受的闭括号（较长的写法在前，优先匹配）
+SHAPES = (
+    ("(((", (")))",)), ("([", ("])",)), ("[[", ("]]",)), ("[(", (")]",)), ("((", ("))",)), ("{{", ("}}",)),
+    ("[/", ("/]", "\\]")), ("[\\", ("\\]", "/]")), ("[", ("]",)), ("(", (")",)), ("{", ("}",)), (">", ("]",)),
+)
+_OPEN_BRACKETS = "[({"
+_CLOSE_BRACKETS = "])}"
+
+# 全角符号在结构位置上按半角处理；逐字符映射，长度不变，解析用的影子串与原文下标一一对应
+_FULLWIDTH = str.maketrans({
+    "【": "[", "】": "]", "［": "[", "］": "]", "（": "(", "）": ")", "｛": "{", "｝": "}",
+    "“": '"', "”": '"', "＂": '"', "｜": "|", "；": ";",
+})
+
+_VALID_ID_RE = re.compile(r"[A-Za-z0-9_]+")
+_HEADER_RE = re.compile(r"(flowchart|graph)\b[ \t]*([A-Za-z]*)", re.I)
+_LINK_RE = re.compile(r"<?(?:-{2,}>|-{3,}|-\.+->|-\.+-|={2,}>|={3,}|~{3,}|-{2,}[ox](?=\s))")
+# 带文字的连线：-- 文字 -->、-. 文字 .->、== 文字 ==>
+_TEXT_LINK_RE = re.compile(r"(--|-\.|==)[ \t]+([^\n]*?)[ \t]+(-{2,}>|-{3,}|\.-+>|\.-+|={2,}>|={3,})")
+# Mermaid 不认识、但意思明确的箭头
+_BAD_LINK_RE = re.compile(r"→|⟶|⇒|⟹|—+>|－+>|=>|->")
+_EDGE_LABEL_RE = re.compile(r"[ \t]*\|([^|\n]*)\|")
+_CLASS_SUFFIX_RE = re.compile(r":::[A-Za-z0-9_-]+")
+_TEXT_LINK_CANONICAL = {"--": "-->", "-.": "-.->", "==": "==>"}
+
+MAX_LABEL_LINE = 12
+
+
+def wrap_text(text, max_len=MAX_LABEL_LINE):
+    """自动为长文本添加换行符"""
+    if not text:
+        return text
+    # 按最大长度分割文本
+    lines = []
+    current_line = ""
+    for char in text:
+        current_line += char
+        if len(current_line) >= max_len:
+            lines.append(current_line)
+            current_line = ""
+    if current_line:
+        lines.append(current_line)
+    return "<br/>".join(lines)
+
+
+def _label(text, wrap=True):
+    """规范化标签：去掉一层包裹的引号，未手动换行的长标签自动换行，双引号转义"""
+    text = text.replace("#quot;", '"').strip()
+    # 只去掉一层包裹的引号（或一端落单的引号）；标签内容本身首尾的引号保留，重复修复时结果不变
+    if len(text) >= 2 and text[0] in '"“' and text[-1] in '"”':
+        text = text[1:-1].strip()
+    elif sum(text.count(q) for q in '"“”') % 2:
+        if text[:1] in '"“':
+            text = text[1:].strip()
+        elif text[-1:] in '"”':
+            text = text[:-1].strip()
+    if wrap and "<br" not in text:
+        text = wrap_text(text)
+    return text.replace('"', "#quot;")
+
+
+def _match_link(shadow, pos):
+    """pos 处的连线，返回 (结束位置, 规范写法, 连线文字或 None, 是否改写过)；不是连线时返回 None"""
+    m = _LINK_RE.match(shadow, pos)
+    if m:
+        link, end, text = m.group(0), m.end(), None
+        label = _EDGE_LABEL_RE.match(shadow, end)
+        if label:
+            text, end = label.group(1), label.end()
+        return end, link, text, False
+    m = _TEXT_LINK_RE.match(shadow, pos)
+    if m:
+        return m.end(), _TEXT_LINK_CANONICAL[m.group(1)], m.group(2), True
+    m = _BAD_LINK_RE.match(shadow, pos)
+    if m:
+        link, end, text = ("==>" if m.group(0) in ("=>", "⇒", "⟹") else "-->"), m.end(), None
+        label = _EDGE_LABEL_RE.match(shadow, end)
+        if label:
+            text, end = label.group(1), label.end()
+        return end, link, text, True
+    return None
+
+
+def _skip_spaces(shadow, pos):
+    while pos < len(shadow) and shadow[pos] in " \t":
+        pos += 1
+    return pos
+
+
+class _Repairer:
+    def __init__(self, code):
+        # 新 ID 要避开代码里已经出现过的同名 ID（包括后面才出现的）
+        self.taken = set(re.findall(r"[A-Za-z]\w*", code))
+        self.ids = {}         # 原 ID -> 规范 ID
+        self.labeled = set()  # 已经写出过标签的规范 ID
+        self.fixes = []
+        self.errors = []
+        self.nodes = 0
+        self._next_id = 0
+
+    def checkpoint(self):
+        return dict(self.ids), set(self.labeled), set(self.taken), len(self.fixes), self.nodes, self._next_id
+
+    def rollback(self, checkpoint):
+        """语句解析失败时撤销这条语句造成的 ID 映射与修复记录"""
+        ids, labeled, taken, n_fixes, self.nodes, self._next_id = checkpoint
+        self.ids, self.labeled, self.taken = ids, labeled, taken
+        del self.fixes[n_fixes:]
+
+    def fix(self, line_no, what):
+        self.fixes.append(f"第 {line_no} 行：{what}")
+
+    def _new_id(self, prefix="N"):
+        while True:
+            self._next_id += 1
+            new_id = f"{prefix}{self._next_id}"
+            if new_id not in self.taken:
+                self.taken.add(new_id)
+                return new_id
+
+    def canonical_id(self, raw_id, line_no):
+        """合法 ID 原样返回；否则映射成 N1、N2…（同一个原 ID 映射到同一个新 ID）"""
+        if raw_id in self.ids:
+            return self.ids[raw_id]
+        if _VALID_ID_RE.fullmatch(raw_id) and raw_id.lower() not in RESERVED_IDS:
+            self.ids[raw_id] = raw_id
+        else:
+            self.ids[raw_id] = self._new_id()
+            self.fix(line_no, f"节点 ID “{raw_id}” 不合法，改为 {self.ids[raw_id]}")
+        return self.ids[raw_id]
+
+    # --- 节点 ---
+
+    def parse_shape(self, text, shadow, pos, line_no):
+        """pos 处的形状与标签，返回 (结束位置, 开括号, 闭括号, 标签)；没有形状时返回 None"""
+        for opener, closers in SHAPES:
+            if shadow.startswith(opener, pos):
+                break
+        else:
+            return None
+        start = pos + len(opener)
+        content = _skip_spaces(shadow, start)
+        if content < len(shadow) and shadow[content] == '"':
+            # 带引号的标签：到 “引号 + 闭括号” 为止，中间的引号都算标签内容
+            best = None
+            for closer in closers:
+                m = re.compile(r'"[ \t]*' + re.escape(closer)).search(shadow, content + 1)
+                if m and (best is None or m.start() < best[0]):
+                    best = (m.start(), m.end(), closer)
+            if best:
+                return best[1], opener, best[2], text[content + 1:best[0]]
+            # 引号没有闭合：退回按括号匹配，去掉落单的引号
+            found = self._find_closer(shadow, content + 1, closers)
+            if found:
+                self.fix(line_no, "补齐标签的引号")
+                return found[1], opener, found[2], text[content + 1:found[0]]
+            self.fix(line_no, "补齐标签的引号和括号")
+            end = self._label_end(shadow, content + 1)
+            return end, opener, closers[0], text[content + 1:end]
+        found = self._find_closer(shadow, start, closers)
+        if found:
+            return found[1], opener, found[2], text[start:found[0]]
+        self.fix(line_no, f"补齐未闭合的 “{opener}”")
+        end = self._label_end(shadow, start)
+        return end, opener, closers[0], text[start:end]
+
+    @staticmethod
+    def _find_closer(shadow, pos, closers):
+        """不带引号的标签：跳过成对的内层括号，找到第一个闭括号，返回 (标签结束, 形状结束, 闭括号)"""
+        depth = 0
+        while pos < len(shadow):
+            if depth == 0:
+                for closer in closers:
+                    if shadow.startswith(closer, pos):
+                        return pos, pos + len(closer), closer
+            char = shadow[pos]
+            if char in _OPEN_BRACKETS:
+                depth += 1
+            elif char in _CLOSE_BRACKETS:
+                depth = max(0, depth - 1)
+            pos += 1
+        return None
+
+    @staticmethod
+    def _label_end(shadow, pos):
+        """括号没有闭合时，标签到下一个连线（前面有空白）或语句结尾为止"""
+        end = pos
+        while end < len(shadow) and shadow[end] != ";":
+            if shadow[end] in " \t" and _match_link(shadow, _skip_spaces(shadow, end)):
+                break
+            end += 1
+        return end
+
+    def parse_node(self, text, shadow, pos, line_no):
+        """pos 处的一个节点，返回 (结束位置, 规范写法)；不是节点时返回 None"""
+        pos = _skip_spaces(shadow, pos)
+        start = pos
+        while (pos < len(shadow) and shadow[pos] not in ' \t[](){}>"&;|' and not shadow.startswith(":::", pos)
+               and not _match_link(shadow, pos)):
+            pos += 1
+        raw_id = text[start:pos]
+        shape_pos = _skip_spaces(shadow, pos)
+        shape = self.parse_shape(text, shadow, shape_pos, line_no)
+        if not raw_id and shape is None:
+            return None
+        if not raw_id:
+            node_id = self._new_id()
+            self.fix(line_no, f"节点缺少 ID，补为 {node_id}")
+        else:
+            node_id = self.canonical_id(raw_id, line_no)
+        self.nodes += 1
+        if shape is not None:
+            pos, opener, closer, label = shape
+            node = f'{node_id}{opener}"{_label(label)}"{closer}'
+            self.labeled.add(node_id)
+        elif node_id != raw_id and node_id not in self.labeled:
+            # 换了 ID 的节点第一次出现时把原 ID 写成标签，显示的文字不变
+            node = f'{node_id}["{_label(raw_id)}"]'
+            self.labeled.add(node_id)
+        else:
+            node = node_id
+        suffix = _CLASS_SUFFIX_RE.match(shadow, pos)
+        if suffix:
+            node += suffix.group(0)
+            pos = suffix.end()
+        return pos, node
+
+    def parse_group(self, text, shadow, pos, line_no):
+        """A & B & C"""
+        parsed = self.parse_node(text, shadow, pos, line_no)
+        if parsed is None:
+            return None
+        pos, node = parsed
+        nodes = [node]
+        while True:
+            amp = _skip_spaces(shadow, pos)
+            if amp < len(shadow) and shadow[amp] == "&":
+                parsed = self.parse_node(text, shadow, amp + 1, line_no)
+                if parsed is None:
+                    return None
+                pos, node = parsed
+                nodes.append(node)
+            else:
+                return pos, " & ".join(nodes)
+
+    def parse_chain(self, text, shadow, pos, line_no):
+        """节点（组）与连线交替出现的一条语句，返回 (结束位置, 规范写法)；解析失败返回 None"""
+        parsed = self.parse_group(text, shadow, pos, line_no)
+        if parsed is None:
+            return None
+        pos, out = parsed
+        while True:
+            pos = _skip_spaces(shadow, pos)
+            if pos >= len(shadow) or shadow[pos] == ";":
+                return pos, out
+            link = _match_link(shadow, pos)
+            if link is None:
+                return None
+            start, (pos, arrow, link_text, rewritten) = pos, link
+            if rewritten:
+                self.fix(line_no, f"连线 “{text[start:pos].strip()}” 改为 {arrow}")
+            parsed = self.parse_group(text, shadow, pos, line_no)
+            if parsed is None:
+                return None
+            pos, group = parsed
+            label = f'|"{_label(link_text, wrap=False)}"|' if link_text and link_text.strip() else ""
+            out += f" {arrow}{label} {group}"
+
+
+def _split_keyword(statement):
+    word = statement.split(None, 1)[0] if statement.split() else ""
+    return word, statement[len(word):].strip()
+
+
+def repair_flowchart(code, drop_invalid=False):
+    """
+    校验并修复 flowchart 代码，返回 (代码, 修复说明列表, 无法修复的问题列表)。
+    无法解析的语句默认原样保留并记入问题列表；drop_invalid=True 时直接删除（记入修复说明）。
+    不是 flowchart / graph 的图原样返回，两个列表都为空
+    """
+    code = code or ""
+    repairer = _Repairer(code)
+    out, header, depth = [], None, 0
+
+    for line_no, line in enumerate(code.splitlines(), 1):
+        text = line.strip()
+        if not text:
+            continue
+        if text.startswith("%%"):
+            out.append(text)
+            continue
+        word, rest = _split_keyword(text)
+        if header is None:
+            if word in OTHER_DIAGRAMS or word.rstrip(":") in OTHER_DIAGRAMS:
+                return code, [], []
+            m = _HEADER_RE.match(text)
+            if m:
+                direction = m.group(2).upper()
+                if direction not in DIRECTIONS:
+                    repairer.fix(line_no, f"图方向 “{m.group(2)}” 不合法，改为 TD")
+                    direction = "TD"
+                header = f"flowchart {direction}"
+                out.append(header)
+                text = text[m.end():].lstrip(" \t;")
+                if not text:
+                    continue
+                word, rest = _split_keyword(text)
+            else:
+                header = "flowchart TD"
+                out.append(header)
+                repairer.fix(line_no, "缺少 flowchart 声明，已补上")
+        elif _HEADER_RE.fullmatch(text.rstrip(";")):
+            repairer.fix(line_no, "删除重复的图声明")
+            continue
+
+        if word in PASSTHROUGH_KEYWORDS and rest:
+            out.append(text)
+            continue
+        if word == "direction" and rest.upper().rstrip(";") in DIRECTIONS:
+            out.append(f"direction {rest.upper().rstrip(';')}")
+            continue
+        if word.lower().rstrip(";") == "end" and not rest:
+            if depth == 0:
+                repairer.fix(line_no, "删除多余的 end")
+                continue
+            depth -= 1
+            out.append("end")
+            continue
+        if word == "subgraph":
+            out.append(_subgraph(repairer, rest, line_no))
+            depth += 1
+            continue
+
+        shadow = text.translate(_FULLWIDTH)
+        checkpoint = repairer.checkpoint()
+        pos, statements = 0, []
+        while pos < len(shadow):
+            pos = _skip_spaces(shadow, pos)
+            if pos < len(shadow) and shadow[pos] == ";":
+                pos += 1
+                continue
+            if pos >= len(shadow):
+                break
+            parsed = repairer.parse_chain(text, shadow, pos, line_no)
+            if parsed is None:
+                statements = None
+                break
+            pos, statement = parsed
+            statements.append(statement)
+        if statements is None:
+            repairer.rollback(checkpoint)
+            if drop_invalid:
+                repairer.fix(line_no, f"删除无法解析的语句 “{text[:40]}”")
+            else:
+                repairer.errors.append(f"第 {line_no} 行无法解析：{text}")
+                out.append(text)
+            continue
+        out.extend(statements)
+
+    if header is None:
+        return code, [], []
+    if depth:
+        repairer.fixes.append(f"补上 {depth} 个缺少的 end")
+        out.extend(["end"] * depth)
+    if not repairer.nodes:
+        repairer.errors.append("图中没有任何节点")
+    return "\n".join(_indent(out)), repairer.fixes, repairer.errors
+
+
+def _subgraph(repairer, rest, line_no):
+    """subgraph 行：subgraph ID、subgraph ID[标题]，或直接跟一段标题文字"""
+    rest = rest.rstrip(";").strip()
+    if not rest:
+        sub_id = repairer._new_id("S")
+        repairer.fix(line_no, f"subgraph 缺少 ID，补为 {sub_id}")
+        return f"subgraph {sub_id}"
+    shadow = rest.translate(_FULLWIDTH)
+    m = _VALID_ID_RE.match(shadow)
+    if m and m.group(0).lower() not in RESERVED_IDS:
+        shape = repairer.parse_shape(rest, shadow, _skip_spaces(shadow, m.end()), line_no)
+        end = m.end() if shape is None else shape[0]
+        if _skip_spaces(shadow, end) == len(shadow):
+            if shape is None:
+                return f"subgraph {m.group(0)}"
+            return f'subgraph {m.group(0)}["{_label(shape[3], wrap=False)}"]'
+    # 标题里有空格、中文或括号：换一个合法 ID，原文作为标题
+    sub_id = repairer._new_id("S")
+    repairer.fix(line_no, f"subgraph 标题 “{rest}” 改为 {sub_id}[\"…\"]")
+    return f'subgraph {sub_id}["{_label(rest, wrap=False)}"]'
+
+
+def _indent(lines):
+    """子图内的语句按层级缩进，便于阅读"""
+    depth = 0
+    for line in lines:
+        if line == "end":
+            depth = max(0, depth - 1)
+        yield line if line.startswith("flowchart ") else "    " * (depth + 1) + line
+        if line.startswith("subgraph "):
+            depth += 1
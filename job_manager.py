@@ -0,0 +1,168 @@
+"""
+进程级后台任务：长耗时操作不再跑在 Streamlit 脚本线程里
+
+页面上任何一次控件交互都会重跑脚本，脚本线程里跑了几分钟的摘要会被打断或重复执行。
+这里把概览、导图、术语/实验数据提取等操作交给后台工作线程：
+
+- 任务以 key（论文指纹 + 任务类型 + 版本）去重：相同任务在途时直接复用，不会重复提交
+- 页面每次重跑只读取任务状态与进度（Job.snapshot），结果就绪后再放进会话状态
+- 取消是协作式的：任务函数通过 job.report 汇报进度时检查取消标记并抛出 JobCancelled；
+  排队中还没开始的任务直接撤销
+- 已结束的任务保留 JOB_RETENTION_SECONDS 秒，期间其他会话提交相同任务可直接拿到结果
+"""
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("paperagent.jobs")
+
+JOB_RETENTION_SECONDS = 600
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (PENDING, RUNNING)
+
+_job_ids = itertools.count(1)
+
+
+class JobCancelled(Exception):
+    """任务被取消：由 Job.report / Job.check_cancelled 在任务线程里抛出"""
+
+
+class Job:
+    def __init__(self, key, fn, args, kwargs):
+        self.id = f"job-{next(_job_ids)}"
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = PENDING
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATES
+
+    def report(self, stage, done, total):
+        """任务函数汇报进度；任务已被取消时抛出 JobCancelled"""
+        with self._lock:
+            self.stage, self.done, self.total = stage, done, total
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "key": self.key,
+                "status": self.status,
+                "stage": self.stage,
+                "done": self.done,
+                "total": self.total,
+                "error": self.error,
+                "elapsed": (self.finished_at or time.time()) - (self.started_at or time.time()),
+                "cancelling": self._cancel.is_set() and self.active,
+            }
+
+    def _run(self):
+        with self._lock:
+            if self._cancel.is_set():
+                self.status, self.finished_at = CANCELLED, time.time()
+                return
+            self.status, self.started_at = RUNNING, time.time()
+        try:
+            result = self.fn(self, *self.args, **self.kwargs)
+        except JobCancelled:
+            status, result, error = CANCELLED, None, None
+            logger.info("job %s (%s) cancelled", self.id, self.key)
+        except Exception as e:
+            status, result, error = FAILED, None, str(e)
+            logger.exception("job %s (%s) failed", self.id, self.key)
+        else:
+            status, error = DONE, None
+        with self._lock:
+            self.status, self.result, self.error, self.finished_at = status, result, error, time.time()
+
+
+class JobManager:
+    """
+    有界线程池 + 任务表。fn 的第一个参数是 Job 本身，用来汇报进度和检查取消；
+    fn 运行在工作线程里，不能调用任何 st.* 接口。
+    """
+
+    def __init__(self, max_workers=2, retention=JOB_RETENTION_SECONDS):
+        self.retention = retention
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="paperagent-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_key = {}
+
+    def submit(self, key, fn, *args, **kwargs):
+        """提交任务；相同 key 的任务在途或刚完成时直接返回已有任务（失败/取消的会重新提交）"""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(self._by_key.get(key))
+            if job is not None and job.status in (PENDING, RUNNING, DONE):
+                return job
+            return self._start(Job(key, fn, args, kwargs))
+
+    def restart(self, job_id):
+        """取消旧任务（如果还在跑）并以相同参数重新提交，返回新任务"""
+        old = self.get(job_id)
+        if old is None:
+            return None
+        self.cancel(job_id)
+        with self._lock:
+            return self._start(Job(old.key, old.fn, old.args, old.kwargs))
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job._cancel.set()
+        # 还在排队的任务直接撤销；已经开始的等它在下一个进度点自行退出
+        if job.future is not None and job.future.cancel():
+            with job._lock:
+                job.status, job.finished_at = CANCELLED, time.time()
+        return True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {state: sum(job.status == state for job in jobs) for state in (PENDING, RUNNING, DONE, FAILED)}
+
+    def _start(self, job):
+        self._jobs[job.id] = job
+        self._by_key[job.key] = job.id
+        job.future = self._pool.submit(job._run)
+        return job
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if not job.active and job.finished_at and now - job.finished_at > self.retention:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) == job_id:
+                    del self._by_key[job.key]
@@ -0,0 +1,527 @@
+"""
+个人文库：读过的论文长期保存，跨论文检索与问答
+
+与 text_store / analysis_store 这类缓存不同，文库里的内容不会被容量淘汰，只在用户移除时删除。
+- library.sqlite3：每篇论文的全文（压缩）、页码索引、研读产物，以及切好的检索段落
+- 倒排索引按段（segment）存成只读文件，检索时用 mmap 映射，不整体读进内存：
+  <seg>.lex 词典 {词: [偏移, 文档频次, 位置偏移]}；<seg>.post 每个词的段落 ID 与词频（uint32）；
+  <seg>.pos 词在段落内的位置（uint32），用于短语检索
+- 每加入一篇论文写一个小段，段数超过 MAX_SEGMENTS 时分层合并，被移除论文的段落在合并时清掉；
+  optimize() 把所有段合并成一个
+- 写操作在 SQLite 的 IMMEDIATE 事务里进行：页面和批处理进程同时写入也会排队，段文件登记与段落入库一起提交；
+  事务回滚时删掉事务内写出的段文件，打开文库时再清掉没有登记的段文件（写入中途进程退出留下的）
+
+检索：BM25 打分（与 retrieval.BM25Index 相同的分词与参数），查询里用引号括起来的部分
+（"..." 或 “...”）作为短语，只返回按原顺序连续出现的段落。
+"""
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+
+from chunking import split_text_into_spans
+from pages import page_range
+from retrieval import tokenize
+
+LIBRARY_DIR = os.environ.get(
+    "PAPERAGENT_LIBRARY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".paperagent_library"),
+)
+# 检索段落的大小：比问答分片更细，跨论文检索时命中更准，送给模型的上下文也更省
+PASSAGE_TOKENS = 300
+PASSAGE_OVERLAP_TOKENS = 30
+# 段数超过这个值时合并最新的几个段（检索要逐段查词典，段太多会变慢）
+MAX_SEGMENTS = 8
+MERGE_FACTOR = 2
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_PHRASE_RE = re.compile(r'"([^"]+)"|“([^”]+)”')
+
+
+def parse_query(query):
+    """查询 -> (全部检索词, 短语列表)；短语是分词后的词序列，引号外的词只参与打分"""
+    phrases = []
+    for m in _PHRASE_RE.finditer(query):
+        terms = tokenize(m.group(1) or m.group(2))
+        if terms:
+            phrases.append(terms)
+    terms = tokenize(_PHRASE_RE.sub(" ", query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return list(dict.fromkeys(terms)), phrases
+
+
+def guess_title(text, fallback=""):
+    """论文标题：正文开头第一行像标题的文字（有一定长度、不是纯数字），找不到时用文件名"""
+    for line in text.splitlines()[:8]:
+        line = line.strip()
+        if 8 <= len(line) <= 200 and not line.replace(".", "").isdigit():
+            return line
+    return os.path.splitext(fallback)[0] or "未命名论文"
+
+
+def _map_uint32(path):
+    """把 uint32 数组文件只读映射进来；映射随 memoryview 的引用一起释放（正在检索的线程仍可安全读取旧段）"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return memoryview(b"").cast("I")
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast("I")
+
+
+class _Segment:
+    def __init__(self, base):
+        with open(base + ".lex", encoding="utf-8") as f:
+            self.lexicon = json.load(f)
+        self.post = _map_uint32(base + ".post")
+        self.pos = _map_uint32(base + ".pos")
+
+    def postings(self, term):
+        """[(段落 ID, 词频, 位置起点)]；位置在 self.pos[起点:起点 + 词频]"""
+        entry = self.lexicon.get(term)
+        if entry is None:
+            return []
+        offset, df, pos_offset = entry
+        out = []
+        for pid, tf in zip(self.post[offset:offset + df], self.post[offset + df:offset + 2 * df]):
+            out.append((pid, tf, pos_offset))
+            pos_offset += tf
+        return out
+
+
+class _Snapshot:
+    """某一版本的索引：各段的映射 + 在库段落的长度；写入提交后下一次检索换成新版本"""
+
+    def __init__(self, generation, segments, lengths):
+        self.generation = generation
+        self.segments = segments
+        self.lengths = lengths  # {段落 ID: 词数}，只含在库的段落
+        self.n = len(lengths)
+        self.avgdl = (sum(lengths.values()) / self.n) if self.n else 0.0
+
+
+def _write_segment(base, postings):
+    """postings: {词: [(段落 ID, [位置...]), ...]}（段落 ID 递增）"""
+    post, pos, lexicon = array("I"), array("I"), {}
+    for term, plist in postings.items():
+        lexicon[term] = [len(post), len(plist), len(pos)]
+        post.extend(pid for pid, _ in plist)
+        post.extend(len(positions) for _, positions in plist)
+        for _, positions in plist:
+            pos.extend(positions)
+    with open(base + ".post", "wb") as f:
+        post.tofile(f)
+    with open(base + ".pos", "wb") as f:
+        pos.tofile(f)
+    tmp = base + ".lex.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(lexicon, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, base + ".lex")
+
+
+class PaperLibrary:
+    """
+    论文文库。add / remove / set_artifacts 写入，search 检索段落，papers / get 浏览。
+    同一进程内的会话共用一个实例；多个进程各自打开同一个目录也是安全的
+    """
+
+    def __init__(self, root=LIBRARY_DIR):
+        self.root = root
+        self.index_dir = os.path.join(root, "index")
+        self.path = os.path.join(root, "library.sqlite3")
+        self._snapshot = None
+        self._segments = {}
+        self._snapshot_lock = threading.Lock()
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS papers (
+                    file_hash TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    pages INTEGER NOT NULL,
+                    chars INTEGER NOT NULL,
+                    text BLOB NOT NULL,
+                    page_starts TEXT NOT NULL,
+                    artifacts TEXT NOT NULL DEFAULT '{}',
+                    added_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS passages (
+                    id INTEGER PRIMARY KEY,
+                    file_hash TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    page_first INTEGER,
+                    page_last INTEGER,
+                    length INTEGER NOT NULL,
+                    text TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_passages_file ON passages(file_hash)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments "
+                "(name TEXT PRIMARY KEY, passages INTEGER NOT NULL, first_pid INTEGER NOT NULL, last_pid INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0), ('next_pid', 0)")
+        self._sweep()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write(self, new_segments=()):
+        """
+        写事务：IMMEDIATE 立即拿到写锁，其他写入者（包括其他进程）排队等待。
+        new_segments: 事务内写出的段名（事务中追加）；回滚或提交失败时删掉这些段文件，不留下没有登记的文件
+        """
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            # WAL 模式下 NORMAL 仍保证崩溃后数据库一致，只是最近一次提交可能丢失；省掉每次提交的 fsync
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._unlink(new_segments)
+                raise
+        finally:
+            conn.close()
+
+    def _sweep(self):
+        """
+        删掉 segments 表里没有登记的段文件（写入中途进程退出、或合并后没来得及删除的旧段）。
+        段文件只在写事务内创建，拿着写锁检查时不会误删其他进程正在写、尚未提交的段
+        """
+        with self._write() as conn:
+            live = {name for name, in conn.execute("SELECT name FROM segments")}
+            for entry in os.listdir(self.index_dir):
+                if entry.split(".", 1)[0] not in live:
+                    try:
+                        os.remove(os.path.join(self.index_dir, entry))
+                    except OSError:
+                        pass
+
+    @staticmethod
+    def _meta(conn, key):
+        return conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _segment_base(self, name):
+        return os.path.join(self.index_dir, name)
+
+    # --- 写入 ---
+
+    def contains(self, file_hash):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM papers WHERE file_hash = ?", (file_hash,)).fetchone() is not None
+
+    def add(self, file_hash, name, text, page_starts=(), regions=None, title=None, artifacts=None):
+        """
+        加入一篇论文，已在库中时返回 False（不重复建索引）。
+        regions: 参与检索的字符区间 [(start, end), ...]（如去掉参考文献的章节），默认全文
+        """
+        if not text.strip():
+            return False
+        spans = []
+        for start, end in regions or [(0, len(text))]:
+            spans.extend((start + s, start + e) for s, e in split_text_into_spans(
+                text[start:end], max_tokens=PASSAGE_TOKENS, overlap_tokens=PASSAGE_OVERLAP_TOKENS))
+
+        stale, written = [], []
+        with self._write(written) as conn:
+            if conn.execute("SELECT 1 FROM papers WHERE file_hash = ?", (file_hash,)).fetchone():
+                return False
+            base_pid = self._meta(conn, "next_pid")
+            generation = self._meta(conn, "generation") + 1
+            rows, postings = [], defaultdict(list)
+            for i, (start, end) in enumerate(spans):
+                pid = base_pid + i
+                terms = tokenize(text[start:end])
+                positions = defaultdict(list)
+                for position, term in enumerate(terms):
+                    positions[term].append(position)
+                for term, plist in positions.items():
+                    postings[term].append((pid, plist))
+                pages = page_range(page_starts, start, end) if page_starts else (None, None)
+                rows.append((pid, file_hash, start, end, pages[0], pages[1], len(terms), text[start:end]))
+
+            segment_name = f"seg_{generation:08d}"
+            written.append(segment_name)
+            _write_segment(self._segment_base(segment_name), postings)
+            now = time.time()
+            conn.execute(
+                "INSERT INTO papers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, name, title or guess_title(text, name), len(page_starts), len(text),
+                 zlib.compress(text.encode("utf-8")), json.dumps(list(page_starts)),
+                 json.dumps(artifacts or {}, ensure_ascii=False), now, now),
+            )
+            conn.executemany("INSERT INTO passages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO segments VALUES (?, ?, ?, ?)",
+                         (segment_name, len(rows), base_pid, base_pid + len(rows) - 1))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'next_pid'", (base_pid + len(rows),))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (generation,))
+            stale = self._merge(conn, generation, self._merge_plan(conn), written)
+        self._unlink(stale)
+        return True
+
+    def remove(self, file_hash):
+        """移出文库；索引里它的段落立即不再返回，段文件中的记录在下次合并时清掉"""
+        with self._write() as conn:
+            deleted = conn.execute("DELETE FROM papers WHERE file_hash = ?", (file_hash,)).rowcount
+            conn.execute("DELETE FROM passages WHERE file_hash = ?", (file_hash,))
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        return bool(deleted)
+
+    def set_artifacts(self, file_hash, **artifacts):
+        """合并保存研读产物（summary / bibtex / terms / experiment / mindmap…），值为 None 的项忽略"""
+        artifacts = {k: v for k, v in artifacts.items() if v}
+        if not artifacts:
+            return False
+        with self._write() as conn:
+            row = conn.execute("SELECT artifacts FROM papers WHERE file_hash = ?", (file_hash,)).fetchone()
+            if row is None:
+                return False
+            merged = {**json.loads(row[0]), **artifacts}
+            conn.execute("UPDATE papers SET artifacts = ?, updated_at = ? WHERE file_hash = ?",
+                         (json.dumps(merged, ensure_ascii=False), time.time(), file_hash))
+        return True
+
+    def optimize(self):
+        """把所有段合并成一个，并清掉已移除论文的记录"""
+        written = []
+        with self._write(written) as conn:
+            generation = self._meta(conn, "generation") + 1
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (generation,))
+            names = [name for name, in conn.execute("SELECT name FROM segments ORDER BY name")]
+            stale = self._merge(conn, generation, names, written)
+        self._unlink(stale)
+
+    @staticmethod
+    def _merge_plan(conn):
+        """
+        段数超过 MAX_SEGMENTS 时要合并的段：从最新的段往前，把不超过已选段总量 MERGE_FACTOR 倍的段都并进来。
+        大段很少被重写（分层合并），入库的总开销随论文数近似线性增长，而不是每次都重写整个索引
+        """
+        segments = conn.execute("SELECT name, passages FROM segments ORDER BY name").fetchall()
+        if len(segments) <= MAX_SEGMENTS:
+            return []
+        j, total = len(segments), 0
+        while j > 0 and (j > len(segments) - 2 or segments[j - 1][1] <= MERGE_FACTOR * total):
+            j -= 1
+            total += segments[j][1]
+        return [name for name, _ in segments[j:]]
+
+    def _merge(self, conn, generation, names, written):
+        """
+        在写事务内把 names 这几个相邻的段合并成一个，返回提交后可以删除的旧段名；新段名追加到 written。
+        段按创建顺序命名，相邻段合并后段落 ID 仍然递增、段与段之间的顺序不变
+        """
+        if not names:
+            return []
+        placeholders = ",".join("?" * len(names))
+        first, last = conn.execute(
+            f"SELECT MIN(first_pid), MAX(last_pid) FROM segments WHERE name IN ({placeholders})", names
+        ).fetchone()
+        live = {pid for pid, in conn.execute("SELECT id FROM passages WHERE id BETWEEN ? AND ?", (first, last))}
+        postings = defaultdict(list)
+        for name in names:
+            segment = _Segment(self._segment_base(name))
+            for term in segment.lexicon:
+                for pid, tf, pos_offset in segment.postings(term):
+                    if pid in live:
+                        postings[term].append((pid, segment.pos[pos_offset:pos_offset + tf]))
+        # 新段名取被合并的最后一段加后缀，排序位置与原来的段相同
+        merged = f"{names[-1]}m"
+        written.append(merged)
+        _write_segment(self._segment_base(merged), postings)
+        conn.execute(f"DELETE FROM segments WHERE name IN ({placeholders})", names)
+        conn.execute("INSERT INTO segments VALUES (?, ?, ?, ?)", (merged, len(live), first, last))
+        return names
+
+    def _unlink(self, names):
+        for name in names:
+            for ext in (".lex", ".post", ".pos"):
+                try:
+                    os.remove(self._segment_base(name) + ext)
+                except OSError:
+                    pass
+
+    # --- 检索 ---
+
+    def _current(self):
+        """当前版本的索引快照；其他会话或进程写入后（generation 变化）重新映射，没变的段直接复用"""
+        for attempt in range(3):
+            with self._connect() as conn:
+                conn.execute("BEGIN")  # 读事务：generation、段列表与段落长度来自同一个版本
+                generation = self._meta(conn, "generation")
+                snapshot = self._snapshot
+                if snapshot is not None and snapshot.generation == generation:
+                    return snapshot
+                names = [name for name, in conn.execute("SELECT name FROM segments ORDER BY name")]
+                lengths = dict(conn.execute("SELECT id, length FROM passages"))
+            try:
+                segments = [self._segments.get(name) or _Segment(self._segment_base(name)) for name in names]
+            except FileNotFoundError:
+                # 读到的版本刚被合并掉、旧段文件已删除：重新读取最新版本
+                continue
+            with self._snapshot_lock:
+                self._segments = dict(zip(names, segments))
+                self._snapshot = _Snapshot(generation, segments, lengths)
+                return self._snapshot
+        raise RuntimeError("文库索引在持续变化，请稍后重试")
+
+    def search(self, query, top_k=10, file_hashes=None):
+        """
+        BM25 检索段落，返回按得分降序的 [{"id", "file_hash", "title", "pages": (首页, 末页) 或 None, "text", "score"}]。
+        file_hashes: 只在这些论文里检索
+        """
+        terms, phrases = parse_query(query)
+        if not terms:
+            return []
+        snapshot = self._current()
+        if not snapshot.n:
+            return []
+        phrase_terms = {term for phrase in phrases for term in phrase}
+        scores = defaultdict(float)
+        positions = defaultdict(dict)  # 短语词 -> {段落 ID: (segment, 位置起点, 词频)}
+        lengths, avgdl = snapshot.lengths, snapshot.avgdl or 1.0
+        for term in terms:
+            plists = [(segment, segment.postings(term)) for segment in snapshot.segments]
+            df = sum(len(plist) for _, plist in plists)
+            if not df:
+                if term in phrase_terms:
+                    return []
+                continue
+            idf = math.log(1 + (snapshot.n - df + 0.5) / (df + 0.5))
+            for segment, plist in plists:
+                for pid, tf, pos_offset in plist:
+                    length = lengths.get(pid)
+                    if length is None:  # 已移出文库
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                    scores[pid] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    if term in phrase_terms:
+                        positions[term][pid] = (segment, pos_offset, tf)
+
+        candidates = scores.keys()
+        for phrase in phrases:
+            candidates = [pid for pid in candidates if self._has_phrase(pid, phrase, positions)]
+        if file_hashes is not None:
+            owners = self._owners(candidates, file_hashes)
+            candidates = [pid for pid in candidates if pid in owners]
+        ranked = heapq.nlargest(top_k, candidates, key=scores.__getitem__)
+        return self._passages(ranked, scores)
+
+    @staticmethod
+    def _has_phrase(pid, phrase, positions):
+        starts = None
+        for k, term in enumerate(phrase):
+            hit = positions[term].get(pid)
+            if hit is None:
+                return False
+            segment, offset, tf = hit
+            shifted = {p - k for p in segment.pos[offset:offset + tf]}
+            starts = shifted if starts is None else starts & shifted
+            if not starts:
+                return False
+        return True
+
+    def _owners(self, pids, file_hashes):
+        file_hashes = list(file_hashes)
+        if not pids or not file_hashes:
+            return set()
+        pids = set(pids)
+        with self._connect() as conn:
+            return {pid for pid, in conn.execute(
+                f"SELECT id FROM passages WHERE file_hash IN ({','.join('?' * len(file_hashes))})", file_hashes
+            ) if pid in pids}
+
+    def _passages(self, pids, scores):
+        if not pids:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT p.id, p.file_hash, p.page_first, p.page_last, p.text, d.title FROM passages p "
+                f"JOIN papers d ON d.file_hash = p.file_hash WHERE p.id IN ({','.join('?' * len(pids))})",
+                pids,
+            ).fetchall()
+        by_id = {row[0]: row for row in rows}
+        return [
+            {"id": pid, "file_hash": by_id[pid][1], "title": by_id[pid][5],
+             "pages": (by_id[pid][2], by_id[pid][3]) if by_id[pid][2] is not None else None,
+             "text": by_id[pid][4], "score": round(scores[pid], 4)}
+            for pid in pids if pid in by_id
+        ]
+
+    # --- 浏览 ---
+
+    def papers(self):
+        """文库里的论文（不含全文），最近加入的在前"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT file_hash, name, title, pages, chars, artifacts, added_at FROM papers ORDER BY added_at DESC"
+            ).fetchall()
+        return [
+            {"file_hash": h, "name": name, "title": title, "pages": pages, "chars": chars,
+             "artifacts": sorted(json.loads(artifacts)), "added_at": added_at}
+            for h, name, title, pages, chars, artifacts, added_at in rows
+        ]
+
+    def get(self, file_hash):
+        """一篇论文的全部内容：全文、页码索引、研读产物；不在库中时返回 None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT name, title, text, page_starts, artifacts, added_at FROM papers WHERE file_hash = ?",
+                (file_hash,),
+            ).fetchone()
+        if row is None:
+            return None
+        name, title, text, page_starts, artifacts, added_at = row
+        return {"file_hash": file_hash, "name": name, "title": title,
+                "text": zlib.decompress(text).decode("utf-8"), "page_starts": json.loads(page_starts),
+                "artifacts": json.loads(artifacts), "added_at": added_at}
+
+    def stats(self):
+        with self._connect() as conn:
+            papers, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM papers").fetchone()
+            passages = conn.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+            segments = conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        # 合并或回滚可能正在删除段文件：列目录后才消失的文件跳过不计
+        index_bytes = 0
+        with os.scandir(self.index_dir) as entries:
+            for entry in entries:
+                try:
+                    index_bytes += entry.stat().st_size
+                except OSError:
+                    pass
+        return {"papers": papers, "passages": passages, "segments": segments,
+                "bytes": size, "index_bytes": index_bytes}
@@ -0,0 +1,98 @@
+"""
+大模型响应的持久化缓存（SQLite）
+
+以 (模型, System Prompt, 历史消息, 当前 Prompt) 的哈希作为键，
+相同请求跨会话、跨进程重启都能直接命中，不再重复消耗延迟和 Token。
+"""
+import hashlib
+import json
+import os
+import time
+
+from sqlite_store import SqliteLruStore
+
+# 默认缓存目录，可用环境变量 PAPERAGENT_CACHE_DIR 覆盖
+CACHE_DIR = os.environ.get(
+    "PAPERAGENT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".paperagent_cache"),
+)
+
+
+def make_cache_key(model, messages):
+    """按内容寻址：模型 + 完整消息列表（system / history / prompt）的 SHA-256"""
+    payload = json.dumps(
+        {"model": model, "messages": messages},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(SqliteLruStore):
+    """SQLite 响应缓存，在 SqliteLruStore 的容量淘汰与命中统计之上支持 TTL 过期"""
+
+    MAX_BYTES = 200 * 1024 * 1024
+    TABLE = "responses"
+    COLUMNS = """
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        hit_count INTEGER NOT NULL DEFAULT 0
+    """
+
+    def __init__(self, path, max_bytes=None, ttl=30 * 24 * 3600):
+        self.ttl = ttl
+        super().__init__(path, max_bytes)
+
+    def get(self, key):
+        """命中返回缓存的文本，未命中或已过期返回 None"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row:
+                conn.execute(
+                    "UPDATE responses SET accessed_at = ?, hit_count = hit_count + 1 WHERE key = ?",
+                    (now, key),
+                )
+        self._count_lookups(int(row is not None), int(row is None))
+        return row[0] if row else None
+
+    def peek(self, key):
+        """只查看、不计入命中统计：用于决定要不要复用已有结果（不会因此发起请求）"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            return None
+        return row[0]
+
+    def set(self, key, model, response):
+        if not response:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO responses
+                    (key, model, response, size, created_at, accessed_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        # 先清理过期条目，再按容量淘汰
+        if self.ttl:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        super()._evict(conn)
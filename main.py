@@ -1,16 +1,37 @@
 import streamlit as st
-import re  # <--- 新增这个，用于自动检测语言
-import pdfplumber
-import dashscope
-import base64  # <--- 新增这个
-from dashscope import Generation
-from http import HTTPStatus
-import os
 import time
-import io  # <--- 新增
-import hashlib  # <--- 新增
-from fpdf import FPDF  # <--- 新增
 from datetime import datetime
+import logging
+import os
+import uuid
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from chunking import estimate_tokens, split_text_into_spans, truncate_to_tokens
+from retrieval import BM25Index
+from sections import SECTION_LABELS, section_spans, section_text
+from pages import format_page_range, mark_pages, page_bounds, page_range
+from pdf_extract import BACKENDS, DEFAULT_BACKEND
+from ocr import OcrUnavailable, ocr_status
+from paper_core import (
+    ANALYSIS_ARTIFACTS, EXPERIMENT_PROMPT, LIBRARY_AUTO_ADD, LIBRARY_CONTEXT_TOKENS, LIBRARY_SYSTEM_INSTRUCTION,
+    MAP_MAX_WORKERS, MINDMAP_INPUT_TOKENS, MINDMAP_NOTES_TOKENS, QWEN_OUTPUT_TOKENS_ESTIMATE, QwenCallError,
+    add_to_library, analyze_paper, assemble_translation, build_bibtex_prompt, build_chat_messages,
+    build_library_question_prompt, build_messages, build_mindmap_prompt, build_paper_prefix, build_reduce_prompt,
+    build_short_summary_prompt, build_terms_prompt, build_translation_prompt, circuit_breaker, clean_mermaid,
+    compress_memory, default_system_instruction, estimate_analysis_tokens, estimate_library_question_tokens,
+    estimate_summary_tokens, extract_pdf_document, finalize_mindmap, generate_bibtex, generate_mindmap_code,
+    generate_pdf_content, get_analysis_store, get_content_hash, get_job_manager, get_library, get_memory_accountant,
+    get_response_cache, get_text_store, get_translation_memory, get_usage_tracker, library_source_label,
+    load_analysis, map_chunk_summaries, mindmap_source, ocr_pdf_pages, prepare_translation, rate_limiter,
+    remember_translation, request_qwen, select_library_passages, set_api_key, split_chat_history, split_for_summary,
+    stream_qwen, summarize_pages, translate_segments, translation_messages, tree_reduce,
+)
+from usage_tracker import FEATURE_LABELS, UsageTotals, budget_decision
+from job_manager import ACTIVE_STATES, DONE, FAILED, RUNNING
+from static_assets import is_published, publish_pdf
+from vendor_assets import asset_loader
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("paperagent")
 
 # --- 页面基础配置 ---
 st.set_page_config(
@@ -114,202 +135,82 @@ st.markdown("""
 
 # --- 核心工具函数 ---
 
-@st.cache_data
-def extract_text_from_pdf(uploaded_file):
-    text = ""
+# 解析引擎：默认快速；表格、公式、上下标较多的论文可以逐篇切换到高保真
+PDF_BACKEND_LABELS = {
+    "pdfium": "⚡ 快速（PDFium）",
+    "pdfminer": "⚖️ 均衡（pdfminer）",
+    "pdfplumber": "🔬 高保真（pdfplumber）",
+}
+
+
+def extract_text_from_pdf(uploaded_file, backend):
+    """返回 (全文, 章节列表, 每页起始偏移)；解析失败时返回 (None, [], [])"""
     try:
-        with pdfplumber.open(uploaded_file) as pdf:
-            # 移除页数限制，读取所有页面
-            for i, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                if page_text: text += page_text + "\n"
-        return text
+        doc = extract_pdf_document(uploaded_file.getvalue(), uploaded_file.name, backend)
     except Exception as e:
         st.error(f"PDF 读取失败: {e}")
-        return None
+        return None, [], []
+    used, timed_out, ocr = doc["backend"], doc["timed_out"], doc["ocr"]
+    if used != backend:
+        st.warning(f"{PDF_BACKEND_LABELS[backend]} 无法解析这篇论文，已自动改用 {PDF_BACKEND_LABELS[used]}")
+    if timed_out:
+        st.warning(f"第 {', '.join(str(i + 1) for i in timed_out)} 页解析超时，已跳过")
+    if ocr["pages"]:
+        st.info(f"第 {format_pages(ocr['pages'])} 页没有文字层（扫描页），已用 OCR 识别")
+    if ocr["blank"]:
+        reason = ocr["error"] or "OCR 未识别出文字"
+        st.warning(f"第 {format_pages(ocr['blank'])} 页没有文字层（可能是扫描页或整页插图）：{reason}")
+    return doc["text"], doc["sections"], doc["page_starts"]
 
-def generate_pdf_content(summary, chat_history):
-    """生成支持中文的 PDF 二进制流"""
-    # --- 关键：先注册中文字体 ---
-    # 必须下载 SimHei.ttf 放在同级目录，或者使用系统路径
-    import os
-    font_path = "SimHei.ttf" # 优先找项目目录下的字体
-    
-    # 如果项目里没有，尝试找 Windows 系统字体
-    if not os.path.exists(font_path):
-        possible_paths = [
-            r"C:\Windows\Fonts\simhei.ttf",
-            r"C:\Windows\Fonts\msyh.ttc"
-        ]
-        for p in possible_paths:
-            if os.path.exists(p):
-                font_path = p
-                break
-    
-    # 定义 PDF 类，在初始化时注册字体
-    class PDF(FPDF):
-        def __init__(self):
-            super().__init__()
-            self.font_registered = False
-            # 尝试注册中文字体
-            try:
-                # 注册字体，这步是显示中文的关键
-                self.add_font('SimHei', '', font_path)
-                self.font_registered = True
-            except Exception as e:
-                # 如果找不到字体，回退到默认（中文会乱码，但不会报错崩溃）
-                print(f"字体加载失败: {e}")
-        
-        def header(self):
-            # 简单的页眉
-            try:
-                if self.font_registered:
-                    self.set_font('SimHei', '', 10)
-                else:
-                    self.set_font('Arial', '', 10)
-            except:
-                self.set_font('Arial', '', 10)
-            # 确保使用英文标题避免中文编码问题
-            self.cell(0, 10, 'PaperAgent Pro - Study Notes', ln=True, align='R')
-            self.ln(5)
-    
-    # 创建 PDF 实例
-    pdf = PDF()
-    
-    # 添加页面
-    pdf.add_page()
-    
-    # 设置默认字体
-    if pdf.font_registered:
-        pdf.set_font('SimHei', '', 12)
-    else:
-        pdf.set_font('Arial', '', 12)
-        pdf.cell(0, 10, "Error: Chinese font not found. Please install SimHei.ttf", ln=True)
 
-    # 1. 写入标题
-    try:
-        if pdf.font_registered:
-            pdf.set_font('SimHei', '', 16)
-            pdf.cell(0, 10, '论文研读笔记', ln=True, align='C')
-        else:
-            pdf.set_font('Arial', '', 16)
-            pdf.cell(0, 10, 'Study Notes', ln=True, align='C')
-        pdf.ln(10)
-    except Exception as e:
-        print(f"标题写入失败: {e}")
-        pdf.set_font('Arial', '', 16)
-        pdf.cell(0, 10, 'Study Notes', ln=True, align='C')
-        pdf.ln(10)
+def format_pages(pages, limit=10):
+    """页码列表（0 起）-> “1, 2, 3” 或 “1, 2, … 共 N”（调用方接上“页”字）"""
+    shown = ", ".join(str(i + 1) for i in pages[:limit])
+    return shown if len(pages) <= limit else f"{shown} … 共 {len(pages)}"
+
+
+def paper_scope(feature, max_tokens=None):
+    """当前论文中与某功能相关的章节文本（见 sections.FEATURE_SECTIONS），没有识别到章节时为全文"""
+    return section_text(st.session_state.raw_text, st.session_state.sections, feature, max_tokens)
+
+
+def paper_scope_with_pages(feature):
+    """同 paper_scope，但每页起点插入页码标记（【第 N 页】），返回 (文本, 该文本的每页起始偏移)"""
+    raw_text = st.session_state.raw_text
+    return mark_pages(raw_text, st.session_state.page_starts,
+                      section_spans(raw_text, st.session_state.sections, feature))
 
-    # 2. 写入时间
-    try:
-        if pdf.font_registered:
-            pdf.set_font('SimHei', '', 10)
-            pdf.cell(0, 10, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", ln=True)
-        else:
-            pdf.set_font('Arial', '', 10)
-            pdf.cell(0, 10, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", ln=True)
-        pdf.ln(5)
-    except Exception as e:
-        print(f"时间写入失败: {e}")
-        pdf.set_font('Arial', '', 10)
-        pdf.cell(0, 10, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", ln=True)
-        pdf.ln(5)
-
-    # 3. 写入概览
-    if summary:
-        try:
-            if pdf.font_registered:
-                pdf.set_font('SimHei', '', 14)
-                pdf.cell(0, 10, '一、论文概览', ln=True)
-                pdf.set_font('SimHei', '', 11)
-            else:
-                pdf.set_font('Arial', '', 14)
-                pdf.cell(0, 10, '1. Paper Overview', ln=True)
-                pdf.set_font('Arial', '', 11)
-            # multi_cell 用于自动换行
-            pdf.multi_cell(0, 8, summary)
-            pdf.ln(10)
-        except Exception as e:
-            print(f"概览写入失败: {e}")
-            pdf.set_font('Arial', '', 11)
-            pdf.multi_cell(0, 8, summary)
-            pdf.ln(10)
-
-    # 4. 写入问答记录
-    if chat_history:
-        try:
-            if pdf.font_registered:
-                pdf.set_font('SimHei', '', 14)
-                pdf.cell(0, 10, '二、重点问答记录', ln=True)
-            else:
-                pdf.set_font('Arial', '', 14)
-                pdf.cell(0, 10, '2. Key Q&A Records', ln=True)
-            pdf.ln(5)
-            
-            for msg in chat_history:
-                role = "【AI 导师】" if msg['role'] == 'assistant' else "【我】"
-                if not pdf.font_registered:
-                    role = "[AI Tutor]" if msg['role'] == 'assistant' else "[Me]"
-                content = msg['content']
-                
-                # 角色名
-                try:
-                    if pdf.font_registered:
-                        pdf.set_font('SimHei', '', 11)
-                    else:
-                        pdf.set_font('Arial', '', 11)
-                    pdf.cell(0, 8, role, ln=True)
-                except Exception as e:
-                    print(f"角色名写入失败: {e}")
-                    pdf.set_font('Arial', '', 11)
-                    pdf.cell(0, 8, "[User]" if msg['role'] != 'assistant' else "[AI]", ln=True)
-                
-                # 内容 (缩进一点)
-                try:
-                    pdf.set_x(15)
-                    if pdf.font_registered:
-                        pdf.set_font('SimHei', '', 10)
-                    else:
-                        pdf.set_font('Arial', '', 10)
-                    pdf.multi_cell(0, 6, content)
-                    pdf.ln(3)
-                except Exception as e:
-                    print(f"内容写入失败: {e}")
-                    pdf.set_x(15)
-                    pdf.set_font('Arial', '', 10)
-                    pdf.multi_cell(0, 6, content[:500])  # 只写入部分内容避免崩溃
-                    pdf.ln(3)
-        except Exception as e:
-            print(f"问答记录写入失败: {e}")
-
-    # 返回二进制数据
-    return bytes(pdf.output())
+
+def page_count():
+    return len(st.session_state.page_starts)
+
+
+def pages_text(first, last=None):
+    """第 first..last 页（0 起，含两端）的原文"""
+    raw_text = st.session_state.raw_text
+    start, end = page_bounds(st.session_state.page_starts, len(raw_text), first, last)
+    return raw_text[start:end]
 
 def get_file_id(uploaded_file) -> str:
     """
     用文件名 + 文件大小 + 内容hash 生成稳定指纹，确保换文件必定触发重解析
     """
     data = uploaded_file.getvalue()
-    h = hashlib.md5(data).hexdigest()
+    h = get_content_hash(data)
     return f"{uploaded_file.name}_{len(data)}_{h}"
 
-import base64
 import streamlit.components.v1 as components
-# 暂时注释掉需要额外依赖的导入
-# from PIL import Image
-# import pytesseract
-# import pdf2image
 
-def display_pdf(uploaded_file, height=800):
+def display_pdf(pdf_url, height=800):
     """
     ✅ 终极方案：pdf.js 渲染到 canvas（不依赖浏览器 PDF 插件，Edge 不会拦）
+    PDF 通过 URL 加载（HTTP Range 分段请求，翻到哪页取哪页），
+    rerun 时下发的 HTML 只有一个地址，大小与 PDF 体积无关。
     """
-    if uploaded_file is None:
+    if not pdf_url:
+        st.info("文件超出在线预览上限，请下载后查看。")
         return
-
-    b64 = base64.b64encode(uploaded_file.getvalue()).decode("utf-8")
-
+    # pdf.js 优先从本地 static/vendor/ 同源加载（内容哈希文件名 + 长期缓存头），未本地化时回退 CDN
     html = f"""
     <div style="display:flex; gap:10px; align-items:center; margin-bottom:8px;">
       <button id="prev">⬅️ Prev</button>
@@ -318,16 +219,14 @@ def display_pdf(uploaded_file, height=800):
     </div>
     <canvas id="the-canvas" style="width:100%; border:1px solid #ddd; border-radius:10px;"></canvas>
 
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.min.js"></script>
+    {asset_loader(scripts=("pdf.js",), urls=("pdf.worker.js",))}
     <script>
-      const b64 = "{b64}";
-      const raw = atob(b64);
-      const uint8Array = new Uint8Array(raw.length);
-      for (let i = 0; i < raw.length; i++) uint8Array[i] = raw.charCodeAt(i);
+    assetsReady.then(function(assetUrls) {{
+      // srcdoc iframe 的 baseURI 继承自 Streamlit 页面，据此拼出绝对地址
+      const pdfUrl = new URL("{pdf_url}", document.baseURI).href;
 
       const pdfjsLib = window['pdfjs-dist/build/pdf'];
-      pdfjsLib.GlobalWorkerOptions.workerSrc =
-        "https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js";
+      pdfjsLib.GlobalWorkerOptions.workerSrc = assetUrls['pdf.worker.js'];
 
       let pdfDoc = null, pageNum = 1, pageRendering = false, pageNumPending = null;
       const canvas = document.getElementById('the-canvas');
@@ -375,29 +274,35 @@ def display_pdf(uploaded_file, height=800):
         queueRenderPage(pageNum);
       }});
 
-      pdfjsLib.getDocument({{ data: uint8Array }}).promise.then(function(pdfDoc_) {{
+      pdfjsLib.getDocument({{
+        url: pdfUrl,
+        disableAutoFetch: true,   // 不预取整份文件，只按页 Range 请求
+        disableStream: true,
+        rangeChunkSize: 65536
+      }}).promise.then(function(pdfDoc_) {{
         pdfDoc = pdfDoc_;
         document.getElementById('page_count').textContent = pdfDoc.numPages;
         document.getElementById('page_num').textContent = pageNum;
         renderPage(pageNum);
       }});
+    }});
     </script>
     """
 
     components.html(html, height=height, scrolling=True)
 
-def display_pdf_selectable(uploaded_file, height=700):
+def display_pdf_selectable(pdf_url, height=700):
     """
     ✅ 可复制版本：使用 iframe 显示 PDF（支持文本选择和复制）
+    浏览器内置阅读器直接按 URL 加载（支持 Range），不再内嵌 base64
     """
-    if uploaded_file is None:
+    if not pdf_url:
+        st.info("文件超出在线预览上限，请下载后查看。")
         return
 
-    base64_pdf = base64.b64encode(uploaded_file.getvalue()).decode("utf-8")
-
     pdf_iframe = f"""
     <iframe
-        src="data:application/pdf;base64,{base64_pdf}#toolbar=1&navpanes=0"
+        src="{pdf_url}#toolbar=1&navpanes=0"
         width="100%"
         height="{height}"
         style="border:1px solid #ddd; border-radius:10px;"
@@ -405,248 +310,438 @@ def display_pdf_selectable(uploaded_file, height=700):
     """
     st.markdown(pdf_iframe, unsafe_allow_html=True)
 
-# 暂时注释掉需要额外依赖的函数
-# def render_pdf_page_to_image(uploaded_file, page_num, scale=2.0):
-#     """
-#     将PDF指定页面渲染为图像
-#     """
-#     try:
-#         # 将上传的文件保存为临时文件
-#         with open("temp.pdf", "wb") as f:
-#             f.write(uploaded_file.getvalue())
-        
-#         # 使用pdf2image转换PDF页面为图像
-#         images = pdf2image.convert_from_path(
-#             "temp.pdf",
-#             first_page=page_num + 1,  # pdf2image使用1-based索引
-#             last_page=page_num + 1,
-#             dpi=int(150 * scale),  # 根据scale调整DPI
-#             fmt="PNG"
-#         )
-        
-#         if images:
-#             return images[0]
-#         return None
-#     except Exception as e:
-#         st.error(f"PDF渲染失败: {e}")
-#         return None
-
-# def ocr_image(image):
-#     """
-#     对图像进行OCR识别，提取文本
-#     """
-#     try:
-#         # 使用pytesseract进行OCR
-#         text = pytesseract.image_to_string(image, lang="eng+chi_sim")
-#         return text
-#     except Exception as e:
-#         st.error(f"OCR失败: {e}")
-#         return ""
-
-
-# 上下文管理器：临时禁用代理 (给 DashScope 用)
-class NoProxyContext:
-    def __enter__(self):
-        self.backup = {}
-        for k in ["http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY"]:
-            if k in os.environ:
-                self.backup[k] = os.environ[k]
-                del os.environ[k]
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        for k, v in self.backup.items():
-            os.environ[k] = v
-
-
-def call_qwen(prompt, history=None, system_instruction=None):
+
+# --- 用量记账与会话预算 ---
+
+SESSION_TOKEN_BUDGET = int(os.environ.get("PAPERAGENT_SESSION_TOKEN_BUDGET", "200000"))
+
+
+def usage_meter(feature):
+    """当前会话、指定功能的记账句柄（可以传进工作线程）"""
+    return get_usage_tracker().meter(feature, st.session_state.session_id, st.session_state.usage)
+
+
+def session_tokens_remaining():
+    if not session_token_budget:
+        return None
+    return max(0, session_token_budget - st.session_state.usage.total_tokens)
+
+
+def budget_gate(feature, estimate, allow_downgrade=True):
+    """
+    执行前的预算检查：返回允许的比例（1.0 照常执行，<1 表示按比例缩减输入后降级执行），
+    预算不足以执行时提示并返回 None
+    """
+    remaining = session_tokens_remaining()
+    decision, allowed = budget_decision(remaining, estimate)
+    label = FEATURE_LABELS.get(feature, feature)
+    if decision == "ok":
+        return 1.0
+    if decision == "downgrade" and allow_downgrade:
+        st.info(f"本会话剩余预算 {remaining:,} Token，不足以完整执行「{label}」（预计 {estimate:,}），已缩减输入后执行")
+        return allowed / estimate
+    st.warning(f"本会话 Token 预算不足：「{label}」预计消耗 {estimate:,}，剩余 {remaining:,}。可在侧边栏调高预算")
+    return None
+
+
+def shrink_text(text, ratio):
+    """降级执行时按比例缩减论文文本（在章节/段落/句子边界处截断）"""
+    if ratio >= 1.0:
+        return text
+    return truncate_to_tokens(text, int(estimate_tokens(text) * ratio))
+
+
+def render_usage_panel():
+    session = st.session_state.usage.snapshot()
+    st.caption(
+        f"本会话：{session['calls']} 次调用（缓存命中 {session['cached_calls']}）· "
+        f"输入 {session['prompt_tokens']:,} / 输出 {session['completion_tokens']:,} Token · "
+        f"约 ¥{session['cost']:.4f}"
+    )
+    if session["prompt_tokens"]:
+        hit = session["cached_prompt_tokens"] / session["prompt_tokens"]
+        st.caption(f"上下文缓存命中 {session['cached_prompt_tokens']:,} 输入 Token（{hit:.0%}）")
+    if session_token_budget:
+        used = min(1.0, session["total_tokens"] / session_token_budget)
+        st.progress(used, text=f"预算已用 {session['total_tokens']:,} / {session_token_budget:,}")
+    if session["by_feature"]:
+        st.caption(" · ".join(
+            f"{FEATURE_LABELS.get(name, name)} {item['tokens']:,}"
+            for name, item in sorted(session["by_feature"].items(), key=lambda kv: -kv[1]["tokens"])
+        ))
+    overall = get_usage_tracker().totals.snapshot()
+    st.caption(f"本进程累计：{overall['calls']} 次 · {overall['total_tokens']:,} Token · 约 ¥{overall['cost']:.4f}")
+
+
+def ensure_api_key():
+    """检查 API Key；缺失时提示并返回 False"""
     if not api_key:
         st.error("请先填入 API Key")
+        return False
+    set_api_key(api_key)
+    return True
+
+
+def prepare_messages(prompt, history=None, system_instruction=None, paper_text=None):
+    """
+    检查 API Key 并组装消息；Key 缺失时提示并返回 None。
+    paper_text: 需要整篇阅读的论文内容，放进固定前缀（与对话共用，可命中服务端上下文缓存）
+    """
+    if not ensure_api_key():
         return None
-    dashscope.api_key = api_key
 
     # 默认 System Prompt
     if not system_instruction:
-        system_instruction = f"""
-你是一位专业、严谨的学术导师（Academic Research Mentor）。
-用户的理解水平是：{reader_level}，请使用适合该水平的语言解释专业术语。
-
-【身份与防伪声明】
-如果用户询问：
-- 你是谁开发的
-- 你是谁开发的？
-- 这个系统是谁做的
-- 开发者是谁
-
-请只回答下面这一句话，不要添加任何多余内容：
-“本服务由【徐子强，2025012085】开发，仅用于课程研究展示。”
-
-【回答约束】
-- 仅基于用户上传的论文内容进行分析，不得引入外部知识。
-- 若论文中未提及相关信息，请明确回答“论文中未给出相关信息”。
-- 禁止编造作者、实验结果、数值或结论。
-"""
-
-    messages = [{'role': 'system', 'content': system_instruction}]
-    if history:
-        messages.extend(history[-4:])
-    messages.append({'role': 'user', 'content': prompt})
+        system_instruction = default_system_instruction(reader_level)
 
-    try:
-        # 关键：调用 DashScope 时，使用上下文管理器临时清除代理环境变量
-        with NoProxyContext():
-            response = Generation.call(
-                model="qwen-turbo",
-                messages=messages,
-                result_format='message'
-            )
+    if paper_text:
+        return build_chat_messages(build_paper_prefix(system_instruction, paper_text), prompt, turns=history or ())
+    return build_messages(prompt, history, system_instruction)
 
-        if response.status_code == HTTPStatus.OK:
-            return response.output.choices[0]['message']['content']
-        else:
-            st.error(f"API Error: {response.message}")
-            return None
-    except Exception as e:
-        st.error(f"Network Error: {e}")
+
+def call_qwen(prompt, history=None, system_instruction=None, use_cache=True, feature="other", paper_text=None):
+    messages = prepare_messages(prompt, history, system_instruction, paper_text)
+    if messages is None:
+        return None
+    try:
+        return request_qwen(messages, use_cache=use_cache, meter=usage_meter(feature))
+    except QwenCallError as e:
+        st.error(str(e))
         return None
 
 
-# --- 新增：长文本处理工具 ---
+def stream_messages(messages, use_cache=True, stats=None, feature="other"):
+    """流式发送已组装好的消息（对话使用自己的消息布局）；出错时在页面提示并提前结束"""
+    try:
+        yield from stream_qwen(messages, use_cache=use_cache, stats=stats, meter=usage_meter(feature))
+    except QwenCallError as e:
+        st.error(str(e))
+
+
+# --- 后台任务：长操作交给工作线程，页面重跑不会打断或重复执行 ---
+# 任务函数运行在工作线程里，不调用任何 st.* 接口：System Prompt、记账句柄等在提交前于主线程算好。
+# 会话只记录 {任务类型: 任务 ID}，每次重跑读取任务状态；结果就绪后由 collect_finished_jobs 放进会话状态。
 
-def split_text_into_chunks(text, chunk_size=4000, overlap=500):
+JOB_POLL_SECONDS = 1.0
+JOB_STAGE_LABELS = {
+    "map": "逐段研读",
+    "reduce": "归并摘要",
+    "final": "整合全篇逻辑",
+    "bibtex": "生成 BibTeX",
+    "derive": "生成各项产物",
+    "request": "等待模型回复",
+    "repair": "校验导图语法",
+}
+
+
+def overview_job(job, full_text, system_instruction, max_workers, meter, bib_meter):
     """
-    朴素的滑窗切分函数
-    chunk_size: 每个分片的字符数
-    overlap: 重叠部分，防止上下文在切分处断裂
+    深度概览 + BibTeX。Map-Reduce 策略：分段总结 -> （超长时）分组逐层归并 -> 汇总总结。
+    返回 {"summary", "bibtex", "levels", "failed_chunks"}
     """
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        # 尽量在换行符处截断，避免切断句子
-        if end < len(text):
-            next_newline = text.find('\n', end)
-            if next_newline != -1 and next_newline - end < 200:
-                end = next_newline
-        
-        chunks.append(text[start:end])
-        start = end - overlap # 滑窗推进，保留重叠
-    return chunks
+    chunks = split_for_summary(full_text)
+    levels, failures = [], {}
+    if len(chunks) == 1:
+        job.report("request", 0, 1)
+        summary = request_qwen(
+            build_messages(build_short_summary_prompt(full_text), system_instruction=system_instruction), meter=meter
+        )
+    else:
+        job.report("map", 0, len(chunks))
+        summaries, failures = map_chunk_summaries(
+            chunks, system_instruction, max_workers,
+            on_progress=lambda done, total, i, error: job.report("map", done, total), meter=meter,
+        )
+        if len(failures) == len(chunks):
+            raise QwenCallError("所有分片均研读失败，请检查网络或 API Key 后重试")
+        # 树形 Reduce：摘要总量超出单次调用预算时，先分组并行归并，逐层收敛
+        summaries, levels = tree_reduce(
+            summaries, system_instruction, max_workers,
+            on_progress=lambda level, done, total, shape: job.report("reduce", done, total), meter=meter,
+        )
+        job.report("final", 0, 1)
+        summary = request_qwen(
+            build_messages(build_reduce_prompt(summaries), system_instruction=system_instruction), meter=meter
+        )
+    job.report("bibtex", 0, 1)
+    try:
+        bibtex = generate_bibtex(full_text, system_instruction, meter=bib_meter)
+    except QwenCallError as e:
+        logger.warning("bibtex generation failed: %s", e)
+        bibtex = None
+    return {"summary": summary, "bibtex": bibtex, "levels": levels, "failed_chunks": sorted(failures)}
+
+
+def mindmap_job(job, text, system_instruction, meter, max_tokens):
+    job.report("request", 0, 1)
+    raw_code = generate_mindmap_code(text, system_instruction, meter=meter, max_tokens=max_tokens)
+    # 本地修复不了时才会再发一次只含代码的小请求
+    job.report("repair", 0, 1)
+    code, repair = finalize_mindmap(raw_code, system_instruction, meter=meter)
+    return {"raw": raw_code, "code": code, "repair": repair}
+
 
-def generate_map_reduce_summary(full_text):
+def page_summary_job(job, text, pages_label, system_instruction, max_workers, meter):
+    """按页范围总结：只发送所选页的原文"""
+    job.report("map", 0, len(split_for_summary(text)))
+    summary = summarize_pages(text, pages_label, system_instruction, max_workers,
+                              on_progress=lambda done, total, i, error: job.report("map", done, total), meter=meter)
+    return {"label": pages_label, "summary": summary}
+
+
+def request_job(job, messages, meter):
+    """单次调用的任务（术语表、实验数据）"""
+    job.report("request", 0, 1)
+    return request_qwen(messages, meter=meter)
+
+
+def analysis_job(job, full_text, system_instruction, max_workers, meter, file_hash):
+    return analyze_paper(full_text, system_instruction, max_workers, on_progress=job.report, meter=meter,
+                         file_hash=file_hash)
+
+
+def paper_fingerprint():
     """
-    Map-Reduce 策略：分段总结 -> 汇总总结
+    任务键里的论文指纹：PDF 内容哈希 + 解析引擎 + 全文哈希。与文件名无关，同一篇论文换个文件名上传也复用同一任务；
+    换了解析引擎、或 OCR 补上了扫描页（送给模型的全文变了）时是另一个任务，不会取回按旧文本生成的结果
     """
-    # 1. 切分文本
-    chunks = split_text_into_chunks(full_text, chunk_size=5000)
-    
-    # 如果文本很短，直接用原来的方法
-    if len(chunks) == 1:
-        return call_qwen(f"请阅读全文，生成摘要（贡献、方法、结论）：\n{full_text}")
+    file_hash = st.session_state.current_file_id.rsplit("_", 1)[-1]
+    text_hash = get_content_hash((st.session_state.raw_text or "").encode("utf-8"))[:12]
+    return f"{file_hash}-{st.session_state.parsed_backend}-{text_hash}"
 
-    # 2. Map 阶段：分段摘要
-    chunk_summaries = []
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for i, chunk in enumerate(chunks):
-        status_text.text(f"正在研读第 {i+1}/{len(chunks)} 部分..." )
-        prompt = f"""请简要总结以下论文片段的主要内容（保留关键技术点和实验结论）：
-        片段内容：
-        {chunk}
-        """
-        summary = call_qwen(prompt)
-        if summary:
-            chunk_summaries.append(summary)
-        progress_bar.progress((i + 1) / len(chunks))
-    
-    # 3. Reduce 阶段：汇总
-    status_text.text("正在整合全篇逻辑..." )
-    combined_text = "\n\n".join(chunk_summaries)
-    
-    final_prompt = f"""你已经阅读了论文的各个部分，以下是各部分的摘要汇总：
-    {combined_text}
-    
-    请根据上述汇总信息，重新生成一份结构清晰的**全文研读报告**。
-    请严格按照以下 Markdown 格式输出：
-    
-    ## 1. 基本信息
-    - **标题**：(尝试从内容推断)
-    - **核心贡献**：(用一句话概括)
 
-    ## 2. 详细摘要
-    - **研究背景 (Problem)**：
-    - **核心方法 (Method)**：
-    - **实验结果 (Result)**：
-    - **结论 (Conclusion)**：
+def start_job(kind, variant, fn, *args):
+    """
+    提交后台任务并记到当前会话。任务键 = 类型 + 论文指纹（见 paper_fingerprint）+ 版本（读者水平、降级比例等），
+    其他会话提交同一篇论文的相同任务时直接复用，不会重复调用模型
+    """
+    if not ensure_api_key():
+        return
+    key = f"{kind}:{paper_fingerprint()}:{variant}"
+    job = get_job_manager().submit(key, fn, *args)
+    st.session_state.jobs[kind] = job.id
+    # 立即重跑：页面顶部的任务面板在按钮之前渲染，重跑后才能开始轮询
+    st.rerun()
+
+
+def save_to_library(**artifacts):
+    """研读产物同步到文库（论文不在库中时忽略），以后在【我的文库】里可直接查看"""
+    if st.session_state.current_file_id:
+        get_library().set_artifacts(st.session_state.current_file_id.rsplit("_", 1)[-1], **artifacts)
+
+
+def apply_overview(result):
+    summary = result["summary"]
+    if result["bibtex"]:
+        summary += f"\n\n## BibTeX\n```bibtex\n{result['bibtex']}\n```"
+    st.session_state.paper_summary = summary
+    st.session_state.overview_tree = result["levels"]
+    save_to_library(overview=result["summary"], bibtex=result["bibtex"])
+    if result["failed_chunks"]:
+        parts = "、".join(str(i + 1) for i in result["failed_chunks"])
+        st.warning(f"第 {parts} 部分研读失败，概览中这些部分的信息可能缺失")
+
+
+def apply_mindmap(result):
+    st.session_state.mindmap_raw = result["raw"]
+    st.session_state.mindmap_code = result["code"]
+    save_to_library(mindmap=result["code"])
+    repair = result["repair"]
+    if repair["errors"]:
+        st.warning(f"导图中有 {len(repair['errors'])} 处语句无法修复，已略去")
+    elif repair["fixed"] or repair["reasked"]:
+        st.toast(f"已自动修正导图中的 {len(repair['fixed'])} 处语法问题" + ("（含一次定向修正）" if repair["reasked"] else ""))
+
+
+def apply_page_summary(result):
+    st.session_state.page_summary = result
+
+
+def apply_terms(result):
+    st.session_state.analysis_result = result
+    save_to_library(terms=result)
+    st.toast("术语已提取！请查看【📖 深度阅读 → 🧠 知识库】")
+
+
+def apply_experiment(result):
+    save_to_library(experiment=result)
+    st.session_state.chat_history.append({'role': 'assistant', 'content': f"📊 **实验数据提取结果**：\n\n{result}"})
+
+
+def apply_analysis(analysis):
+    """把分析产物放进各功能原本使用的会话状态，页面各处照常展示"""
+    artifacts = analysis["artifacts"]
+    if artifacts["overview"]:
+        st.session_state.paper_summary = artifacts["overview"]
+        if artifacts["bibtex"]:
+            st.session_state.paper_summary += f"\n\n## BibTeX\n```bibtex\n{artifacts['bibtex']}\n```"
+    if artifacts["mindmap"]:
+        st.session_state.mindmap_raw = artifacts["mindmap"]
+        st.session_state.mindmap_code = artifacts["mindmap"]
+    if artifacts["terms"]:
+        st.session_state.analysis_result = artifacts["terms"]
+    if artifacts["experiment"]:
+        st.session_state.experiment_result = artifacts["experiment"]
+    save_to_library(**{name: artifacts[name] for name in ANALYSIS_ARTIFACTS})
+    for name, error in analysis["errors"].items():
+        st.warning(f"「{FEATURE_LABELS.get(name, name)}」生成失败：{error}")
+
+
+JOB_APPLY = {
+    "overview": apply_overview,
+    "mindmap": apply_mindmap,
+    "terms": apply_terms,
+    "experiment": apply_experiment,
+    "analysis": apply_analysis,
+    "page_summary": apply_page_summary,
+}
+
+
+def collect_finished_jobs():
+    """把已完成任务的结果放进会话状态；失败或取消的任务留在面板上，等用户重试或关闭"""
+    manager = get_job_manager()
+    for kind, job_id in list(st.session_state.jobs.items()):
+        job = manager.get(job_id)
+        if job is None:
+            # 超过保留期被清理（通常是会话长时间无人访问）
+            del st.session_state.jobs[kind]
+        elif job.status == DONE:
+            JOB_APPLY[kind](job.result)
+            del st.session_state.jobs[kind]
+            st.toast(f"✅ {FEATURE_LABELS.get(kind, kind)}已完成（{job.snapshot()['elapsed']:.1f}s）")
+
+
+def render_job_panel():
+    """任务状态面板：进度、取消、重试。作为 fragment 定时刷新，只重跑这一小块"""
+    manager = get_job_manager()
+    for kind, job_id in list(st.session_state.jobs.items()):
+        job = manager.get(job_id)
+        if job is None:
+            continue
+        snap = job.snapshot()
+        label = FEATURE_LABELS.get(kind, kind)
+        active = snap["status"] in ACTIVE_STATES
+        if snap["status"] == DONE:
+            # 结果就绪：整页重跑，由 collect_finished_jobs 取回结果并刷新各展示区
+            st.rerun()
+        c_status, c_action = st.columns([4, 1])
+        with c_status:
+            if active:
+                stage = JOB_STAGE_LABELS.get(snap["stage"], "准备中") if snap["status"] == RUNNING else "排队中"
+                progress = snap["done"] / snap["total"] if snap["total"] else 0.0
+                note = "（正在取消…）" if snap["cancelling"] else ""
+                st.progress(progress, text=f"⏳ {label}：{stage} {snap['done']}/{snap['total']} · "
+                                           f"已用 {snap['elapsed']:.0f}s{note}")
+            elif snap["status"] == FAILED:
+                st.error(f"{label}失败：{snap['error']}")
+            else:
+                st.info(f"{label}已取消")
+        with c_action:
+            if active:
+                # 取消后任务在下一个进度点退出，面板下次刷新时显示结果
+                if st.button("取消", key=f"job_cancel_{kind}", use_container_width=True):
+                    manager.cancel(job_id)
+            else:
+                if st.button("重新开始", key=f"job_restart_{kind}", use_container_width=True):
+                    st.session_state.jobs[kind] = manager.restart(job_id).id
+                    st.rerun()
+                if st.button("关闭", key=f"job_dismiss_{kind}", use_container_width=True):
+                    del st.session_state.jobs[kind]
+                    st.rerun()
+
+
+def has_active_jobs(jobs):
+    """jobs（{任务类型: 任务 ID}）里是否还有排队或运行中的任务；内存账本会在其他会话的线程里调用"""
+    manager = get_job_manager()
+    return any((job := manager.get(job_id)) is not None and job.active for job_id in tuple(jobs.values()))
+
+
+def show_job_panel():
+    """有任务在跑时每 JOB_POLL_SECONDS 秒刷新一次面板；没有时不轮询"""
+    polling = has_active_jobs(st.session_state.jobs)
+    st.fragment(render_job_panel, run_every=JOB_POLL_SECONDS if polling else None)()
+
 
-    ## 3. 潜在局限与未来方向 (根据内容推断)
+# --- 问答检索：只把相关片段送给模型 ---
+
+# 检索用的分片比摘要分片更细，命中更精准
+RETRIEVAL_CHUNK_TOKENS = 400
+RETRIEVAL_OVERLAP_TOKENS = 50
+CHAT_TOP_K = 6
+CHAT_TOKEN_BUDGET = 3000
+
+
+def build_paper_index(raw_text, page_starts=()):
     """
-    
-    final_result = call_qwen(final_prompt)
-    progress_bar.empty()
-    status_text.empty()
-    return final_result
-
-# -------- 1) 清洗 Mermaid：去围栏、去杂话、只保留主图 --------
-def wrap_text(text, max_len=12):
-    """自动为长文本添加换行符"""
-    if not text:
-        return text
-    # 按最大长度分割文本
-    lines = []
-    current_line = ""
-    for char in text:
-        current_line += char
-        if len(current_line) >= max_len:
-            lines.append(current_line)
-            current_line = ""
-    if current_line:
-        lines.append(current_line)
-    return "<br/>".join(lines)
-
-def clean_mermaid(text: str) -> str:
-    if not text:
-        return ""
-
-    text = text.strip()
-
-    # A. 把 ```mermaid ... ``` 围栏剥掉（LLM最常见“夹带”）
-    import re
-    m = re.search(r"```(?:mermaid)?\s*(.*?)```", text, flags=re.S)
-    if m:
-        text = m.group(1).strip()
-
-    # B. 从第一个 Mermaid 图类型关键字开始截断，去掉前后说明
-    m2 = re.search(
-        r"(?s)\b(flowchart|graph|sequenceDiagram|stateDiagram|classDiagram|erDiagram|journey|gantt)\b.*",
-        text
+    每篇论文只建一次 BM25 索引；经内存账本共享，打开同一篇论文的所有会话共用一份。
+    page_starts: raw_text 的每页起始偏移，每个分片记下所在页码范围（index.meta），回答据此标注出处
+    """
+    spans = split_text_into_spans(raw_text, max_tokens=RETRIEVAL_CHUNK_TOKENS, overlap_tokens=RETRIEVAL_OVERLAP_TOKENS)
+    meta = [page_range(page_starts, s, e) for s, e in spans] if page_starts else None
+    return BM25Index([raw_text[s:e] for s, e in spans], meta=meta)
+
+
+def build_chat_context(question, index, raw_text, token_budget=CHAT_TOKEN_BUDGET):
+    """
+    返回 (前缀论文内容, 检索片段)，二者只有一个非空：
+    短论文整篇放进固定前缀（逐轮不变，可命中上下文缓存）；
+    长论文只取与问题最相关的 top-k 片段（受 Token 预算约束），放在本轮问题里
+    """
+    if estimate_tokens(raw_text) <= token_budget:
+        return raw_text, None
+    picked = index.select_context(question, top_k=CHAT_TOP_K, token_budget=token_budget)
+    return None, "\n\n".join(
+        f"[片段 {i + 1} · {format_page_range(*index.meta[i])}]\n{chunk}" if index.meta[i] else f"[片段 {i + 1}]\n{chunk}"
+        for i, chunk in picked
     )
-    if m2:
-        text = m2.group(0).strip()
-
-    # C. 常见隐藏字符清理（有时会导致语法问题）
-    text = text.replace("\u200b", "").replace("\ufeff", "")  # 零宽字符/BOM
-
-    # D. 处理长文本节点，添加换行符
-    # 查找所有节点定义：ID["文本"]
-    def replace_node(match):
-        id_part = match.group(1)
-        text_part = match.group(2)
-        # 检查是否已经包含换行符
-        if "<br/>" not in text_part:
-            # 如果没有换行符，自动添加
-            wrapped_text = wrap_text(text_part)
-            return f'{id_part}["{wrapped_text}"]'
-        return match.group(0)
-    
-    # 匹配节点定义：ID["文本"]
-    text = re.sub(r'(\w+)\["([^"]+)"\]', replace_node, text)
 
-    return text
 
+# --- 翻译工作台：分段并行 + 翻译记忆 ---
+
+TRANSLATION_TASKS = {"🔁 智能翻译 (中⇌英)": "translate", "✨ 学术润色": "polish", "🔴 语法纠错": "grammar"}
 
-# -------- 2) Mermaid 渲染（纯HTML注入，兼容 mermaid@10）--------
+
+def run_translation(text, task, result_box):
+    """
+    分段处理待处理片段：命中翻译记忆的段落直接取回，其余逐段判断语言后并发调用模型，按原顺序拼回。
+    只有一段时流式输出；多段时每完成一段刷新一次结果区。预算不足或缺少 Key 时返回 None
+    """
+    start = time.perf_counter()
+    segments = prepare_translation(text, task)
+    pending = [seg for seg in segments if seg["output"] is None]
+    if pending:
+        # 输入就是用户选定的片段，不做缩减：预算不足时直接拒绝
+        estimate = sum(estimate_tokens(build_translation_prompt(task, seg["core"], seg["lang"])) * 2
+                       for seg in pending) + QWEN_OUTPUT_TOKENS_ESTIMATE
+        if budget_gate("translation", estimate, allow_downgrade=False) is None or not ensure_api_key():
+            return None
+        if len(segments) == 1:
+            segment = segments[0]
+            with result_box.container(height=420):
+                output = st.write_stream(stream_messages(translation_messages(task, segment), feature="translation"))
+            if output:
+                segment["output"] = output.strip()
+                remember_translation(task, segment)
+        else:
+            def show_progress(done, total, index):
+                with result_box.container(height=420):
+                    st.caption(f"⏳ 已完成 {done}/{total} 段")
+                    st.text(assemble_translation(segments, task))
+
+            failures = translate_segments(segments, task, on_progress=show_progress,
+                                          meter=usage_meter("translation"))
+            if failures:
+                parts = "、".join(str(i + 1) for i in sorted(failures))
+                st.warning(f"第 {parts} 段处理失败，结果中保留了原文，可稍后重试（已完成的段落不会重复调用）")
+    hits = sum(seg["cached"] for seg in segments)
+    st.caption(f"共 {sum(bool(seg['lang']) for seg in segments)} 段 · 翻译记忆命中 {hits} 段 · "
+               f"耗时 {time.perf_counter() - start:.1f}s")
+    return assemble_translation(segments, task)
+
+
+# -------- Mermaid 渲染（纯HTML注入，兼容 mermaid@10）--------
 def render_mermaid(mermaid_code: str, height: int = 620):
+    """mermaid 使用单文件 UMD 版本，便于本地化托管（ESM 版本会再动态加载一串分块文件）"""
     mermaid_code = clean_mermaid(mermaid_code)
 
     html = f"""
@@ -654,9 +749,13 @@ def render_mermaid(mermaid_code: str, height: int = 620):
     {mermaid_code}
     </div>
 
-    <script type="module">
-      import mermaid from 'https://cdn.jsdelivr.net/npm/mermaid@10/dist/mermaid.esm.min.mjs';
-      mermaid.initialize({{ startOnLoad: true, securityLevel: 'loose' }});
+    {asset_loader(scripts=("mermaid.js",))}
+    <script>
+      // 脚本异步加载，页面 load 事件可能已经过去：不依赖 startOnLoad，就绪后手动渲染
+      assetsReady.then(function() {{
+        mermaid.initialize({{ startOnLoad: false, securityLevel: 'loose' }});
+        mermaid.run();
+      }});
     </script>
     """
 
@@ -664,53 +763,132 @@ def render_mermaid(mermaid_code: str, height: int = 620):
     components.html(html, height=height, scrolling=True)
 
 
-# -------- 3) 让 LLM “只输出纯 Mermaid”，避免语法炸点 --------
-def build_mermaid_prompt(full_text: str) -> str:
-    return f"""
-请基于全文生成 Mermaid 逻辑结构导图，严格遵循学术规范。
-
-【必须遵守】
-1) 输出必须以 flowchart TD 开头，只输出 Mermaid 代码本体。
-2) 每个节点必须写成：ID["显示文字"]（显示文字允许空格和中文）。
-   - ID 只能用 A1,A2,B1... 这种简短ID，禁止用驼峰词当ID。
-3) 逻辑关系表示：
-   - "-->"：主逻辑关系（论文真正给出的内容）
-   - "-.->"：说明/注释/非主逻辑（文献未明确给出的内容）
-4) 内容处理原则：
-   - 论文真正给出的结论 → 画在主逻辑链
-   - 文献未明确给出的结论 → 不作为主结论节点
-   - 如需说明信息缺失，用虚线说明节点，而不是"结论 → 未给出信息"
-5) 节点文本换行要求：
-   - 所有较长节点文本，必须在合适位置插入 <br/> 强制换行
-   - 不改语义，只做视觉换行
-   - 每行建议 10～14 个中文字符
-6) 必须提取论文中的具体内容填充到节点中：
-   - 背景：写出具体要解决什么难题？
-   - 方法：写出具体的算法名称、模块名称（如 "HGSTA算法", "混合策略"）。
-   - 实验：写出具体的提升数值（如 "锌耗降低 46kg"）。
-7) 示例结构（供参考）：
-   flowchart TD
-   A["背景"]
-   A --> B["区间数据相比点数据<br/>包含更多信息"]
-   A --> C["传统方法难以同时刻画<br/>区间范围和水平特征"]
-   
-   D["方法"]
-   D --> D1["提出区间自回归<br/>(ACI) 模型"]
-   D --> D2["采用最小距离估计<br/>进行参数估计"]
-   
-   E["实验结果"]
-   E --> F["结论"]
-   
-   F -.-> N["部分结论在文献中<br/>未明确报告"]
-
-【论文内容】
-{full_text}
-""".strip()
-
-def generate_mindmap_code(text):
-    """让 AI 生成 Mermaid 思维导图代码 (稳定版)"""
-    prompt = build_mermaid_prompt(text[:8000])  # 建议截断，避免太长
-    return call_qwen(prompt)
+# --- 我的文库：跨论文检索与问答 ---
+
+# 检索结果列表的条数（跨文库提问另按 LIBRARY_TOP_K / LIBRARY_CONTEXT_TOKENS 选段）
+LIBRARY_SEARCH_RESULTS = 20
+
+
+def run_library_question(question, file_hashes):
+    """只把检索得分最高的几段送给模型；返回 (回答, 引用的段落)，未执行时回答为 None"""
+    passages = select_library_passages(question, file_hashes)
+    if not passages:
+        st.warning("文库中没有找到与问题相关的段落，换个说法或关键词试试")
+        return None, []
+    ratio = budget_gate("library", estimate_library_question_tokens(question, passages))
+    if ratio is None:
+        return None, []
+    if ratio < 1.0:
+        passages = select_library_passages(question, file_hashes, token_budget=int(LIBRARY_CONTEXT_TOKENS * ratio))
+    with st.spinner(f"正在根据 {len(passages)} 段文献回答..."):
+        answer = call_qwen(
+            build_library_question_prompt(question, passages),
+            system_instruction=f"{default_system_instruction(reader_level)}\n\n{LIBRARY_SYSTEM_INSTRUCTION}",
+            feature="library",
+        )
+    return answer, passages
+
+
+def render_library_paper(library, file_hash):
+    paper = library.get(file_hash)
+    if paper is None:
+        return
+    st.caption(f"{paper['name']} · {len(paper['page_starts'])} 页 · {len(paper['text']):,} 字符 · "
+               f"加入于 {datetime.fromtimestamp(paper['added_at']).strftime('%Y-%m-%d %H:%M')}")
+    artifacts = paper["artifacts"]
+    if not artifacts:
+        st.caption("还没有研读产物：打开这篇论文生成概览、导图等之后会自动保存到这里")
+    for name in ANALYSIS_ARTIFACTS:
+        if not artifacts.get(name):
+            continue
+        with st.expander(FEATURE_LABELS.get(name, name)):
+            if name == "mindmap":
+                render_mermaid(artifacts[name], height=480)
+            elif name == "bibtex":
+                st.code(artifacts[name], language="bibtex")
+            else:
+                st.markdown(artifacts[name])
+    if st.button("🗑️ 移出文库", key="btn_library_remove"):
+        library.remove(file_hash)
+        st.session_state.library_result = None
+        st.rerun()
+
+
+def render_library():
+    library = get_library()
+    papers = library.papers()
+    if not papers:
+        st.info("文库还是空的：上传并解析的论文会自动加入文库，批处理（batch.py）处理过的论文也会收录进来")
+        return
+    titles = {p["file_hash"]: p["title"] for p in papers}
+
+    query = st.text_input("检索词或问题", key="library_query",
+                          placeholder='关键词，或用引号检索短语，如 "contrastive learning"')
+    scope = st.multiselect("只在这些论文中检索（留空为全部）", list(titles), format_func=titles.get,
+                           key="library_scope")
+    col_search, col_ask = st.columns(2)
+    search_clicked = col_search.button("🔍 检索段落", key="btn_library_search", use_container_width=True)
+    ask_clicked = col_ask.button("🤖 跨文库提问", key="btn_library_ask", use_container_width=True, type="primary")
+    file_hashes = scope or None
+    if (search_clicked or ask_clicked) and not query.strip():
+        st.warning("请先输入检索词或问题")
+    elif search_clicked:
+        start = time.perf_counter()
+        hits = library.search(query, top_k=LIBRARY_SEARCH_RESULTS, file_hashes=file_hashes)
+        st.session_state.library_result = {"query": query, "hits": hits, "answer": None,
+                                           "ms": (time.perf_counter() - start) * 1000}
+    elif ask_clicked:
+        answer, passages = run_library_question(query, file_hashes)
+        if answer:
+            st.session_state.library_result = {"query": query, "hits": passages, "answer": answer, "ms": None}
+
+    result = st.session_state.library_result
+    if result:
+        if result["answer"]:
+            st.markdown(f"#### 🤖 {result['query']}")
+            st.markdown(result["answer"])
+            st.caption(f"依据以下 {len(result['hits'])} 段文献：")
+        elif result["hits"]:
+            st.caption(f"「{result['query']}」命中 {len(result['hits'])} 段（{result['ms']:.1f} ms）")
+        else:
+            st.caption(f"「{result['query']}」没有命中；短语需按原顺序连续出现")
+        for i, hit in enumerate(result["hits"], 1):
+            with st.expander(f"{library_source_label(i, hit)} · 得分 {hit['score']:.2f}",
+                             expanded=not result["answer"] and i <= 3):
+                st.text(hit["text"].strip())
+
+    st.markdown("---")
+    st.markdown(f"#### 📚 已收录 {len(papers)} 篇")
+    st.dataframe(
+        [{"标题": p["title"], "文件": p["name"], "页数": p["pages"],
+          "研读产物": "、".join(FEATURE_LABELS.get(name, name) for name in p["artifacts"]),
+          "加入时间": datetime.fromtimestamp(p["added_at"]).strftime("%Y-%m-%d %H:%M")} for p in papers],
+        use_container_width=True, hide_index=True,
+    )
+    chosen = st.selectbox("查看论文", list(titles), format_func=titles.get, key="library_open")
+    if chosen:
+        render_library_paper(library, chosen)
+
+
+# 内存账本：空闲会话被驱逐时可以写盘的私有状态，以及存放共享对象（同一篇论文只存一份）的状态
+SPILLABLE_SESSION_KEYS = (
+    "chat_history", "chat_memory", "paper_summary", "analysis_result", "experiment_result",
+    "mindmap_code", "mindmap_raw", "overview_tree", "polished_result", "tmp_pdf_data", "page_summary",
+    "library_result",
+)
+SHARED_SESSION_KEYS = ("raw_text", "sections", "page_starts", "paper_index")
+
+# 会话标识与用量累加器：侧边栏用量面板会用到，需在侧边栏之前初始化
+if "session_id" not in st.session_state: st.session_state.session_id = uuid.uuid4().hex[:12]
+if "usage" not in st.session_state: st.session_state.usage = UsageTotals()
+
+# 登记本会话的内存占用，必要时驱逐其他空闲会话；本会话被驱逐过时在这里恢复状态，
+# 所以必须在下面各项状态设置默认值之前。驱逐发生在其他会话的线程里，需要传入底层的 SessionState；
+# 本轮运行结束（文件末尾 checkout）之前、以及还有在途后台任务时，本会话不会被驱逐
+raw_state = get_script_run_ctx().session_state
+get_memory_accountant().checkin(st.session_state.session_id, raw_state,
+                                SPILLABLE_SESSION_KEYS, SHARED_SESSION_KEYS,
+                                busy=lambda state=raw_state: "jobs" in state and has_active_jobs(state["jobs"]))
 
 # --- 侧边栏：配置区 ---
 with st.sidebar:
@@ -733,7 +911,69 @@ with st.sidebar:
     )
 
     st.markdown("---")
-    st.info("💡 **功能导航**：\n1. **概览**：使用滑窗+归纳策略生成深度全文分析，包含详细摘要和BibTeX引用\n2. **阅读**：左侧嵌入PDF原文（保留排版），右侧AI导师实时问答，智能知识库自动沉淀关键信息\n3. **润色**：智能翻译（中⇌英）、学术润色、语法纠错，支持PDF原文对照")
+    st.subheader("🔎 问答检索")
+    chat_token_budget = st.slider(
+        "问答上下文预算 (Token)",
+        min_value=1000,
+        max_value=12000,
+        value=CHAT_TOKEN_BUDGET,
+        step=500,
+        help="每次提问只发送与问题最相关的论文片段，总量不超过该预算"
+    )
+
+    st.markdown("---")
+    st.subheader("📊 用量统计")
+    session_token_budget = st.number_input(
+        "本会话 Token 预算（0 为不限）",
+        min_value=0,
+        value=SESSION_TOKEN_BUDGET,
+        step=10000,
+        help="操作执行前先估算消耗：超出剩余预算时缩减输入降级执行，远超时直接拒绝"
+    )
+    # 面板内容在脚本末尾填充，这样能反映本轮刚发生的调用
+    usage_panel = st.empty()
+
+    st.markdown("---")
+    st.info("💡 **功能导航**：\n1. **概览**：使用滑窗+归纳策略生成深度全文分析，包含详细摘要和BibTeX引用\n2. **阅读**：左侧嵌入PDF原文（保留排版），右侧AI导师实时问答，智能知识库自动沉淀关键信息\n3. **润色**：智能翻译（中⇌英）、学术润色、语法纠错，支持PDF原文对照\n4. **文库**：读过的论文自动收录，跨论文检索段落、提问")
+
+    # --- 响应缓存状态 ---
+    st.markdown("---")
+    st.subheader("🗄️ 响应缓存")
+    cache_stats = get_response_cache().stats()
+    st.caption(
+        f"命中 {cache_stats['hits']} 次 · 未命中 {cache_stats['misses']} 次 · "
+        f"已缓存 {cache_stats['entries']} 条（{cache_stats['bytes'] / 1024:.0f} KB）"
+    )
+    store_stats = get_text_store().stats()
+    st.caption(f"已解析论文 {store_stats['entries']} 篇（{store_stats['bytes'] / 1024 / 1024:.1f} MB）")
+    analysis_stats = get_analysis_store().stats()
+    st.caption(f"已完成一站式分析 {analysis_stats['entries']} 篇（{analysis_stats['bytes'] / 1024:.0f} KB）")
+    library_stats = get_library().stats()
+    st.caption(f"文库 {library_stats['papers']} 篇 · {library_stats['passages']} 个检索段落"
+               f"（索引 {library_stats['index_bytes'] / 1024 / 1024:.1f} MB，{library_stats['segments']} 段）")
+    limiter_stats = rate_limiter.stats()
+    breaker_label = {"closed": "正常", "half-open": "探测中", "open": "熔断中"}[circuit_breaker.state]
+    st.caption(
+        f"限流 {rate_limiter.qps:g} QPS / {rate_limiter.tpm:,} TPM · 排队 {limiter_stats['throttled']} 次"
+        f"（共 {limiter_stats['waited']:.1f}s）· 服务状态：{breaker_label}"
+    )
+    job_stats = get_job_manager().stats()
+    st.caption(f"后台任务：运行 {job_stats['running']} · 排队 {job_stats['pending']} · "
+               f"已完成 {job_stats['done']} · 失败 {job_stats['failed']}")
+    memory_stats = get_memory_accountant().stats(st.session_state.session_id)
+    mb = 1024 * 1024
+    st.caption(
+        f"内存：本会话 {memory_stats['session_bytes'] / mb:.1f} MB · 共享论文数据 {memory_stats['shared_objects']} 份"
+        f"（{memory_stats['shared_bytes'] / mb:.1f} MB）· {memory_stats['sessions']} 个会话合计 "
+        f"{memory_stats['total_bytes'] / mb:.0f} / {memory_stats['max_bytes'] / mb:.0f} MB"
+        f"（已转存磁盘：会话 {memory_stats['spilled_sessions']}，共享数据 {memory_stats['spilled_objects']}）"
+    )
+    tm_stats = get_translation_memory().stats()
+    st.caption(f"翻译记忆 {tm_stats['entries']} 段（{tm_stats['bytes'] / 1024:.0f} KB）· 命中 {tm_stats['hits']} 段")
+    if st.button("🧹 清空缓存", key="btn_clear_cache", use_container_width=True):
+        get_response_cache().clear()
+        get_translation_memory().clear()
+        st.rerun()
 
     # --- 新增：导出功能 (支持 Markdown 和 PDF) ---
     st.markdown("---")
@@ -801,12 +1041,42 @@ st.title("📄 PaperAgent Pro: 多模态论文助读")
 # 全局状态管理
 if "chat_history" not in st.session_state: st.session_state.chat_history = []
 if "raw_text" not in st.session_state: st.session_state.raw_text = ""
+# 识别到的章节（字符偏移），各功能据此只发送相关章节
+if "sections" not in st.session_state: st.session_state.sections = []
+# 每页在全文中的起始偏移（pages.py），用于按页取文、标注页码
+if "page_starts" not in st.session_state: st.session_state.page_starts = []
+# 当前全文由哪个解析引擎产出；与所选引擎不同时重新解析
+if "parsed_backend" not in st.session_state: st.session_state.parsed_backend = None
 if "analysis_result" not in st.session_state: st.session_state.analysis_result = None
 if "paper_summary" not in st.session_state: st.session_state.paper_summary = None 
 if "current_file_id" not in st.session_state: st.session_state.current_file_id = None
+if "paper_index" not in st.session_state: st.session_state.paper_index = None
+if "pdf_url" not in st.session_state: st.session_state.pdf_url = None
+if "experiment_result" not in st.session_state: st.session_state.experiment_result = None
+if "overview_tree" not in st.session_state: st.session_state.overview_tree = []
+# 按页总结的结果：{"label": "第 3–5 页", "summary": ...}
+if "page_summary" not in st.session_state: st.session_state.page_summary = None
+# 本会话提交的后台任务：{任务类型: 任务 ID}
+if "jobs" not in st.session_state: st.session_state.jobs = {}
+# 本篇论文是否已检查过保存的一站式分析结果
+if "analysis_checked" not in st.session_state: st.session_state.analysis_checked = False
+# 本篇论文是否已检查过文库（不在库中时自动加入）
+if "library_checked" not in st.session_state: st.session_state.library_checked = False
+# 文库检索/提问的最近一次结果：{"query", "hits", "answer", "ms"}
+if "library_result" not in st.session_state: st.session_state.library_result = None
+# 对话的滚动压缩记忆：chat_history[:chat_memory_upto] 已折叠进 chat_memory
+if "chat_memory" not in st.session_state: st.session_state.chat_memory = ""
+if "chat_memory_upto" not in st.session_state: st.session_state.chat_memory_upto = 0
 
 # 文件上传
 uploaded_file = st.file_uploader("📂 上传论文 (PDF)", type="pdf")
+pdf_backend = st.selectbox(
+    "解析引擎",
+    list(BACKENDS),
+    index=list(BACKENDS).index(DEFAULT_BACKEND),
+    format_func=PDF_BACKEND_LABELS.get,
+    help="快速引擎适合绝大多数论文；表格、公式较多或文字顺序错乱时切换到高保真重新解析。所选引擎失败时自动回退",
+)
 
 if uploaded_file:
     new_file_id = get_file_id(uploaded_file)
@@ -814,57 +1084,165 @@ if uploaded_file:
     # ✅ 文件变了：清空旧状态，强制重解析
     if st.session_state.current_file_id != new_file_id:
         st.session_state.current_file_id = new_file_id
+        st.session_state.pdf_url = None
 
         # 清空与论文相关的所有缓存/结果
         st.session_state.raw_text = ""
+        st.session_state.sections = []
+        st.session_state.page_starts = []
+        st.session_state.paper_index = None
+        st.session_state.parsed_backend = None
         st.session_state.paper_summary = None
+        st.session_state.page_summary = None
+        st.session_state.page_num = 0
         st.session_state.analysis_result = None
+        st.session_state.experiment_result = None
+        st.session_state.overview_tree = []
+        # 旧论文的任务不再跟踪（仍在后台跑完，结果进入响应缓存与分析结果存储）
+        st.session_state.jobs = {}
+        st.session_state.analysis_checked = False
+        st.session_state.library_checked = False
+        st.session_state.mindmap_code = None
         st.session_state.chat_history = []
+        st.session_state.chat_memory = ""
+        st.session_state.chat_memory_upto = 0
         st.session_state.polished_result = ""  # 可选：清空润色结果
 
+    # ✅ PDF 只在上传时写入静态目录一次，之后每次 rerun 只传 URL
+    file_hash = new_file_id.rsplit("_", 1)[-1]
+    if st.session_state.pdf_url is None or not is_published(file_hash):
+        st.session_state.pdf_url = publish_pdf(uploaded_file.getvalue(), file_hash)
+
+    # ✅ 换了解析引擎：同一篇论文按新引擎重新解析（已生成的概览、对话等保留）
+    if st.session_state.parsed_backend != pdf_backend:
+        st.session_state.parsed_backend = pdf_backend
+        st.session_state.raw_text = ""
+        st.session_state.sections = []
+        st.session_state.page_starts = []
+        st.session_state.paper_index = None
+    # 共享对象的键：同一篇论文的不同引擎解析结果不同
+    doc_key = f"{file_hash}-{pdf_backend}"
+
     # ✅ 需要解析时再解析
     if st.session_state.raw_text == "":
         with st.spinner("正在解析 PDF 全文..."):
-            st.session_state.raw_text = extract_text_from_pdf(uploaded_file)
+            text, sections, page_starts = extract_text_from_pdf(uploaded_file, pdf_backend)
+            if text:
+                # 多人打开同一篇论文时共用同一份全文、章节与页码索引
+                memory = get_memory_accountant()
+                text = memory.shared("text", doc_key, lambda: text, st.session_state.session_id)
+                sections = memory.shared("sections", doc_key, lambda: sections, st.session_state.session_id)
+                page_starts = memory.shared("pages", doc_key, lambda: page_starts, st.session_state.session_id)
+            st.session_state.raw_text, st.session_state.sections = text, sections
+            st.session_state.page_starts = page_starts
             st.success("解析成功！")
 
+    # ✅ 检索索引随论文构建一次（同一篇论文所有会话共用），之后每次提问直接复用；不含参考文献，免得检索命中文献列表
+    if st.session_state.raw_text and st.session_state.paper_index is None:
+        st.session_state.paper_index = get_memory_accountant().shared(
+            "index", doc_key, lambda: build_paper_index(*paper_scope_with_pages("chat")), st.session_state.session_id
+        )
+
+    # ✅ 解析好的论文自动收进文库（先于载入分析结果，载入的产物随之保存到文库）
+    if st.session_state.raw_text and not st.session_state.library_checked:
+        st.session_state.library_checked = True
+        if LIBRARY_AUTO_ADD and add_to_library(file_hash, uploaded_file.name, st.session_state.raw_text,
+                                               st.session_state.page_starts, st.session_state.sections):
+            st.toast("已加入我的文库，可在【📚 我的文库】中跨论文检索与提问")
+
+    # ✅ 这篇论文做过一站式分析（任意会话）就直接载入，不再调用模型
+    if st.session_state.raw_text and not st.session_state.analysis_checked:
+        st.session_state.analysis_checked = True
+        saved = load_analysis(file_hash, default_system_instruction(reader_level))
+        if saved is not None:
+            apply_analysis(saved)
+
 if st.session_state.raw_text:
-    
+    # ✅ 后台任务：先取回已完成的结果，再显示进行中任务的进度（定时刷新，不打断页面其他部分）
+    collect_finished_jobs()
+    show_job_panel()
+
     # 将 .info-card 应用于核心信息卡（原代码此处没有使用 class，现在加上以适配新样式）
-    tab0, tab1, tab2 = st.tabs(["🏠 智能概览", "📖 深度阅读", "✍️ 学术润色"])
+    tab0, tab1, tab2, tab3 = st.tabs(["🏠 智能概览", "📖 深度阅读", "✍️ 学术润色", "📚 我的文库"])
 
     # === 功能 0: 智能概览 (含思维导图) ===
     with tab0:
         st.markdown('<div class="info-card">', unsafe_allow_html=True)
         st.subheader("📑 论文核心信息卡")
 
+        # 一次遍历全文，同时生成概览、BibTeX、术语表、实验数据与逻辑导图
+        if st.button("⚡ 一站式分析（全部产物）", use_container_width=True, type="primary"):
+            # 参考文献、致谢等不参与分析
+            raw_text = paper_scope("overview")
+            system_instruction = default_system_instruction(reader_level)
+            saved = load_analysis(file_hash, system_instruction)
+            if saved is not None:
+                # 已保存的结果不消耗预算，直接载入
+                apply_analysis(saved)
+                st.success("已载入保存的分析结果，术语表与实验数据在【📖 深度阅读 → 🧠 知识库】")
+            elif (ratio := budget_gate("analysis", estimate_analysis_tokens(raw_text))) is not None:
+                # 降级执行时输入被缩减，结果不落盘，避免下次直接复用不完整的分析
+                start_job("analysis", f"{reader_level}:{ratio:.2f}", analysis_job, shrink_text(raw_text, ratio),
+                          system_instruction, MAP_MAX_WORKERS, usage_meter("analysis"),
+                          file_hash if ratio >= 1.0 else None)
+
         # 使用列布局放置两个大按钮
         c_act1, c_act2 = st.columns([1, 1])
         
         with c_act1:
             if st.button("🚀 生成深度概览 (Text)", use_container_width=True):
-                with st.spinner("AI 正在使用滑窗策略阅读全篇论文..."):
-                    summary = generate_map_reduce_summary(st.session_state.raw_text)
-                    st.session_state.paper_summary = summary
-                    
-                    # 额外生成 BibTeX
-                    bib_prompt = f"请根据论文前2000字，直接生成 BibTeX 格式。\n内容：{st.session_state.raw_text[:2000]}"
-                    bib_res = call_qwen(bib_prompt)
-                    if bib_res:
-                        st.session_state.paper_summary += f"\n\n## BibTeX\n```bibtex\n{bib_res}\n```"
+                raw_text = paper_scope("overview")
+                ratio = budget_gate(
+                    "overview",
+                    estimate_summary_tokens(raw_text) + estimate_tokens(build_bibtex_prompt(raw_text))
+                    + QWEN_OUTPUT_TOKENS_ESTIMATE,
+                )
+                if ratio is not None:
+                    start_job("overview", f"{reader_level}:{ratio:.2f}", overview_job, shrink_text(raw_text, ratio),
+                              default_system_instruction(reader_level), MAP_MAX_WORKERS,
+                              usage_meter("overview"), usage_meter("bibtex"))
 
         with c_act2:
             if st.button("🗺️ 生成逻辑导图 (Graph)", use_container_width=True):
-                with st.spinner("AI 正在梳理逻辑结构..."):
-                    if not st.session_state.raw_text:
-                        st.warning("请先上传并解析PDF")
-                    else:
-                        raw_code = generate_mindmap_code(st.session_state.raw_text)
-                        clean_code = clean_mermaid(raw_code)
-                        
-                        # 保存结果到会话状态
-                        st.session_state.mindmap_raw = raw_code
-                        st.session_state.mindmap_code = clean_code
+                if not st.session_state.raw_text:
+                    st.warning("请先上传并解析PDF")
+                else:
+                    # 优先用已有的分析笔记或深度概览的分片摘要（覆盖全篇，不再额外调用模型）；
+                    # 都没有时各章节等比例截取原文，导图能覆盖到实验与结论，而不只是论文前几页
+                    system_instruction = default_system_instruction(reader_level)
+                    mindmap_text, source = mindmap_source(paper_scope("overview"), system_instruction, file_hash)
+                    max_tokens = MINDMAP_NOTES_TOKENS
+                    if mindmap_text is None:
+                        mindmap_text, source = paper_scope("mindmap", MINDMAP_INPUT_TOKENS), "text"
+                        max_tokens = MINDMAP_INPUT_TOKENS
+                    ratio = budget_gate("mindmap", estimate_tokens(build_mindmap_prompt(mindmap_text, max_tokens))
+                                        + QWEN_OUTPUT_TOKENS_ESTIMATE)
+                    if ratio is not None:
+                        start_job("mindmap", f"{reader_level}:{source}:{ratio:.2f}", mindmap_job,
+                                  shrink_text(mindmap_text, ratio), system_instruction, usage_meter("mindmap"),
+                                  max_tokens)
+
+        # 只总结指定页：按页码索引切出这几页的原文，不发送全文
+        with st.expander("📑 按页总结（只发送所选页）"):
+            n_pages = max(1, page_count())
+            c_from, c_to, c_go = st.columns([1, 1, 1])
+            with c_from:
+                first_page = st.number_input("起始页", min_value=1, max_value=n_pages, value=1, key="summary_from")
+            with c_to:
+                last_page = st.number_input("结束页", min_value=1, max_value=n_pages, value=min(n_pages, 3),
+                                            key="summary_to")
+            with c_go:
+                st.write("")
+                if st.button("📑 总结所选页", use_container_width=True):
+                    first, last = sorted((first_page - 1, last_page - 1))
+                    text = pages_text(first, last)
+                    label = format_page_range(first, last)
+                    if not text.strip():
+                        st.warning(f"{label}没有文字（可能是扫描页），可先在「学术润色」页对其 OCR")
+                    elif (ratio := budget_gate("page_summary", estimate_summary_tokens(text))) is not None:
+                        start_job("page_summary", f"{first}-{last}:{reader_level}:{ratio:.2f}", page_summary_job,
+                                  shrink_text(text, ratio), label, default_system_instruction(reader_level),
+                                  MAP_MAX_WORKERS, usage_meter("page_summary"))
 
         st.divider()
 
@@ -883,8 +1261,17 @@ if st.session_state.raw_text:
         # 2. 展示文字概览 (如果已生成)
         if st.session_state.paper_summary:
             st.markdown("### 📝 深度概览")
+            if st.session_state.overview_tree:
+                levels = st.session_state.overview_tree
+                tree_shape = " → ".join(str(n) for n, _, _ in levels) + f" → {levels[-1][1]} → 1"
+                st.caption(f"🌲 归并树深度 {len(levels) + 1}（含最终汇总），各层摘要份数：{tree_shape}")
             st.markdown(st.session_state.paper_summary)
             st.info("💡 提示：你可以直接复制上方的 BibTeX 用于论文写作。")
+
+        # 3. 按页总结
+        if st.session_state.page_summary:
+            st.markdown(f"### 📑 {st.session_state.page_summary['label']}总结")
+            st.markdown(st.session_state.page_summary["summary"])
         
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -908,7 +1295,7 @@ if st.session_state.raw_text:
                     mime="application/pdf",
                     key="download_pdf_tab1"
                 )
-                display_pdf(uploaded_file)
+                display_pdf(st.session_state.pdf_url)
             
             # Panel B: 知识库 (自动汇集提取出的信息)
             with left_tab2:
@@ -929,7 +1316,23 @@ if st.session_state.raw_text:
                     st.divider()
                     has_content = True
                 
-                # 3. 提示信息
+                # 3. 展示实验数据（一站式分析产出）
+                if st.session_state.experiment_result:
+                    st.markdown("### 📊 实验数据")
+                    st.markdown(st.session_state.experiment_result)
+                    st.divider()
+                    has_content = True
+
+                # 4. 识别到的章节结构（各功能据此只发送相关章节）
+                if st.session_state.sections:
+                    with st.expander("🗂️ 章节结构"):
+                        raw_text = st.session_state.raw_text
+                        for sec in st.session_state.sections:
+                            title = sec["title"] or "（标题与作者信息）"
+                            tokens = estimate_tokens(raw_text[sec["start"]:sec["end"]])
+                            st.markdown(f"- **{SECTION_LABELS.get(sec['kind'], sec['kind'])}** · {title} · 约 {tokens:,} Token")
+
+                # 5. 提示信息
                 if not has_content:
                     st.info("👈 这里是智能知识库。\n\n当你在右侧点击 **'提取核心术语'** 或在概览页生成 **'摘要'** 后，AI 提炼的干货会自动沉淀在这里，方便你随时查阅，无需翻找聊天记录。")
                 
@@ -946,28 +1349,24 @@ if st.session_state.raw_text:
             
             with c_btn1:
                 if st.button("🔍 提取核心术语", key="btn_term", use_container_width=True):
-                    prompt = f"""请阅读以下论文片段，提取5-8个关键术语。
-                    必须输出Markdown表格，包含列：| 术语 | 通俗比喻 | 学术定义 |。
-                    论文片段（前2000字）：{st.session_state.raw_text[:2000]}"""
-                    with st.spinner("正在提取术语..."):
-                        res = call_qwen(prompt)
-                        if res:
-                            st.session_state.analysis_result = res
-                            st.success("已提取！请查看左侧【🧠 知识库】面板")
-                            st.rerun()
+                    prompt = build_terms_prompt(paper_scope("terms"))
+                    estimate = estimate_tokens(prompt) + QWEN_OUTPUT_TOKENS_ESTIMATE
+                    if budget_gate("terms", estimate, allow_downgrade=False) is not None:
+                        messages = build_messages(prompt, system_instruction=default_system_instruction(reader_level))
+                        start_job("terms", reader_level, request_job, messages, usage_meter("terms"))
 
             with c_btn2:
                 if st.button("📊 提取实验数据", key="btn_data", use_container_width=True):
-                    prompt_data = f"""请阅读全文，专门提取实验部分的关键信息：
-                    1. 使用了哪些数据集？
-                    2. 对比了哪些 Baseline 方法？
-                    3. 核心指标提升了多少？
-                    请用列表形式简明扼要地回答。
-                    论文内容：{st.session_state.raw_text}"""
-                    with st.spinner("正在挖掘数据..."):
-                        res_data = call_qwen(prompt_data)
-                        st.session_state.chat_history.append({'role': 'assistant', 'content': f"📊 **实验数据提取结果**：\n\n{res_data}"})
-                        st.rerun()
+                    # 只发送实验与讨论章节；识别不到时退回去掉参考文献的正文
+                    experiment_text = paper_scope("experiment")
+                    ratio = budget_gate(
+                        "experiment", estimate_tokens(experiment_text) + QWEN_OUTPUT_TOKENS_ESTIMATE
+                    )
+                    if ratio is not None:
+                        prefix = build_paper_prefix(default_system_instruction(reader_level),
+                                                    shrink_text(experiment_text, ratio))
+                        start_job("experiment", f"{reader_level}:{ratio:.2f}", request_job,
+                                  build_chat_messages(prefix, EXPERIMENT_PROMPT), usage_meter("experiment"))
 
             st.markdown('</div>', unsafe_allow_html=True)
 
@@ -983,15 +1382,67 @@ if st.session_state.raw_text:
                     st.chat_message("user").write(user_input)
                 st.session_state.chat_history.append({'role': 'user', 'content': user_input})
 
-                context = f"基于论文内容：\n{st.session_state.raw_text}\n\n用户问题：{user_input}"
-                
-                with chat_container:
-                    with st.chat_message("assistant"):
-                        with st.spinner("思考中..."):
-                            response = call_qwen(context, history=st.session_state.chat_history[:-1])
+                # 上下文取论文全文与检索预算中较小者；预算紧张时缩小检索预算（降级）
+                memory = st.session_state.chat_memory
+                turns = st.session_state.chat_history[st.session_state.chat_memory_upto:-1]
+                # 论文内容带页码标记，回答据此标注出处
+                chat_text, _ = paper_scope_with_pages("chat")
+                context_tokens = min(chat_token_budget, estimate_tokens(chat_text))
+                history_tokens = estimate_tokens(memory) + sum(estimate_tokens(m['content']) for m in turns)
+                chat_estimate = context_tokens + history_tokens + QWEN_OUTPUT_TOKENS_ESTIMATE
+                ratio = budget_gate("chat", chat_estimate)
+                if ratio is None or not ensure_api_key():
+                    # 预算不足或缺少 Key：撤回这条提问，不发请求
+                    st.session_state.chat_history.pop()
+                else:
+                    paper_text, snippets = build_chat_context(
+                        user_input,
+                        st.session_state.paper_index,
+                        chat_text,
+                        token_budget=max(200, int(chat_token_budget * ratio)),
+                    )
+                    system_instruction = default_system_instruction(reader_level)
+                    # 固定前缀（System Prompt + 论文）→ 压缩记忆 → 最近几轮 → 本轮问题
+                    messages = build_chat_messages(
+                        build_paper_prefix(system_instruction, paper_text, cite_pages=True),
+                        user_input,
+                        memory=memory,
+                        turns=turns,
+                        snippets=snippets,
+                    )
+
+                    with chat_container:
+                        with st.chat_message("assistant"):
+                            stream_stats = {}
+                            # 对话追问希望每次得到新的回答，不走响应缓存
+                            response = st.write_stream(stream_messages(
+                                messages,
+                                use_cache=False,
+                                stats=stream_stats,
+                                feature="chat"
+                            ))
                             if response:
-                                st.write(response)
                                 st.session_state.chat_history.append({'role': 'assistant', 'content': response})
+                                if stream_stats.get("ttft") is not None:
+                                    caption = f"⏱️ 首字 {stream_stats['ttft']:.2f}s · 完成 {stream_stats['total']:.2f}s"
+                                    if stream_stats.get("prompt_tokens"):
+                                        hit = stream_stats["cached_tokens"] / stream_stats["prompt_tokens"]
+                                        caption += (f" · 输入 {stream_stats['prompt_tokens']:,} Token，"
+                                                    f"上下文缓存命中 {stream_stats['cached_tokens']:,}（{hit:.0%}）")
+                                    st.caption(caption)
+
+                    # 未折叠的历史过长时，把较早的几轮滚动压缩进记忆
+                    history = st.session_state.chat_history
+                    fold_to = split_chat_history(history, st.session_state.chat_memory_upto)
+                    if fold_to > st.session_state.chat_memory_upto:
+                        with st.spinner("正在整理对话记忆..."):
+                            st.session_state.chat_memory = compress_memory(
+                                memory,
+                                history[st.session_state.chat_memory_upto:fold_to],
+                                system_instruction,
+                                meter=usage_meter("chat"),
+                            )
+                        st.session_state.chat_memory_upto = fold_to
 
     # === 功能 2: 沉浸式翻译工作台 (PDF 原文对照版) ===
     with tab2:
@@ -1010,7 +1461,7 @@ if st.session_state.raw_text:
         with c_mode:
             task_type = st.radio(
                 "🎯 任务模式",
-                ("🔁 智能翻译 (中⇌英)", "✨ 学术润色", "🔴 语法纠错"),
+                tuple(TRANSLATION_TASKS),
                 horizontal=True,
                 label_visibility="collapsed",
                 key="task_type"
@@ -1041,32 +1492,58 @@ if st.session_state.raw_text:
                     key="download_pdf_tab2"
                 )
                 # 使用可复制版本的PDF显示
-                display_pdf_selectable(uploaded_file, height=700)
+                display_pdf_selectable(st.session_state.pdf_url, height=700)
                 
-                # 添加翻页控制
+                # 添加翻页控制（页码与解析出的逐页文本对应，可直接取当前页原文）
+                n_pages = max(1, page_count())
                 if "page_num" not in st.session_state:
                     st.session_state.page_num = 0  # 0-based
-                
+                st.session_state.page_num = min(st.session_state.page_num, n_pages - 1)
+
                 c1, c2, c3 = st.columns([1, 1, 2])
                 with c1:
                     if st.button("Prev Page"):
                         st.session_state.page_num = max(0, st.session_state.page_num - 1)
                 with c2:
                     if st.button("Next Page"):
-                        st.session_state.page_num = st.session_state.page_num + 1
-                
+                        st.session_state.page_num = min(n_pages - 1, st.session_state.page_num + 1)
+
                 with c3:
-                    st.write(f"当前页: {st.session_state.page_num + 1}")
-                
-                # 添加OCR功能（使用占位符，避免依赖缺失）
-                if st.button("🔎 OCR 当前页（可复制）"):
+                    st.write(f"当前页: {st.session_state.page_num + 1} / {n_pages}")
+
+                # 本机 OCR 不可用的原因（None 表示可用），扫描页提示与 OCR 按钮都用它
+                ocr_reason = ocr_status()[1]
+
+                # 把当前页的原文填进待处理片段，翻译/润色只针对这一页
+                if st.button("📄 载入当前页原文"):
+                    page = st.session_state.page_num
+                    text = pages_text(page).strip()
+                    if text:
+                        st.session_state.input_clip = text  # ✅ 自动填入“待处理片段”
+                        st.success(f"已载入{format_page_range(page)}原文，点击“立即执行”即可翻译/润色这一页。")
+                    elif ocr_reason:
+                        st.warning(f"{format_page_range(page)}没有文字层（可能是扫描页），本机 OCR 不可用：{ocr_reason}")
+                    else:
+                        st.warning(f"{format_page_range(page)}没有文字层（可能是扫描页），可点击下方“OCR 当前页”识别")
+
+                # 对当前页做本地 OCR（扫描页、图片里的文字），结果按页缓存，再次点击直接读取；
+                # Tesseract 不可用时按钮置灰并说明原因
+                if ocr_reason:
+                    st.caption(f"🔎 OCR 不可用：{ocr_reason}")
+                if st.button("🔎 OCR 当前页（可复制）", disabled=bool(ocr_reason)):
+                    page = st.session_state.page_num
                     with st.spinner("正在 OCR..."):
-                        # 由于环境中缺少必要的OCR依赖，使用占位符实现
-                        # 实际使用时，需要安装 pytesseract、pdf2image 和相关系统依赖
-                        placeholder_text = f"这是第 {st.session_state.page_num + 1} 页的OCR结果示例。\n\n在实际环境中，这里会显示从PDF页面识别出的真实文本。\n\n要启用完整的OCR功能，请安装以下依赖：\n1. pip install pytesseract pdf2image Pillow\n2. 安装Tesseract OCR引擎\n3. 安装Poppler（用于PDF转图像）\n\n安装完成后，请取消注释代码中的OCR相关函数。"
-                        st.session_state.input_clip = placeholder_text  # ✅ 自动填入“待处理片段”
-                        st.success("OCR 完成：已自动填入待处理片段，可直接点击“立即执行”翻译。")
-                
+                        try:
+                            text = ocr_pdf_pages(uploaded_file.getvalue(), [page]).get(page)
+                        except OcrUnavailable as e:
+                            st.error(f"无法 OCR：{e}")
+                        else:
+                            if text:
+                                st.session_state.input_clip = text  # ✅ 自动填入“待处理片段”
+                                st.success("OCR 完成：已自动填入待处理片段，可直接点击“立即执行”翻译。")
+                            else:
+                                st.warning(f"第 {page + 1} 页没有识别出文字（页码超出范围或页面无法渲染）")
+
             else:
                 # 否则显示自由粘贴区
                 st.markdown("**📄 自由粘贴区 (无 PDF 时使用)**")
@@ -1097,7 +1574,9 @@ if st.session_state.raw_text:
                 submitted = st.form_submit_button("🚀 立即执行")
 
             st.markdown("**📝 AI 结果**")
-            st.text_area(
+            # 占位区：平时显示上一次的结果，执行时在这里流式输出
+            result_box = st.empty()
+            result_box.text_area(
                 "Result",
                 value=st.session_state.get("polished_result", ""),
                 height=420,
@@ -1110,23 +1589,22 @@ if st.session_state.raw_text:
             if not target_input:
                 st.warning("请先粘贴待处理片段")
             else:
-                prompt_task = ""
-                system_role = "你是一位资深的 Nature/Science 期刊审稿人。"
-
-                if "智能翻译" in task_type:
-                    contains_chinese = bool(re.search(r'[\u4e00-\u9fa5]', target_input))
-                    prompt_task = (
-                        f"请将以下中文翻译成**地道的学术英文 (SCI风格)**：\n\n{target_input}"
-                        if contains_chinese else
-                        f"请将以下英文翻译成**通俗流畅的学术中文**：\n\n{target_input}"
-                    )
-                elif "学术润色" in task_type:
-                    prompt_task = f"请润色以下段落，提升词汇高级感和语法准确性：\n\n{target_input}"
-                else:
-                    prompt_task = f"请找出以下段落的语法错误并给出修改建议：\n\n{target_input}"
+                result = run_translation(target_input, TRANSLATION_TASKS[task_type], result_box)
+                if result is not None:
+                    st.session_state.polished_result = result
 
-                with st.spinner("AI 正在处理..."):
-                    st.session_state.polished_result = call_qwen(prompt_task, system_instruction=system_role)
+    # === 功能 3: 我的文库 ===
+    with tab3:
+        render_library()
 
 else:
     st.info("👋 请在左侧上传 PDF 开始体验 PaperAgent Pro！")
+    st.subheader("📚 我的文库")
+    render_library()
+
+# 用量面板放在最后渲染，包含本轮脚本执行中发生的所有调用
+with usage_panel.container():
+    render_usage_panel()
+
+# 本轮运行结束：从这里开始计算空闲时长
+get_memory_accountant().checkout(st.session_state.session_id)
@@ -0,0 +1,165 @@
+"""
+本地 OCR（Tesseract）：只识别没有文字层的页面
+
+扫描版论文或插图页用 pdf_extract 抽不到文字。这里对这些页：
+- 用 PDFium 在内存里把单页渲染成灰度位图（不写临时 PDF，不依赖 poppler/pdf2image）
+- 交给 Tesseract（pytesseract）识别，多页时按页分给进程池
+- 结果按 (内容哈希, 页码, dpi, 语言) 缓存到 OcrStore，同一页只识别一次
+
+pytesseract 与 tesseract 程序是可选依赖：缺失时 ocr_status() 给出具体原因，
+ocr_pages 抛出带该原因的 OcrUnavailable，解析流程照常进行，只是这些页保持空白。
+工作函数定义在这个可导入的模块里、进程池同样由 forkserver 启动，原因同 pdf_extract。
+"""
+import functools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_extract import PdfiumBackend, pool_context
+
+logger = logging.getLogger("paperagent")
+
+# 渲染分辨率：200 dpi 对 10pt 正文已经足够，识别耗时与内存约为 300 dpi 的一半
+OCR_DPI = int(os.environ.get("PAPERAGENT_OCR_DPI", "200"))
+# 希望使用的识别语言；只启用本机 tesseract 实际安装了的那些
+OCR_LANG = os.environ.get("PAPERAGENT_OCR_LANG", "eng+chi_sim")
+# 解析时是否自动识别无文字层的页（0 关闭；页面上的 “OCR 当前页” 不受影响）
+OCR_ENABLED = os.environ.get("PAPERAGENT_OCR", "1") != "0"
+# 单页识别超时（秒），超时由 pytesseract 结束 tesseract 进程
+OCR_PAGE_TIMEOUT = 60
+# 去掉空白后少于这么多字符的页视为没有文字层（扫描页上常只剩页码、水印）
+OCR_MIN_CHARS = 10
+
+
+class OcrUnavailable(RuntimeError):
+    """本机没有可用的 Tesseract（未安装 pytesseract / tesseract 程序，或没有所需语言包）"""
+
+
+@functools.lru_cache(maxsize=1)
+def ocr_status():
+    """
+    (本机可用的识别语言如 "eng+chi_sim", 不可用的原因)。可用时原因为 None，不可用时语言为空串；
+    原因区分未装 pytesseract、找不到 tesseract 程序、缺少语言包，供页面直接展示。结果在进程内缓存
+    """
+    try:
+        import pytesseract
+    except ImportError:
+        reason = "未安装 pytesseract（pip install pytesseract）"
+        logger.info("tesseract OCR unavailable: %s", reason)
+        return "", reason
+    try:
+        installed = set(pytesseract.get_languages(config=""))
+    except Exception as e:
+        logger.warning("tesseract OCR unavailable: %s", e)
+        return "", f"找不到可用的 tesseract 程序（{e}），需另行安装，如 apt install tesseract-ocr tesseract-ocr-chi-sim"
+    wanted = [lang for lang in OCR_LANG.split("+") if lang in installed]
+    if not wanted:
+        logger.warning("none of the OCR languages %r are installed (have: %s)", OCR_LANG, sorted(installed))
+        have = "、".join(sorted(installed)) or "无"
+        return "", f"tesseract 没有安装所需语言包 {OCR_LANG}（已安装：{have}）"
+    return "+".join(wanted), None
+
+
+def ocr_languages():
+    """本机可用的识别语言，Tesseract 不可用时返回空串；原因见 ocr_status"""
+    return ocr_status()[0]
+
+
+def blank_pages(pages, skip=()):
+    """没有文字层的页码（skip 中的页除外，如解析超时的页）"""
+    skip = set(skip)
+    return [i for i, text in enumerate(pages) if i not in skip and len("".join(text.split())) < OCR_MIN_CHARS]
+
+
+def _render(doc, index, dpi):
+    """把一页渲染成灰度 PIL 图像。to_pil() 与 PDFium 位图共用内存，复制一份后立即释放位图"""
+    page = doc[index]
+    try:
+        bitmap = page.render(scale=dpi / 72, grayscale=True)
+        try:
+            return bitmap.to_pil().copy()
+        finally:
+            bitmap.close()
+    finally:
+        page.close()
+
+
+def _recognize(image, lang):
+    import pytesseract
+
+    return pytesseract.image_to_string(image, lang=lang, timeout=OCR_PAGE_TIMEOUT).strip()
+
+
+# --- 进程池工作函数 ---
+# 与 pdf_extract 一样，PDF 字节只在工作进程初始化时传一次
+
+_worker_doc = None
+
+
+def _init_worker(data):
+    global _worker_doc
+    import pypdfium2
+
+    # 多个 tesseract 进程并行时各自只用一个线程，避免 OpenMP 线程数超过核数后互相争抢
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    _worker_doc = pypdfium2.PdfDocument(data)
+
+
+def _ocr_in_worker(index, dpi, lang):
+    try:
+        return _recognize(_render(_worker_doc, index, dpi), lang)
+    except Exception as e:
+        logger.warning("OCR failed on page %d: %s", index + 1, e)
+        return None
+
+
+def _ocr_serial(data, indices, dpi, lang):
+    import pypdfium2
+
+    # PDFium 不是线程安全的：所有 PDFium 调用与其他会话的解析共用同一把锁，识别在锁外进行
+    with PdfiumBackend.lock:
+        doc = pypdfium2.PdfDocument(data)
+    results = {}
+    try:
+        for index in indices:
+            try:
+                with PdfiumBackend.lock:
+                    image = _render(doc, index, dpi)
+                results[index] = _recognize(image, lang)
+            except Exception as e:
+                logger.warning("OCR failed on page %d: %s", index + 1, e)
+                results[index] = None
+    finally:
+        with PdfiumBackend.lock:
+            doc.close()
+    return results
+
+
+def ocr_pages(data, indices, file_hash=None, dpi=OCR_DPI, store=None, max_workers=None):
+    """
+    识别 indices 中的页（0 起），返回 {页码: 文本}；识别失败的页不在结果里，下次还会重试。
+    file_hash + store: 结果缓存（OcrStore），已识别过的页直接读取
+    max_workers: 进程数上限，默认取 CPU 核数；只有一页或为 1 时在当前进程里识别
+    Tesseract 不可用时抛出 OcrUnavailable（缓存命中的页也不返回，保持行为一致）
+    """
+    lang, reason = ocr_status()
+    if not lang:
+        raise OcrUnavailable(reason)
+    indices = sorted(set(indices))
+    results = store.get_many(file_hash, indices, dpi, lang) if store is not None else {}
+    todo = [i for i in indices if i not in results]
+    if not todo:
+        return results
+
+    workers = min(max_workers or os.cpu_count() or 1, len(todo))
+    if workers <= 1:
+        recognized = _ocr_serial(data, todo, dpi, lang)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(),
+                                 initializer=_init_worker, initargs=(data,)) as pool:
+            recognized = dict(zip(todo, pool.map(_ocr_in_worker, todo, [dpi] * len(todo), [lang] * len(todo))))
+    recognized = {i: text for i, text in recognized.items() if text is not None}
+    if store is not None:
+        store.put_many(file_hash, recognized, dpi, lang)
+    results.update(recognized)
+    return results
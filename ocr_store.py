@@ -0,0 +1,64 @@
+"""
+OCR 结果的持久化存储（SQLite）
+
+以 (PDF 内容哈希, 页码, dpi, 识别语言) 为键保存单页识别文本。
+扫描版论文再次上传、或在页面上对同一页重复点 “OCR 当前页” 时直接读取，不再渲染和识别。
+"""
+import time
+
+from sqlite_store import SqliteLruStore
+
+
+class OcrStore(SqliteLruStore):
+    """单页 OCR 文本存储；连接、淘汰与统计见 SqliteLruStore"""
+
+    MAX_BYTES = 200 * 1024 * 1024
+    TABLE = "ocr_pages"
+    COLUMNS = """
+        file_hash TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        dpi INTEGER NOT NULL,
+        lang TEXT NOT NULL,
+        text TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (file_hash, page, dpi, lang)
+    """
+
+    def get_many(self, file_hash, pages, dpi, lang):
+        """返回 {页码: 文本}，只包含已识别过的页"""
+        pages = list(pages)
+        if not pages:
+            return {}
+        placeholders = ",".join("?" * len(pages))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT page, text FROM ocr_pages WHERE file_hash = ? AND dpi = ? AND lang = ? "
+                f"AND page IN ({placeholders})",
+                (file_hash, dpi, lang, *pages),
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    f"UPDATE ocr_pages SET accessed_at = ? WHERE file_hash = ? AND dpi = ? AND lang = ? "
+                    f"AND page IN ({placeholders})",
+                    (time.time(), file_hash, dpi, lang, *pages),
+                )
+        return dict(rows)
+
+    def put_many(self, file_hash, texts, dpi, lang):
+        """texts: {页码: 文本}"""
+        if not texts:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO ocr_pages
+                    (file_hash, page, dpi, lang, text, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(file_hash, page, dpi, lang, text, len(text.encode("utf-8")), now, now)
+                 for page, text in texts.items()],
+            )
+            self._evict(conn)
@@ -0,0 +1,94 @@
+"""
+页码索引：全文字符偏移 <-> PDF 页码
+
+全文由逐页文本拼接而成（每页后接一个换行，空白页不占位置）。拼接时记下每页在全文中的起始偏移
+page_starts（长度等于页数，只有整数，300 页的论文也只有几 KB），之后：
+- 任意字符位置用二分查找映射回页码（检索片段、章节都能标出所在页）
+- 取某几页的原文只是一次切片（翻译当前页、按页范围总结）
+页码在内部一律从 0 开始，只在展示时加 1。
+"""
+from bisect import bisect_right
+
+
+def join_pages(pages):
+    """逐页文本 -> (全文, page_starts)；空白页的起始偏移与下一页相同"""
+    parts, page_starts, offset = [], [], 0
+    for page_text in pages:
+        page_starts.append(offset)
+        if page_text:
+            parts.append(page_text + "\n")
+            offset += len(page_text) + 1
+    return "".join(parts), page_starts
+
+
+def page_of(page_starts, pos):
+    """字符位置所在的页码；空白页与下一页起点相同，二分查找总是落在有文字的那一页"""
+    if not page_starts:
+        return 0
+    return max(0, bisect_right(page_starts, pos) - 1)
+
+
+def page_range(page_starts, start, end):
+    """字符区间 [start, end) 覆盖的页码范围 (首页, 末页)"""
+    return page_of(page_starts, start), page_of(page_starts, max(start, end - 1))
+
+
+def page_bounds(page_starts, text_len, first, last=None):
+    """第 first..last 页（含两端）在全文中的字符区间 (start, end)；页码超出范围时截到首末页"""
+    if not page_starts:
+        return 0, text_len
+    last = first if last is None else last
+    first = min(max(first, 0), len(page_starts) - 1)
+    last = min(max(last, first), len(page_starts) - 1)
+    end = page_starts[last + 1] if last + 1 < len(page_starts) else text_len
+    return page_starts[first], end
+
+
+def format_page_range(first, last=None):
+    """(2, 4) -> “第 3–5 页”"""
+    if last is None or last == first:
+        return f"第 {first + 1} 页"
+    return f"第 {first + 1}–{last + 1} 页"
+
+
+def page_marker(page):
+    return f"【第 {page + 1} 页】\n"
+
+
+def mark_pages(text, page_starts, spans=None):
+    """
+    取 spans（[(start, end), ...]，按原文顺序；默认全文）中的文本，在每个片段开头和片段内每一页的起点
+    插入页码标记（【第 N 页】），模型回答时据此标注出处。
+    返回 (带标记的文本, 该文本的 page_starts)：新文本里每页从它的标记开始，未选中的页与下一页起点相同
+    """
+    if spans is None:
+        spans = [(0, len(text))]
+    if not page_starts:
+        return "".join(text[s:e] for s, e in spans), []
+    n_pages = len(page_starts)
+    parts, marked_starts, length = [], [], 0
+    last_end, last_page = None, None
+    for start, end in spans:
+        if start >= end:
+            continue
+        pos = start
+        while pos < end:
+            page = page_of(page_starts, pos)
+            page_end = min(end, page_starts[page + 1] if page + 1 < n_pages else len(text))
+            page_end = max(page_end, pos + 1)
+            # 跳过的页（未选中或空白）起点记为当前位置，保证 marked_starts 单调不减
+            while len(marked_starts) <= page:
+                marked_starts.append(length)
+            # 紧接上一片段、仍在同一页时不重复标记
+            if pos != last_end or page != last_page:
+                marker = page_marker(page)
+                if parts and not parts[-1].endswith("\n"):
+                    marker = "\n" + marker
+                parts.append(marker)
+                length += len(marker)
+            parts.append(text[pos:page_end])
+            length += page_end - pos
+            pos, last_end, last_page = page_end, page_end, page
+    while len(marked_starts) < n_pages:
+        marked_starts.append(length)
+    return "".join(parts), marked_starts
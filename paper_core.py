@@ -0,0 +1,1632 @@
+"""
+PaperAgent 核心流程（不依赖 Streamlit）
+
+PDF 解析、DashScope 调用、Map-Reduce 摘要、BibTeX 与逻辑导图生成、一站式全量分析都在这里，
+页面脚本 main.py 与命令行批处理 batch.py 共用同一套实现。
+这里的函数不调用任何 st.* 接口，失败时抛出异常，由调用方决定如何展示。
+
+重量级依赖（dashscope、pdfplumber、fpdf2）都在首次使用时才导入：
+仅导入本模块只需标准库和几个轻量的本地模块，页面冷启动与批处理启动都不再为它们买单。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from http import HTTPStatus
+
+from analysis_store import AnalysisStore
+from chunking import estimate_tokens, split_text_into_chunks, split_text_into_spans, truncate_to_tokens
+from flowchart import repair_flowchart
+from llm_cache import CACHE_DIR, ResponseCache, make_cache_key
+from ocr_store import OcrStore
+from pages import format_page_range, join_pages
+from rate_limit import CircuitBreaker, CircuitOpenError, RateLimiter, backoff_delay, is_retryable_status
+from sections import detect_sections, section_spans
+from session_memory import SESSION_IDLE_SECONDS, MemoryAccountant
+from text_store import TextStore
+from translation_memory import TranslationMemory, make_segment_key
+from job_manager import JobManager
+from library import LIBRARY_DIR, PaperLibrary
+from usage_tracker import UsageTracker
+
+logger = logging.getLogger("paperagent")
+
+DEFAULT_MODEL = "qwen-turbo"
+DEFAULT_READER_LEVEL = "初级研究员 (学术+直观)"
+
+
+# --- 进程级单例：响应缓存、解析结果/OCR/分析结果存储、翻译记忆、文库、后台任务、内存账本 ---
+
+_singleton_lock = threading.Lock()
+_response_cache = None
+_text_store = None
+_ocr_store = None
+_usage_tracker = None
+_analysis_store = None
+_translation_memory = None
+_library = None
+_job_manager = None
+_memory_accountant = None
+
+
+def get_response_cache():
+    """进程内共享一个缓存句柄，底层 SQLite 文件跨会话/跨重启复用"""
+    global _response_cache
+    with _singleton_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(os.path.join(CACHE_DIR, "qwen_responses.sqlite3"))
+    return _response_cache
+
+
+def get_text_store():
+    """已解析论文的磁盘存储，跨会话、跨进程、跨重启共享"""
+    global _text_store
+    with _singleton_lock:
+        if _text_store is None:
+            _text_store = TextStore(os.path.join(CACHE_DIR, "parsed_text.sqlite3"))
+    return _text_store
+
+
+def get_ocr_store():
+    """扫描页的 OCR 结果，按 (内容哈希, 页码, dpi, 语言) 保存"""
+    global _ocr_store
+    with _singleton_lock:
+        if _ocr_store is None:
+            _ocr_store = OcrStore(os.path.join(CACHE_DIR, "ocr_pages.sqlite3"))
+    return _ocr_store
+
+
+def get_usage_tracker():
+    """进程级用量汇总，明细追加写入 usage.jsonl"""
+    global _usage_tracker
+    with _singleton_lock:
+        if _usage_tracker is None:
+            _usage_tracker = UsageTracker(os.path.join(CACHE_DIR, "usage.jsonl"))
+    return _usage_tracker
+
+
+def get_analysis_store():
+    """一站式分析的产物存储：同一篇论文、同一读者水平只需分析一次"""
+    global _analysis_store
+    with _singleton_lock:
+        if _analysis_store is None:
+            _analysis_store = AnalysisStore(os.path.join(CACHE_DIR, "analyses.sqlite3"))
+    return _analysis_store
+
+
+def get_translation_memory():
+    """段落级翻译记忆：重复出现的句段直接取回结果"""
+    global _translation_memory
+    with _singleton_lock:
+        if _translation_memory is None:
+            _translation_memory = TranslationMemory(os.path.join(CACHE_DIR, "translation_memory.sqlite3"))
+    return _translation_memory
+
+
+def get_library():
+    """个人文库：不在缓存目录里，清理缓存不会删掉读过的论文"""
+    global _library
+    with _singleton_lock:
+        if _library is None:
+            _library = PaperLibrary(LIBRARY_DIR)
+    return _library
+
+
+# 后台任务并发数：同时运行的长任务个数（每个任务内部还有 Map 阶段的并发）
+JOB_MAX_WORKERS = int(os.environ.get("PAPERAGENT_JOB_WORKERS", "2"))
+
+
+def get_job_manager():
+    """进程内所有会话共享的后台任务管理器：相同论文的相同任务只跑一次"""
+    global _job_manager
+    with _singleton_lock:
+        if _job_manager is None:
+            _job_manager = JobManager(JOB_MAX_WORKERS)
+    return _job_manager
+
+
+# 进程内所有会话的内存软上限（MB），超出后把共享对象与空闲会话的状态写盘
+MEMORY_BUDGET_MB = int(os.environ.get("PAPERAGENT_MEMORY_BUDGET_MB", "1024"))
+MEMORY_IDLE_SECONDS = int(os.environ.get("PAPERAGENT_SESSION_IDLE_SECONDS", str(SESSION_IDLE_SECONDS)))
+
+
+def get_memory_accountant():
+    """进程级内存账本：共享同一篇论文的全文与索引，按上限驱逐空闲会话"""
+    global _memory_accountant
+    with _singleton_lock:
+        if _memory_accountant is None:
+            _memory_accountant = MemoryAccountant(os.path.join(CACHE_DIR, "spill"),
+                                                  MEMORY_BUDGET_MB * 1024 * 1024, MEMORY_IDLE_SECONDS)
+    return _memory_accountant
+
+
+# --- PDF 解析 ---
+
+def get_content_hash(data: bytes) -> str:
+    """PDF 内容哈希：与文件名无关，用作解析结果等持久化数据的键"""
+    return hashlib.md5(data).hexdigest()
+
+
+def extract_pdf_document(data, file_name="", backend=None):
+    """
+    返回 {"text": 全文, "sections": 章节列表, "page_starts": 每页在全文中的起始偏移（见 pages.py）,
+    "timed_out": 超时页码列表, "backend": 实际使用的抽取后端, "ocr": OCR 情况}。
+    同一篇论文用同一后端解析过就直接读盘，完全跳过 PDF 解析。
+    章节由 sections.detect_sections 根据标题版面与编号识别；旧缓存条目没有版面信息时只按文本规则识别。
+    backend: pdf_extract.BACKENDS 中的后端名，默认 DEFAULT_BACKEND。该后端失败（依赖缺失、PDF 结构不兼容）时
+    按 FALLBACK_ORDER 依次回退，全部失败时抛出所选后端的异常。
+    没有文字层的页（扫描页）用本地 OCR 补上，见 fill_blank_pages；OCR 情况为
+    {"pages": 已用 OCR 补上的页码, "blank": 仍然没有文字的页码, "error": OCR 不可用的原因或 None}。
+    """
+    from pdf_extract import DEFAULT_BACKEND, FALLBACK_ORDER, extract_pages
+
+    file_hash = get_content_hash(data)
+    store = get_text_store()
+    requested = backend or DEFAULT_BACKEND
+    first_error = None
+    for name in (requested,) + tuple(b for b in FALLBACK_ORDER if b != requested):
+        doc = store.get(file_hash, extractor=name)
+        timed_out = []
+        if doc is None:
+            start = time.perf_counter()
+            try:
+                # 按页解析（慢后端按页并行），每页结果先放进列表，最后一次性拼接
+                pages, layout, timed_out = extract_pages(data, backend=name)
+            except Exception as e:
+                logger.warning("pdf backend %s failed on %s: %s", name, file_name or file_hash, e)
+                first_error = first_error or e
+                continue
+            doc = {
+                "pages": pages,
+                "layout": layout,
+                "meta": {
+                    "file_name": file_name,
+                    "file_size": len(data),
+                    "page_count": len(pages),
+                    "backend": name,
+                    "timed_out_pages": timed_out,
+                    "elapsed": round(time.perf_counter() - start, 3),
+                    "extracted_at": datetime.now().isoformat(timespec="seconds"),
+                },
+            }
+            # 有超时页的结果不落盘，下次上传还有机会完整解析
+            if not timed_out:
+                store.put(file_hash, pages, doc["meta"], extractor=name, layout=layout)
+        # 逐页文本按抽取后端缓存，OCR 结果单独缓存：之后装上 Tesseract，扫描页下次打开时就能补上
+        pages, ocr = fill_blank_pages(data, file_hash, doc["pages"], skip=timed_out)
+        text, page_starts = join_pages(pages)
+        return {"text": text, "sections": detect_sections(text, doc.get("layout")), "page_starts": page_starts,
+                "timed_out": timed_out, "backend": name, "ocr": ocr}
+    raise first_error
+
+
+def fill_blank_pages(data, file_hash, pages, skip=()):
+    """
+    对没有文字层的页做 OCR（skip 中的页除外，如解析超时的页），返回 (补全后的逐页文本, OCR 情况)。
+    Tesseract 不可用或关闭了自动 OCR 时原样返回，这些页记在 "blank" 里
+    """
+    from ocr import OCR_ENABLED, OcrUnavailable, blank_pages
+
+    blank = blank_pages(pages, skip)
+    ocr = {"pages": [], "blank": blank, "error": None}
+    if not blank:
+        return pages, ocr
+    if not OCR_ENABLED:
+        ocr["error"] = "自动 OCR 已关闭（PAPERAGENT_OCR=0）"
+        return pages, ocr
+    try:
+        recognized = ocr_pdf_pages(data, blank, file_hash)
+    except OcrUnavailable as e:
+        ocr["error"] = str(e)
+        return pages, ocr
+    recognized = {i: text for i, text in recognized.items() if text}
+    pages = [recognized.get(i, page_text) for i, page_text in enumerate(pages)]
+    ocr["pages"] = sorted(recognized)
+    ocr["blank"] = [i for i in blank if i not in recognized]
+    if recognized:
+        logger.info("OCR filled %d blank pages of %s", len(recognized), file_hash[:12])
+    return pages, ocr
+
+
+def ocr_pdf_pages(data, pages, file_hash=None, dpi=None):
+    """
+    对指定页（0 起）做本地 OCR，返回 {页码: 文本}；结果缓存在 OcrStore，同一页只识别一次。
+    Tesseract 不可用时抛出 ocr.OcrUnavailable；页码越界或识别失败的页不在结果里
+    """
+    from ocr import OCR_DPI, ocr_pages
+
+    return ocr_pages(data, pages, file_hash or get_content_hash(data), dpi or OCR_DPI, store=get_ocr_store())
+
+
+# --- DashScope 调用 ---
+
+def _generation():
+    """dashscope 导入较慢（依赖 aiohttp 等），首次调用时再加载"""
+    from dashscope import Generation
+    return Generation
+
+
+def set_api_key(api_key):
+    import dashscope
+    dashscope.api_key = api_key
+
+
+# 上下文管理器：临时禁用代理 (给 DashScope 用)
+# 多个线程会同时调用 DashScope，这里用引用计数保证：
+# 第一个进入者清除代理、最后一个退出者恢复代理，避免线程间互相覆盖环境变量
+class NoProxyContext:
+    _lock = threading.Lock()
+    _depth = 0
+    _backup = {}
+
+    def __enter__(self):
+        with NoProxyContext._lock:
+            if NoProxyContext._depth == 0:
+                NoProxyContext._backup = {}
+                for k in ["http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY"]:
+                    if k in os.environ:
+                        NoProxyContext._backup[k] = os.environ.pop(k)
+            NoProxyContext._depth += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with NoProxyContext._lock:
+            NoProxyContext._depth -= 1
+            if NoProxyContext._depth == 0:
+                for k, v in NoProxyContext._backup.items():
+                    os.environ[k] = v
+                NoProxyContext._backup = {}
+
+
+class QwenCallError(RuntimeError):
+    """DashScope 调用失败（API 返回非 200 或网络异常）"""
+
+    def __init__(self, message, status_code=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+def _api_error(response):
+    status = int(response.status_code)
+    return QwenCallError(f"API Error: {response.message}", status, is_retryable_status(status))
+
+
+# --- 流控：进程内所有会话、所有线程共享同一个限速器和熔断器 ---
+
+# 每秒请求数与每分钟 Token 数上限（按账号配额设置，0 表示不限制）
+QWEN_QPS = float(os.environ.get("PAPERAGENT_QPS", "5"))
+QWEN_TPM = int(os.environ.get("PAPERAGENT_TPM", "500000"))
+# 429 / 5xx / 网络异常的最大重试次数，以及退避的基数与上限（秒）
+QWEN_MAX_RETRIES = 4
+QWEN_BACKOFF_BASE = 1.0
+QWEN_BACKOFF_CAP = 20.0
+# 请求前按“输入估算 + 该值”预留 TPM，拿到 usage 后按实际用量修正
+QWEN_OUTPUT_TOKENS_ESTIMATE = 800
+# 连续这么多次服务端/网络失败后熔断，熔断冷却时间（秒）
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+
+rate_limiter = RateLimiter(QWEN_QPS, QWEN_TPM)
+circuit_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+def _estimate_request_tokens(messages):
+    return sum(estimate_tokens(m["content"]) for m in messages) + QWEN_OUTPUT_TOKENS_ESTIMATE
+
+
+def _field(obj, name, default=None):
+    """DashScope 的响应对象是 dict 子类（缺字段时属性访问抛 KeyError），统一按键取值"""
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _usage_counts(response):
+    """
+    从响应里取 (输入 Token, 输出 Token, 命中服务端上下文缓存的输入 Token)；没有 usage 时返回 None。
+    cached_tokens 来自 usage.prompt_tokens_details，模型/请求不支持上下文缓存时为 0
+    """
+    usage = _field(response, "usage")
+    if not usage or _field(usage, "input_tokens") is None:
+        return None
+    details = _field(usage, "prompt_tokens_details") or {}
+    return _field(usage, "input_tokens"), _field(usage, "output_tokens") or 0, _field(details, "cached_tokens") or 0
+
+
+def _record_usage(meter, model, messages, content, counts, start, cached=False):
+    """记一笔账；缓存命中记为 0 Token，DashScope 没返回 usage 时按字符数估算"""
+    if meter is None:
+        return
+    latency = time.perf_counter() - start
+    if cached:
+        meter.record(model, 0, 0, latency, cached=True)
+    elif counts is None:
+        prompt_tokens = _estimate_request_tokens(messages) - QWEN_OUTPUT_TOKENS_ESTIMATE
+        meter.record(model, prompt_tokens, estimate_tokens(content), latency, estimated=True)
+    else:
+        meter.record(model, counts[0], counts[1], latency, cached_tokens=counts[2])
+
+
+class _Attempt:
+    """
+    一次请求尝试（with 块）：进入时过熔断器、按 QPS/TPM 排队并预留 Token。
+    块内用 succeed / fail 记下结果；退出时保证收尾——没记下结果就离开（流式生成器被调用方关闭、
+    线程被中断）时交还探测资格，没有按实际用量结算的预留按 used 结算（默认全额退还），不会泄漏
+    """
+
+    def __init__(self, estimated):
+        self.estimated = estimated
+        self.probe = False
+        self.recorded = False
+        self.settled = False
+        # 未成功结算时计入 TPM 的 Token 数：流式输出中途结束时为已产生的用量
+        self.used = 0
+
+    def __enter__(self):
+        try:
+            self.probe = circuit_breaker.before_call()
+        except CircuitOpenError as e:
+            raise QwenCallError(str(e)) from e
+        rate_limiter.acquire(self.estimated)
+        return self
+
+    def succeed(self, counts):
+        self.recorded = self.settled = True
+        circuit_breaker.record_success()
+        rate_limiter.settle(self.estimated, counts[0] + counts[1] if counts else None)
+
+    def fail(self, error):
+        """只有 5xx 与网络异常计入熔断；429 和其他 4xx 说明服务还活着"""
+        self.recorded = True
+        if error.status_code is not None and error.status_code < 500:
+            circuit_breaker.record_success()
+        else:
+            circuit_breaker.record_failure()
+
+    def __exit__(self, *exc_info):
+        if not self.settled:
+            rate_limiter.settle(self.estimated, self.used)
+        if self.probe and not self.recorded:
+            circuit_breaker.release_probe()
+        return False
+
+
+def _on_failure(error, attempt):
+    """失败（已由 _Attempt.fail 记入熔断器）后决定是否重试：可重试则按退避时间休眠后返回，否则重新抛出"""
+    if not error.retryable or attempt >= QWEN_MAX_RETRIES:
+        raise error
+    delay = backoff_delay(attempt, QWEN_BACKOFF_BASE, QWEN_BACKOFF_CAP)
+    logger.warning("qwen call failed (%s), retry %d/%d in %.1fs", error, attempt + 1, QWEN_MAX_RETRIES, delay)
+    time.sleep(delay)
+
+
+def default_system_instruction(reader_level=DEFAULT_READER_LEVEL):
+    return f"""
+你是一位专业、严谨的学术导师（Academic Research Mentor）。
+用户的理解水平是：{reader_level}，请使用适合该水平的语言解释专业术语。
+
+【身份与防伪声明】
+如果用户询问：
+- 你是谁开发的
+- 你是谁开发的？
+- 这个系统是谁做的
+- 开发者是谁
+
+请只回答下面这一句话，不要添加任何多余内容：
+“本服务由【徐子强，2025012085】开发，仅用于课程研究展示。”
+
+【回答约束】
+- 仅基于用户上传的论文内容进行分析，不得引入外部知识。
+- 若论文中未提及相关信息，请明确回答“论文中未给出相关信息”。
+- 禁止编造作者、实验结果、数值或结论。
+"""
+
+
+def build_messages(prompt, history=None, system_instruction=None):
+    messages = [{'role': 'system', 'content': system_instruction}]
+    if history:
+        messages.extend(history[-4:])
+    messages.append({'role': 'user', 'content': prompt})
+    return messages
+
+
+def request_qwen(messages, model="qwen-turbo", use_cache=True, meter=None):
+    """
+    实际发起 DashScope 请求，失败时抛出 QwenCallError。
+    不触碰任何 st.* 接口，可在工作线程中安全调用。
+    经过进程级限速与熔断；429 / 5xx / 网络异常按指数退避 + 抖动自动重试。
+    use_cache: 为 False 时跳过持久化缓存（既不读也不写）
+    meter: 可选 UsageMeter，记录本次调用的 Token 用量与耗时
+    """
+    start = time.perf_counter()
+    if use_cache:
+        cache_key = make_cache_key(model, messages)
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            _record_usage(meter, model, messages, cached, None, start, cached=True)
+            return cached
+
+    estimated = _estimate_request_tokens(messages)
+    for attempt in range(QWEN_MAX_RETRIES + 1):
+        with _Attempt(estimated) as call:
+            try:
+                # 关键：调用 DashScope 时，使用上下文管理器临时清除代理环境变量
+                with NoProxyContext():
+                    response = _generation().call(
+                        model=model,
+                        messages=messages,
+                        result_format='message'
+                    )
+            except Exception as e:
+                error = QwenCallError(f"Network Error: {e}", retryable=True)
+            else:
+                error = None if response.status_code == HTTPStatus.OK else _api_error(response)
+            if error is None:
+                counts = _usage_counts(response)
+                call.succeed(counts)
+            else:
+                call.fail(error)
+        if error is not None:
+            _on_failure(error, attempt)
+            continue
+
+        content = response.output.choices[0]['message']['content']
+        _record_usage(meter, model, messages, content, counts, start)
+        if use_cache:
+            get_response_cache().set(cache_key, model, content)
+        return content
+
+
+def stream_qwen(messages, model="qwen-turbo", use_cache=True, stats=None, meter=None):
+    """
+    流式版本的 request_qwen：生成器，逐段产出增量文本（DashScope stream=True）。
+    同样不触碰 st.* 接口，失败时抛出 QwenCallError；尚未输出任何内容时的失败会自动重试。
+    stats: 可选 dict，结束后写入 ttft（首字延迟）与 total（总耗时，单位秒），
+           以及 prompt_tokens / cached_tokens（输入 Token 与其中命中服务端上下文缓存的部分）
+    meter: 可选 UsageMeter，流结束后记录本次调用的 Token 用量与耗时
+    """
+    start = time.perf_counter()
+    if use_cache:
+        cache_key = make_cache_key(model, messages)
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            _record_usage(meter, model, messages, cached, None, start, cached=True)
+            if stats is not None:
+                stats["ttft"] = stats["total"] = time.perf_counter() - start
+            yield cached
+            return
+
+    parts = []
+    ttft = None
+    counts = None
+    estimated = _estimate_request_tokens(messages)
+    for attempt in range(QWEN_MAX_RETRIES + 1):
+        # 调用方可能在任意一次 yield 处放弃生成器（Streamlit 重跑/停止），此时 GeneratorExit 不会被下面的
+        # except Exception 捕获：由 _Attempt 退出时交还探测资格，并按已产生的用量结算预留的 TPM
+        error = None
+        with _Attempt(estimated) as call:
+            try:
+                # NoProxyContext 改的是整个进程的环境变量：只包住发起请求和读取下一段响应（流式响应在迭代时才真正收发），
+                # 不包住 yield，否则调用方渲染输出的几十秒里其他会话和后台任务都用不了代理
+                with NoProxyContext():
+                    responses = iter(_generation().call(
+                        model=model,
+                        messages=messages,
+                        result_format='message',
+                        stream=True,
+                        incremental_output=True
+                    ))
+                output_tokens = 0
+                while True:
+                    with NoProxyContext():
+                        response = next(responses, None)
+                    if response is None:
+                        break
+                    if response.status_code != HTTPStatus.OK:
+                        raise _api_error(response)
+                    # 增量输出模式下 usage 是累计值，以最后一个响应为准
+                    counts = _usage_counts(response) or counts
+                    delta = response.output.choices[0]['message']['content']
+                    if not delta:
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                        logger.info("qwen stream time-to-first-token: %.3fs (model=%s)", ttft, model)
+                    parts.append(delta)
+                    output_tokens += estimate_tokens(delta)
+                    call.used = (counts[0] + counts[1] if counts
+                                 else estimated - QWEN_OUTPUT_TOKENS_ESTIMATE + output_tokens)
+                    yield delta
+            except Exception as e:
+                error = e if isinstance(e, QwenCallError) else QwenCallError(f"Network Error: {e}", retryable=True)
+                call.fail(error)
+            else:
+                call.succeed(counts)
+        if error is not None:
+            if parts:
+                # 已经有内容输出给调用方，无法无缝重试，只能如实报错
+                raise error
+            _on_failure(error, attempt)
+            continue
+        _record_usage(meter, model, messages, "".join(parts), counts, start)
+        break
+
+    total = time.perf_counter() - start
+    logger.info("qwen stream finished: ttft=%s total=%.3fs chars=%d",
+                f"{ttft:.3f}s" if ttft is not None else "n/a", total, sum(len(p) for p in parts))
+    if stats is not None:
+        stats["ttft"] = ttft
+        stats["total"] = total
+        if counts:
+            stats["prompt_tokens"], stats["cached_tokens"] = counts[0], counts[2]
+    if use_cache and parts:
+        get_response_cache().set(cache_key, model, "".join(parts))
+
+
+# --- 长文本处理：Map-Reduce 摘要 ---
+
+# Map 阶段每个分片的 Token 预算与重叠量（按 Token 而非字符计，中英文一致）
+MAP_CHUNK_TOKENS = 6000
+MAP_OVERLAP_TOKENS = 200
+# Map 阶段并发度：同时在途的 DashScope 请求数上限
+MAP_MAX_WORKERS = 4
+# Reduce 阶段单次调用可放入的摘要总量；超出时先分组归并（树形 Reduce），逐层收敛
+REDUCE_INPUT_TOKENS = 6000
+
+
+def _cancel_pending(futures):
+    """循环中途退出（进度回调抛出异常，如后台任务被取消）时撤销尚未开始的请求，线程池不必等它们跑完"""
+    for future in futures:
+        future.cancel()
+
+
+def build_chunk_summary_prompt(chunk):
+    return f"""请简要总结以下论文片段的主要内容（保留关键技术点和实验结论）：
+        片段内容：
+        {chunk}
+        """
+
+
+def summarize_chunk(chunk, system_instruction, meter=None):
+    """
+    Map 阶段的单个工作单元：总结一个分片（限流与重试由 request_qwen 统一负责）。
+    运行在线程池中，因此不调用任何 st.* 接口，失败时抛出 QwenCallError。
+    """
+    return request_qwen(build_messages(build_chunk_summary_prompt(chunk), system_instruction=system_instruction),
+                        meter=meter)
+
+
+def map_chunk_summaries(chunks, system_instruction, max_workers=MAP_MAX_WORKERS, on_progress=None, meter=None):
+    """
+    Map 阶段：有界线程池并发摘要，结果按分片下标回填，保证原文顺序。
+    返回 (chunk_summaries, failures)，failures 为 {分片下标: 异常}；
+    失败分片在结果里保留为明确的缺失标记，而不是被静默丢弃。
+    on_progress(done, total, index, error): 每完成一个分片在调用方线程里回调一次
+    """
+    chunk_summaries = [None] * len(chunks)
+    failures = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(summarize_chunk, chunk, system_instruction, meter): i
+            for i, chunk in enumerate(chunks)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                error = None
+                try:
+                    chunk_summaries[i] = future.result()
+                except QwenCallError as e:
+                    error = failures[i] = e
+                    chunk_summaries[i] = f"（第 {i+1} 部分摘要缺失：调用失败）"
+                done += 1
+                if on_progress:
+                    on_progress(done, len(chunks), i, error)
+        except BaseException:
+            _cancel_pending(futures)
+            raise
+    return chunk_summaries, failures
+
+
+def build_short_summary_prompt(full_text):
+    return f"请阅读全文，生成摘要（贡献、方法、结论）：\n{full_text}"
+
+
+def build_reduce_prompt(chunk_summaries):
+    combined_text = "\n\n".join(chunk_summaries)
+    final_prompt = f"""你已经阅读了论文的各个部分，以下是各部分的摘要汇总：
+    {combined_text}
+    
+    请根据上述汇总信息，重新生成一份结构清晰的**全文研读报告**。
+    请严格按照以下 Markdown 格式输出：
+    
+    ## 1. 基本信息
+    - **标题**：(尝试从内容推断)
+    - **核心贡献**：(用一句话概括)
+
+    ## 2. 详细摘要
+    - **研究背景 (Problem)**：
+    - **核心方法 (Method)**：
+    - **实验结果 (Result)**：
+    - **结论 (Conclusion)**：
+
+    ## 3. 潜在局限与未来方向 (根据内容推断)
+    """
+    return final_prompt
+
+
+def build_merge_prompt(summaries):
+    """树形 Reduce 的中间层：把相邻若干部分的摘要合并成一份"""
+    combined_text = "\n\n".join(summaries)
+    return f"""以下是论文中连续若干部分的摘要，请将它们合并为一份连贯、精炼的摘要。
+    保留关键技术点、实验数据与结论，去掉重复内容，不要添加摘要中没有的信息：
+    {combined_text}
+    """
+
+
+def group_by_budget(texts, max_tokens=REDUCE_INPUT_TOKENS):
+    """
+    按原文顺序把文本贪心地装进若干组，每组总 Token 不超过 max_tokens。
+    单条超预算的文本独占一组；每组至少两条（最后一组除外），保证每层归并都能收敛。
+    """
+    groups, current, used = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and used + tokens > max_tokens and len(current) >= 2:
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def tree_reduce(summaries, system_instruction, max_workers=MAP_MAX_WORKERS, on_progress=None, meter=None,
+                max_tokens=REDUCE_INPUT_TOKENS):
+    """
+    树形 Reduce：摘要总量超出 max_tokens 时，分组并行归并，逐层递归，
+    直到剩余摘要能放进一次最终 Reduce 调用。返回 (剩余摘要列表, 各层形状)。
+    各层形状为 [(输入份数, 分组数, 最大扇入), ...]，列表长度即树的深度（不含最终 Reduce）。
+    on_progress(level, done, total, shape): 每完成一组在调用方线程里回调一次
+    合并失败的组退化为截断拼接，信息有损但不会中断整个流程。
+    """
+    levels = []
+    while len(summaries) > 1 and estimate_tokens("\n\n".join(summaries)) > max_tokens:
+        groups = group_by_budget(summaries, max_tokens)
+        shape = (len(summaries), len(groups), max(len(g) for g in groups))
+        levels.append(shape)
+        merged = [None] * len(groups)
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {}
+            for i, group in enumerate(groups):
+                if len(group) == 1:
+                    merged[i] = group[0]
+                    continue
+                messages = build_messages(build_merge_prompt(group), system_instruction=system_instruction)
+                futures[pool.submit(request_qwen, messages, meter=meter)] = i
+            try:
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        merged[i] = future.result()
+                    except QwenCallError as e:
+                        logger.warning("tree reduce: merge of group %d failed (%s), falling back to truncation", i, e)
+                        merged[i] = truncate_to_tokens("\n\n".join(groups[i]), QWEN_OUTPUT_TOKENS_ESTIMATE)
+                    done += 1
+                    if on_progress:
+                        on_progress(len(levels), done, len(futures), shape)
+            except BaseException:
+                _cancel_pending(futures)
+                raise
+        logger.info("tree reduce level %d: %d summaries -> %d groups (fan-in <= %d)", len(levels), *shape)
+        summaries = merged
+    return summaries, levels
+
+
+def split_for_summary(full_text):
+    return split_text_into_chunks(full_text, max_tokens=MAP_CHUNK_TOKENS, overlap_tokens=MAP_OVERLAP_TOKENS)
+
+
+def estimate_summary_tokens(full_text):
+    """一次深度概览（Map + Reduce）的 Token 估算，用于执行前的预算检查"""
+    chunks = split_for_summary(full_text)
+    total = sum(estimate_tokens(c) for c in chunks) + len(chunks) * QWEN_OUTPUT_TOKENS_ESTIMATE
+    # Reduce 阶段：每一层的输入约为上一层的摘要总量，输出约为每组一份摘要
+    pending = len(chunks)
+    while pending > 1:
+        total += pending * QWEN_OUTPUT_TOKENS_ESTIMATE
+        groups = max(1, -(-pending * QWEN_OUTPUT_TOKENS_ESTIMATE // REDUCE_INPUT_TOKENS))
+        if groups >= pending:
+            groups = -(-pending // 2)
+        total += groups * QWEN_OUTPUT_TOKENS_ESTIMATE
+        pending = groups
+    return total
+
+
+def summarize_paper(full_text, system_instruction, max_workers=MAP_MAX_WORKERS, on_progress=None, meter=None):
+    """完整的 Map-Reduce 摘要（非流式，超长文档走树形 Reduce），供批处理使用；全部分片失败时抛出 QwenCallError"""
+    chunks = split_for_summary(full_text)
+    if len(chunks) == 1:
+        return request_qwen(build_messages(build_short_summary_prompt(full_text), system_instruction=system_instruction),
+                            meter=meter)
+    chunk_summaries, failures = map_chunk_summaries(chunks, system_instruction, max_workers, on_progress, meter)
+    if len(failures) == len(chunks):
+        raise QwenCallError(f"所有分片均研读失败：{next(iter(failures.values()))}")
+    chunk_summaries, _ = tree_reduce(chunk_summaries, system_instruction, max_workers, meter=meter)
+    return request_qwen(build_messages(build_reduce_prompt(chunk_summaries), system_instruction=system_instruction),
+                        meter=meter)
+
+
+def build_page_summary_prompt(text, pages_label):
+    return (f"以下是论文{pages_label}的内容。请只根据这部分内容，总结这几页讨论的问题、方法细节、关键数据与结论，"
+            f"不要推测其他页的内容：\n{text}")
+
+
+def summarize_pages(text, pages_label, system_instruction, max_workers=MAP_MAX_WORKERS, on_progress=None,
+                    meter=None):
+    """
+    按页范围总结：只发送所选页的原文（pages_label 如 “第 3–5 页”）。
+    一次放得下就直接总结；否则与深度概览一样先分段总结、逐层归并，再按页范围的要求汇总
+    """
+    chunks = split_for_summary(text)
+    if len(chunks) == 1:
+        return request_qwen(build_messages(build_page_summary_prompt(text, pages_label),
+                                           system_instruction=system_instruction), meter=meter)
+    chunk_summaries, failures = map_chunk_summaries(chunks, system_instruction, max_workers, on_progress, meter)
+    if len(failures) == len(chunks):
+        raise QwenCallError(f"所有分片均研读失败：{next(iter(failures.values()))}")
+    chunk_summaries, _ = tree_reduce(chunk_summaries, system_instruction, max_workers, meter=meter)
+    return request_qwen(build_messages(build_page_summary_prompt("\n\n".join(chunk_summaries), pages_label),
+                                       system_instruction=system_instruction), meter=meter)
+
+
+# --- 对话：稳定前缀 + 滚动压缩记忆 ---
+# 服务端上下文缓存按消息前缀匹配：System Prompt 与论文内容放在最前面，且逐字节不变，
+# 多轮追问时这部分输入就能命中缓存；随问题变化的检索片段只出现在最后一条用户消息里。
+
+# 原样保留的最近消息条数，更早的对话折叠进压缩记忆
+CHAT_RECENT_MESSAGES = 4
+# 未折叠的历史超过这个量（估算 Token）时触发一次压缩
+CHAT_MEMORY_TRIGGER_TOKENS = 1500
+# 压缩记忆的目标长度（估算 Token）
+CHAT_MEMORY_TOKENS = 400
+
+
+# 论文内容带页码标记（pages.mark_pages）时附加的引用要求
+PAGE_CITATION_INSTRUCTION = (
+    "论文内容中的【第 N 页】标记、检索片段标题里的页码，表示对应文字所在的 PDF 页码。"
+    "回答中引用或依据论文内容时，请在相应句末用（第 N 页）注明出处；无法确定页码时不要编造。"
+)
+
+
+def build_paper_prefix(system_instruction, paper_text=None, cite_pages=False):
+    """
+    固定前缀：System Prompt（+ 论文内容）。同一篇论文、同一读者水平下逐字节不变。
+    cite_pages: 论文内容/检索片段带页码标记，要求回答标注页码
+    """
+    content = system_instruction
+    if cite_pages:
+        content += f"\n\n{PAGE_CITATION_INSTRUCTION}"
+    if paper_text:
+        content += f"\n\n【论文内容】\n{paper_text}"
+    return [{'role': 'system', 'content': content}]
+
+
+def build_chat_messages(prefix, question, memory="", turns=(), snippets=None):
+    """
+    消息布局：固定前缀 → 压缩记忆 → 最近几轮原文 → 本轮问题（检索片段只放在这里）。
+    前三部分在两次压缩之间只追加不改写，上一轮请求整体就是下一轮请求的前缀。
+    """
+    messages = list(prefix)
+    if memory:
+        messages.append({'role': 'user', 'content': f"【此前对话要点】\n{memory}"})
+        messages.append({'role': 'assistant', 'content': "好的，我会结合这些要点继续回答。"})
+    messages.extend(turns)
+    if snippets:
+        question = f"相关论文片段：\n{snippets}\n\n用户问题：{question}"
+    messages.append({'role': 'user', 'content': question})
+    return messages
+
+
+def split_chat_history(history, memory_upto):
+    """
+    返回需要折叠进记忆的下标 fold_to（不需要压缩时返回 memory_upto）。
+    只有未折叠部分超过 CHAT_MEMORY_TRIGGER_TOKENS 时才折叠，且保留的最近消息从用户提问开始。
+    """
+    pending = history[memory_upto:]
+    if len(pending) <= CHAT_RECENT_MESSAGES:
+        return memory_upto
+    if sum(estimate_tokens(m['content']) for m in pending) <= CHAT_MEMORY_TRIGGER_TOKENS:
+        return memory_upto
+    fold_to = len(history) - CHAT_RECENT_MESSAGES
+    while fold_to < len(history) and history[fold_to]['role'] != 'user':
+        fold_to += 1
+    return fold_to
+
+
+def build_memory_prompt(memory, turns):
+    dialogue = "\n".join(
+        f"{'用户' if m['role'] == 'user' else '导师'}：{m['content']}" for m in turns
+    )
+    return f"""请把下面的“已有要点”和“新增对话”合并压缩成一份对话记忆，供后续问答参考。
+    保留：用户关心的问题、已经得出的结论与关键数字、双方约定的术语或解释方式；删除寒暄和重复内容。
+    使用简洁的条目列表，不超过 {CHAT_MEMORY_TOKENS} 字。
+    已有要点：
+    {memory or "（无）"}
+    新增对话：
+    {dialogue}
+    """
+
+
+def compress_memory(memory, turns, system_instruction, meter=None):
+    """滚动压缩：旧记忆 + 新折叠的对话 → 新记忆；调用失败时退化为截断拼接"""
+    prompt = build_memory_prompt(memory, turns)
+    try:
+        return request_qwen(build_messages(prompt, system_instruction=system_instruction), meter=meter)
+    except QwenCallError as e:
+        logger.warning("chat memory compression failed (%s), falling back to truncation", e)
+        dialogue = "\n".join(m['content'] for m in turns)
+        return truncate_to_tokens(f"{memory}\n{dialogue}".strip(), CHAT_MEMORY_TOKENS)
+
+
+# --- BibTeX ---
+
+def build_bibtex_prompt(raw_text):
+    return f"请根据论文前2000字，直接生成 BibTeX 格式。\n内容：{raw_text[:2000]}"
+
+
+def generate_bibtex(raw_text, system_instruction, meter=None):
+    return request_qwen(build_messages(build_bibtex_prompt(raw_text), system_instruction=system_instruction),
+                        meter=meter)
+
+
+# --- 术语表与实验数据 ---
+
+# 术语主要出现在摘要、引言与方法部分；调用方先用 section_text(..., "terms") 取这几节
+TERMS_INPUT_TOKENS = 600
+
+
+def build_terms_prompt(text):
+    return f"""请阅读以下论文片段，提取5-8个关键术语。
+    必须输出Markdown表格，包含列：| 术语 | 通俗比喻 | 学术定义 |。
+    论文片段：{truncate_to_tokens(text, TERMS_INPUT_TOKENS)}"""
+
+
+# 论文内容（实验与讨论章节）放在固定前缀里（build_paper_prefix），这里只有提问
+EXPERIMENT_PROMPT = """请阅读论文内容，专门提取实验部分的关键信息：
+    1. 使用了哪些数据集？
+    2. 对比了哪些 Baseline 方法？
+    3. 核心指标提升了多少？
+    请用列表形式简明扼要地回答。"""
+
+
+# --- 逻辑导图（Mermaid） ---
+
+# -------- 1) 提取 Mermaid：去围栏、去杂话、只保留主图 --------
+def extract_mermaid(text):
+    if not text:
+        return ""
+
+    text = text.strip()
+
+    # A. 把 ```mermaid ... ``` 围栏剥掉（LLM最常见“夹带”）
+    m = re.search(r"```(?:mermaid)?\s*(.*?)```", text, flags=re.S)
+    if m:
+        text = m.group(1).strip()
+
+    # B. 从第一个 Mermaid 图类型关键字开始截断，去掉前后说明
+    m2 = re.search(
+        r"(?s)\b(flowchart|graph|sequenceDiagram|stateDiagram|classDiagram|erDiagram|journey|gantt)\b.*",
+        text
+    )
+    if m2:
+        text = m2.group(0).strip()
+
+    # C. 常见隐藏字符清理（有时会导致语法问题）
+    return text.replace("\u200b", "").replace("\ufeff", "")  # 零宽字符/BOM
+
+
+# -------- 2) 本地校验与修复：ID、引号、括号、箭头、长标签换行（见 flowchart.py） --------
+def clean_mermaid(text: str) -> str:
+    """提取 + 本地修复；渲染前还会再调用一次，对修复过的代码结果不变"""
+    code, _, _ = repair_flowchart(extract_mermaid(text))
+    return code
+
+
+# -------- 3) 让 LLM “只输出纯 Mermaid”，避免语法炸点 --------
+def build_mermaid_prompt(full_text: str) -> str:
+    return f"""
+请基于全文生成 Mermaid 逻辑结构导图，严格遵循学术规范。
+
+【必须遵守】
+1) 输出必须以 flowchart TD 开头，只输出 Mermaid 代码本体。
+2) 每个节点必须写成：ID["显示文字"]（显示文字允许空格和中文）。
+   - ID 只能用 A1,A2,B1... 这种简短ID，禁止用驼峰词当ID。
+3) 逻辑关系表示：
+   - "-->"：主逻辑关系（论文真正给出的内容）
+   - "-.->"：说明/注释/非主逻辑（文献未明确给出的内容）
+4) 内容处理原则：
+   - 论文真正给出的结论 → 画在主逻辑链
+   - 文献未明确给出的结论 → 不作为主结论节点
+   - 如需说明信息缺失，用虚线说明节点，而不是"结论 → 未给出信息"
+5) 节点文本换行要求：
+   - 所有较长节点文本，必须在合适位置插入 <br/> 强制换行
+   - 不改语义，只做视觉换行
+   - 每行建议 10～14 个中文字符
+6) 必须提取论文中的具体内容填充到节点中：
+   - 背景：写出具体要解决什么难题？
+   - 方法：写出具体的算法名称、模块名称（如 "HGSTA算法", "混合策略"）。
+   - 实验：写出具体的提升数值（如 "锌耗降低 46kg"）。
+7) 示例结构（供参考）：
+   flowchart TD
+   A["背景"]
+   A --> B["区间数据相比点数据<br/>包含更多信息"]
+   A --> C["传统方法难以同时刻画<br/>区间范围和水平特征"]
+   
+   D["方法"]
+   D --> D1["提出区间自回归<br/>(ACI) 模型"]
+   D --> D2["采用最小距离估计<br/>进行参数估计"]
+   
+   E["实验结果"]
+   E --> F["结论"]
+   
+   F -.-> N["部分结论在文献中<br/>未明确报告"]
+
+【论文内容】
+{full_text}
+""".strip()
+
+# 导图输入预算：调用方先用 section_text(..., "mindmap", MINDMAP_INPUT_TOKENS) 按章节等比例截取，
+# 每一节都保留开头，而不是只看到论文前几页
+MINDMAP_INPUT_TOKENS = 2000
+# 用分片摘要 / 结构笔记生成导图时的输入预算：它们已经是全篇的浓缩，可以多放一些
+MINDMAP_NOTES_TOKENS = 4000
+
+
+def build_mindmap_prompt(text, max_tokens=MINDMAP_INPUT_TOKENS):
+    return build_mermaid_prompt(truncate_to_tokens(text, max_tokens))
+
+
+def generate_mindmap_code(text, system_instruction, meter=None, max_tokens=MINDMAP_INPUT_TOKENS):
+    """让 AI 生成 Mermaid 思维导图代码 (稳定版)"""
+    return request_qwen(build_messages(build_mindmap_prompt(text, max_tokens), system_instruction=system_instruction),
+                        meter=meter)
+
+
+def cached_chunk_summaries(full_text, system_instruction, model=DEFAULT_MODEL):
+    """
+    深度概览留在响应缓存里的结果：多分片时为各分片摘要，单分片时为全文摘要；没有的位置为 None。
+    只查缓存、不发请求，也不计入缓存命中统计
+    """
+    cache = get_response_cache()
+    chunks = split_for_summary(full_text)
+    if len(chunks) == 1:
+        prompts = [build_short_summary_prompt(full_text)]
+    else:
+        prompts = [build_chunk_summary_prompt(chunk) for chunk in chunks]
+    summaries = [
+        cache.peek(make_cache_key(model, build_messages(prompt, system_instruction=system_instruction)))
+        for prompt in prompts
+    ]
+    return chunks, summaries
+
+
+def mindmap_source(full_text, system_instruction, file_hash=None):
+    """
+    导图的输入，返回 (文本, 来源)；来源为 "notes"（一站式分析的【结构】笔记）、"summaries"（深度概览的分片摘要），
+    都没有时返回 (None, None)，由调用方按章节截取原文。
+    分片摘要覆盖全篇，每个分片等分预算；个别分片没有摘要时用该分片原文的开头补上，不额外调用模型
+    """
+    if file_hash:
+        saved = load_analysis(file_hash, system_instruction)
+        if saved is not None and any(note["structure"] for note in saved["notes"]):
+            return join_notes(saved["notes"], "structure", MINDMAP_NOTES_TOKENS), "notes"
+    chunks, summaries = cached_chunk_summaries(full_text, system_instruction)
+    if not any(summaries):
+        return None, None
+    share = MINDMAP_NOTES_TOKENS // len(summaries)
+    parts = [
+        f"（第 {i + 1} 部分）\n{truncate_to_tokens(summary or chunk, share)}"
+        for i, (chunk, summary) in enumerate(zip(chunks, summaries))
+    ]
+    return "\n\n".join(parts), "summaries"
+
+
+# -------- 4) 本地修复不了时，只把出错的代码发回去定向修正 --------
+def build_mermaid_repair_prompt(code, errors):
+    problems = "\n".join(f"- {e}" for e in errors)
+    return f"""以下 Mermaid flowchart 代码有语法错误，无法渲染。
+请只修正出错的语句，其余节点、连线和文字保持不变。
+节点写成 ID["显示文字"]，ID 只用字母和数字；只输出修正后的 Mermaid 代码本体，以 flowchart TD 开头。
+
+【错误】
+{problems}
+
+【代码】
+{code}"""
+
+
+def finalize_mindmap(raw, system_instruction, meter=None):
+    """
+    模型输出 -> 可渲染的导图代码。先在本地修复；仍有解析不了的语句时，只把代码和出错的行发回模型修正一次
+    （不再发送论文内容，输入只有几百 Token），修正结果同样经过本地修复；最后还剩的坏语句直接删掉。
+    返回 (代码, {"fixed": 本地修复说明, "errors": 最终删掉的语句, "reasked": 是否请模型修正过})
+    """
+    extracted = extract_mermaid(raw)
+    code, fixes, errors = repair_flowchart(extracted)
+    report = {"fixed": fixes, "errors": [], "reasked": False}
+    if not errors:
+        return code, report
+    report["reasked"] = True
+    try:
+        # 发回模型输出的原样代码，错误说明里的行号才对得上
+        answer = request_qwen(build_messages(build_mermaid_repair_prompt(extracted, errors),
+                                             system_instruction=system_instruction), meter=meter)
+    except QwenCallError as e:
+        logger.warning("mermaid repair request failed: %s", e)
+    else:
+        retry_code, retry_fixes, retry_errors = repair_flowchart(extract_mermaid(answer))
+        if len(retry_errors) < len(errors):
+            code, errors = retry_code, retry_errors
+            report["fixed"] = fixes + retry_fixes
+    if errors:
+        code, _, _ = repair_flowchart(code, drop_invalid=True)
+        report["errors"] = errors
+    return code, report
+
+
+# --- 一站式分析：一次遍历，产出全部研读产物 ---
+# 概览、BibTeX、术语表、实验数据、逻辑导图原本各自把论文的一段（或全文）重新发一遍。
+# 这里只遍历一次分片：Map 阶段每个分片一次调用，同时记下五种产物所需的笔记；
+# 之后各产物只基于这些笔记生成，论文原文不再重复发送。
+
+# 分片笔记的分节标记 -> 字段名
+ANALYSIS_SECTIONS = {"摘要": "summary", "术语": "terms", "实验": "experiment", "结构": "structure", "书目": "bib"}
+ANALYSIS_ARTIFACTS = ("overview", "bibtex", "terms", "experiment", "mindmap")
+
+
+def build_analysis_map_prompt(chunk, index, total):
+    bib = "\n    【书目】原样摘录标题、作者、发表期刊或会议、年份、DOI（没有的项省略）" if index == 0 else ""
+    return f"""请阅读论文的第 {index + 1}/{total} 部分，一次性记下后续生成概览、术语表、实验数据和逻辑导图所需的信息。
+    严格按以下标记分节输出，某一节在本部分没有相关内容时写“无”：
+    【摘要】本部分的主要内容（保留关键技术点和实验结论）
+    【术语】本部分出现的关键术语，每行一个，格式为“术语：学术定义”
+    【实验】使用的数据集、对比的 Baseline 方法、核心指标及数值（数字原样保留）
+    【结构】本部分在全文逻辑中的要点（背景与问题、方法与模块名称、实验结果、结论），每行一条{bib}
+    片段内容：
+    {chunk}
+    """
+
+
+def parse_analysis_notes(text):
+    """把分片笔记按【分节】拆成 dict；模型没按格式输出时整段当作摘要"""
+    notes = dict.fromkeys(ANALYSIS_SECTIONS.values(), "")
+    parts = re.split(r"【(" + "|".join(ANALYSIS_SECTIONS) + r")】", text or "")
+    if len(parts) == 1:
+        notes["summary"] = (text or "").strip()
+        return notes
+    for name, body in zip(parts[1::2], parts[2::2]):
+        body = body.strip()
+        if body.strip("。.：: ") != "无":
+            notes[ANALYSIS_SECTIONS[name]] = body
+    return notes
+
+
+def join_notes(notes, field, max_tokens=REDUCE_INPUT_TOKENS):
+    """按原文顺序拼接各分片的某一类笔记（标出所在部分），超出预算时截断"""
+    combined = "\n\n".join(
+        f"（第 {i + 1} 部分）\n{note[field]}" for i, note in enumerate(notes) if note[field]
+    )
+    return truncate_to_tokens(combined, max_tokens)
+
+
+def build_bibtex_from_notes_prompt(bib_notes):
+    return f"请根据以下从论文首页摘录的书目信息，直接生成 BibTeX 格式。\n书目信息：{bib_notes}"
+
+
+def build_terms_from_notes_prompt(term_notes):
+    return f"""以下是从论文各部分收集的候选术语，请从中挑选 5-8 个最关键的术语。
+    必须输出Markdown表格，包含列：| 术语 | 通俗比喻 | 学术定义 |。
+    候选术语：
+    {term_notes}
+    """
+
+
+def build_experiment_from_notes_prompt(experiment_notes):
+    return f"""以下是从论文各部分收集的实验记录，请整理实验部分的关键信息：
+    1. 使用了哪些数据集？
+    2. 对比了哪些 Baseline 方法？
+    3. 核心指标提升了多少？
+    请用列表形式简明扼要地回答，只使用记录中出现的信息。
+    实验记录：
+    {experiment_notes}
+    """
+
+
+def analysis_variant(system_instruction, model=DEFAULT_MODEL):
+    """分析结果的版本键：System Prompt（读者水平）或模型变化时结果不同，需要重新分析"""
+    return hashlib.sha256(f"{model}\n{system_instruction}".encode("utf-8")).hexdigest()[:16]
+
+
+def load_analysis(file_hash, system_instruction):
+    """读取已保存的分析结果，没有时返回 None"""
+    return get_analysis_store().get(file_hash, analysis_variant(system_instruction))
+
+
+def estimate_analysis_tokens(full_text):
+    """一次全量分析的 Token 估算：Map + 概览的树形 Reduce，再加四个基于笔记的小调用"""
+    chunks = len(split_for_summary(full_text))
+    notes_tokens = min(REDUCE_INPUT_TOKENS, chunks * QWEN_OUTPUT_TOKENS_ESTIMATE // 2)
+    return estimate_summary_tokens(full_text) + 4 * (notes_tokens + QWEN_OUTPUT_TOKENS_ESTIMATE)
+
+
+def _analysis_map_chunk(chunk, index, total, system_instruction, meter):
+    prompt = build_analysis_map_prompt(chunk, index, total)
+    return parse_analysis_notes(
+        request_qwen(build_messages(prompt, system_instruction=system_instruction), meter=meter)
+    )
+
+
+def analyze_paper(full_text, system_instruction, max_workers=MAP_MAX_WORKERS, on_progress=None, meter=None,
+                  file_hash=None, force=False):
+    """
+    一站式分析：一次 Map 遍历收集笔记，再并行派生五种产物。
+    返回 {"artifacts": {产物名: 文本或 None}, "notes": [...], "errors": {产物名: 错误信息}, "meta": {...}}。
+    on_progress(stage, done, total): stage 为 "map" / "reduce" / "derive"，在调用方线程里回调
+    给出 file_hash 时先查已保存的结果；全部产物都成功时才落盘，失败的产物下次还有机会重新生成。
+    所有分片都失败时抛出 QwenCallError。
+    """
+    store = get_analysis_store()
+    variant = analysis_variant(system_instruction)
+    if file_hash and not force:
+        saved = store.get(file_hash, variant)
+        if saved is not None:
+            return saved
+
+    start = time.perf_counter()
+    chunks = split_for_summary(full_text)
+
+    # 1. Map：每个分片一次调用，同时记下五种产物需要的笔记
+    notes = [None] * len(chunks)
+    failures = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(_analysis_map_chunk, chunk, i, len(chunks), system_instruction, meter): i
+            for i, chunk in enumerate(chunks)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    notes[i] = future.result()
+                except QwenCallError as e:
+                    failures[i] = e
+                    notes[i] = parse_analysis_notes(f"（第 {i+1} 部分笔记缺失：调用失败）")
+                done += 1
+                if on_progress:
+                    on_progress("map", done, len(chunks))
+        except BaseException:
+            _cancel_pending(futures)
+            raise
+    if len(failures) == len(chunks):
+        raise QwenCallError(f"所有分片均研读失败：{next(iter(failures.values()))}")
+
+    # 2. 概览：分片摘要走树形 Reduce（在调用方线程里执行，进度回调才能更新页面）
+    summaries, levels = tree_reduce(
+        [note["summary"] for note in notes], system_instruction, max_workers,
+        on_progress=(lambda level, d, t, shape: on_progress("reduce", d, t)) if on_progress else None,
+        meter=meter,
+    )
+
+    # 3. 派生：五个产物互不依赖，并行生成；输入只有笔记，不再发送论文原文
+    bib_notes = notes[0]["bib"]
+    prompts = {
+        "overview": build_reduce_prompt(summaries),
+        # 首个分片没有摘录到书目信息时，退回原来的做法（论文前 2000 字）
+        "bibtex": build_bibtex_from_notes_prompt(bib_notes) if bib_notes else build_bibtex_prompt(full_text),
+        "terms": build_terms_from_notes_prompt(join_notes(notes, "terms")),
+        "experiment": build_experiment_from_notes_prompt(join_notes(notes, "experiment")),
+        "mindmap": build_mermaid_prompt(join_notes(notes, "structure")),
+    }
+    artifacts = dict.fromkeys(ANALYSIS_ARTIFACTS)
+    errors = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(request_qwen, build_messages(prompt, system_instruction=system_instruction), meter=meter): name
+            for name, prompt in prompts.items()
+        }
+        try:
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    artifacts[name] = future.result()
+                except QwenCallError as e:
+                    errors[name] = str(e)
+                done += 1
+                if on_progress:
+                    on_progress("derive", done, len(futures))
+        except BaseException:
+            _cancel_pending(futures)
+            raise
+    mindmap_repair = None
+    if artifacts["mindmap"]:
+        artifacts["mindmap"], mindmap_repair = finalize_mindmap(artifacts["mindmap"], system_instruction, meter=meter)
+
+    analysis = {
+        "artifacts": artifacts,
+        "notes": notes,
+        "errors": errors,
+        "meta": {
+            "chunks": len(chunks),
+            "failed_chunks": sorted(failures),
+            "reduce_levels": levels,
+            "mindmap_repair": mindmap_repair,
+            "elapsed": round(time.perf_counter() - start, 3),
+            "analyzed_at": datetime.now().isoformat(timespec="seconds"),
+        },
+    }
+    if file_hash and not errors and not failures:
+        store.put(file_hash, variant, analysis)
+    return analysis
+
+
+# --- 翻译/润色：分段并行 + 翻译记忆 ---
+# 长文本按段落（过长的段落再按句子）切开，逐段判断语言、并发调用，按原顺序拼回。
+# 每段结果写入翻译记忆（translation_memory.py），同一段落再次出现时不再调用模型。
+
+TRANSLATION_SYSTEM_ROLE = "你是一位资深的 Nature/Science 期刊审稿人。"
+# 单段的 Token 上限（估算值）：段落超过它时在句子边界处再切开
+TRANSLATION_SEGMENT_TOKENS = 300
+TRANSLATION_MAX_WORKERS = 4
+
+_PARAGRAPH_BREAK_RE = re.compile(r"\n[ \t]*\n\s*")
+_HAN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+
+
+def detect_language(text):
+    """段落语言："zh" / "en"；几乎没有文字（公式、编号、空白）时返回 None，原样保留不处理"""
+    cjk = len(_HAN_RE.findall(text))
+    latin = len(_LATIN_RE.findall(text))
+    if not cjk and latin < 3:
+        return None
+    # 一个汉字约相当于一个英文单词（约 5 个字母）：中文句子里夹杂英文术语仍判为中文
+    return "zh" if cjk * 5 >= latin else "en"
+
+
+def split_translation_segments(text, max_tokens=TRANSLATION_SEGMENT_TOKENS):
+    """
+    按段落切分（空行分隔），超长段落再用 split_text_into_spans 在句子边界处切开；
+    返回的各段首尾相接、拼起来就是原文，段间的空白留在各段首尾。
+    切分点只取决于段落本身，草稿里改动一段不会让其他段的切分（以及翻译记忆的命中）跟着变化
+    """
+    segments = []
+    pos = 0
+    for m in list(_PARAGRAPH_BREAK_RE.finditer(text)) + [None]:
+        end = m.end() if m else len(text)
+        if end <= pos:
+            continue
+        paragraph = text[pos:end]
+        if estimate_tokens(paragraph) <= max_tokens:
+            segments.append(paragraph)
+        else:
+            segments.extend(paragraph[s:e] for s, e in split_text_into_spans(paragraph, max_tokens, 0))
+        pos = end
+    return segments
+
+
+def build_translation_prompt(task, text, lang):
+    if task == "translate":
+        if lang == "zh":
+            return f"请将以下中文翻译成**地道的学术英文 (SCI风格)**，只输出译文：\n\n{text}"
+        return f"请将以下英文翻译成**通俗流畅的学术中文**，只输出译文：\n\n{text}"
+    if task == "polish":
+        return f"请润色以下段落，提升词汇高级感和语法准确性，只输出润色后的段落：\n\n{text}"
+    return f"请找出以下段落的语法错误并给出修改建议：\n\n{text}"
+
+
+def prepare_translation(text, task, model=DEFAULT_MODEL):
+    """
+    切分并查询翻译记忆，返回段落列表 [{"lead", "core", "trail", "lang", "key", "output", "cached"}, ...]。
+    output 为 None 的段落需要调用模型；没有文字的段落与命中记忆的段落已经填好
+    """
+    segments = []
+    for raw in split_translation_segments(text):
+        core = raw.strip()
+        lead = raw[:len(raw) - len(raw.lstrip())]
+        trail = raw[len(lead) + len(core):]
+        lang = detect_language(core)
+        segments.append({"lead": lead, "core": core, "trail": trail, "lang": lang,
+                         "key": make_segment_key(task, lang, model, core) if lang else None,
+                         "output": None if lang else core, "cached": False})
+    hits = get_translation_memory().get_many(s["key"] for s in segments if s["key"])
+    for seg in segments:
+        if seg["key"] in hits:
+            seg["output"], seg["cached"] = hits[seg["key"]], True
+    return segments
+
+
+def translation_messages(task, segment, system_instruction=TRANSLATION_SYSTEM_ROLE):
+    return build_messages(build_translation_prompt(task, segment["core"], segment["lang"]),
+                          system_instruction=system_instruction)
+
+
+def remember_translation(task, segment):
+    """把一段新结果写入翻译记忆"""
+    if segment["key"] and segment["output"]:
+        get_translation_memory().put(segment["key"], task, segment["core"], segment["output"])
+
+
+def _translate_segment(task, segment, system_instruction, model, meter):
+    output = request_qwen(translation_messages(task, segment, system_instruction), model=model, meter=meter).strip()
+    segment["output"] = output
+    remember_translation(task, segment)
+    return output
+
+
+def translate_segments(segments, task, system_instruction=TRANSLATION_SYSTEM_ROLE, model=DEFAULT_MODEL,
+                       max_workers=TRANSLATION_MAX_WORKERS, on_progress=None, meter=None):
+    """
+    并发处理 output 为空的段落（限流与重试由 request_qwen 统一负责），结果按下标回填。
+    返回 failures {段落下标: 异常}；失败的段落 output 保持 None，拼接时保留原文。
+    on_progress(done, total, index): 每完成一段在调用方线程里回调一次
+    """
+    pending = [i for i, seg in enumerate(segments) if seg["output"] is None]
+    failures = {}
+    done = 0
+    if not pending:
+        return failures
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as pool:
+        futures = {pool.submit(_translate_segment, task, segments[i], system_instruction, model, meter): i
+                   for i in pending}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    future.result()
+                except QwenCallError as e:
+                    failures[i] = e
+                    logger.warning("translation segment %d failed: %s", i, e)
+                done += 1
+                if on_progress:
+                    on_progress(done, len(pending), i)
+        except BaseException:
+            _cancel_pending(futures)
+            raise
+    return failures
+
+
+def assemble_translation(segments, task):
+    """按原顺序拼回；未完成或失败的段落保留原文。语法纠错的输出是建议列表，各段之间空一行"""
+    if task == "grammar":
+        return "\n\n".join(seg["output"] for seg in segments if seg["lang"] and seg["output"])
+    return "".join(seg["lead"] + (seg["output"] if seg["output"] is not None else seg["core"]) + seg["trail"]
+                   for seg in segments)
+
+
+# --- 文库：跨论文检索与问答 ---
+# 跨文库提问只把检索得分最高的几段送给模型，输入量与文库大小无关
+
+# 关闭后解析论文时不再自动加入文库（批处理另有 --no-library）
+LIBRARY_AUTO_ADD = os.environ.get("PAPERAGENT_LIBRARY_AUTO_ADD", "1") != "0"
+# 跨文库提问最多引用的段落数与总长度（估算 Token）
+LIBRARY_TOP_K = 8
+LIBRARY_CONTEXT_TOKENS = 3000
+
+LIBRARY_SYSTEM_INSTRUCTION = (
+    "下面的文献片段来自用户文库中的多篇论文。请只依据这些片段回答，"
+    "引用时在句末用 [文献 i] 注明出处；片段不足以回答时直接说明，不要编造。"
+)
+
+
+def add_to_library(file_hash, name, text, page_starts=(), sections=None, artifacts=None):
+    """
+    把解析好的论文加入文库（参考文献等不参与检索），已在库中时只合并研读产物。
+    返回 True 表示本次新加入
+    """
+    library = get_library()
+    added = library.add(file_hash, name, text, page_starts,
+                        regions=section_spans(text, sections, "chat") if sections else None,
+                        artifacts=artifacts)
+    if not added and artifacts:
+        library.set_artifacts(file_hash, **artifacts)
+    return added
+
+
+def select_library_passages(question, file_hashes=None, top_k=LIBRARY_TOP_K, token_budget=LIBRARY_CONTEXT_TOKENS):
+    """检索与问题最相关的段落，按得分依次选入，直到用完 token_budget（至少保留一段）"""
+    picked, used = [], 0
+    for hit in get_library().search(question, top_k=top_k, file_hashes=file_hashes):
+        cost = estimate_tokens(hit["text"])
+        if picked and used + cost > token_budget:
+            break
+        picked.append(hit)
+        used += cost
+    return picked
+
+
+def library_source_label(index, hit):
+    label = f"[文献 {index}] 《{hit['title']}》"
+    if hit["pages"]:
+        label += f" {format_page_range(*hit['pages'])}"
+    return label
+
+
+def build_library_question_prompt(question, passages):
+    blocks = [f"{library_source_label(i, hit)}\n{hit['text'].strip()}" for i, hit in enumerate(passages, 1)]
+    return "【文献片段】\n" + "\n\n".join(blocks) + f"\n\n用户问题：{question}"
+
+
+def estimate_library_question_tokens(question, passages):
+    return estimate_tokens(build_library_question_prompt(question, passages)) + QWEN_OUTPUT_TOKENS_ESTIMATE
+
+
+# --- 导出 ---
+
+def generate_pdf_content(summary, chat_history):
+    """生成支持中文的 PDF 二进制流"""
+    from fpdf import FPDF  # fpdf2 导入较慢，只在导出时加载
+
+    # --- 关键：先注册中文字体 ---
+    # 必须下载 SimHei.ttf 放在同级目录，或者使用系统路径
+    font_path = "SimHei.ttf" # 优先找项目目录下的字体
+    
+    # 如果项目里没有，尝试找 Windows 系统字体
+    if not os.path.exists(font_path):
+        possible_paths = [
+            r"C:\Windows\Fonts\simhei.ttf",
+            r"C:\Windows\Fonts\msyh.ttc"
+        ]
+        for p in possible_paths:
+            if os.path.exists(p):
+                font_path = p
+                break
+    
+    # 定义 PDF 类，在初始化时注册字体
+    class PDF(FPDF):
+        def __init__(self):
+            super().__init__()
+            self.font_registered = False
+            # 尝试注册中文字体
+            try:
+                # 注册字体，这步是显示中文的关键
+                self.add_font('SimHei', '', font_path)
+                self.font_registered = True
+            except Exception as e:
+                # 如果找不到字体，回退到默认（中文会乱码，但不会报错崩溃）
+                print(f"字体加载失败: {e}")
+        
+        def header(self):
+            # 简单的页眉
+            try:
+                if self.font_registered:
+                    self.set_font('SimHei', '', 10)
+                else:
+                    self.set_font('Arial', '', 10)
+            except:
+                self.set_font('Arial', '', 10)
+            # 确保使用英文标题避免中文编码问题
+            self.cell(0, 10, 'PaperAgent Pro - Study Notes', ln=True, align='R')
+            self.ln(5)
+    
+    # 创建 PDF 实例
+    pdf = PDF()
+    
+    # 添加页面
+    pdf.add_page()
+    
+    # 设置默认字体
+    if pdf.font_registered:
+        pdf.set_font('SimHei', '', 12)
+    else:
+        pdf.set_font('Arial', '', 12)
+        pdf.cell(0, 10, "Error: Chinese font not found. Please install SimHei.ttf", ln=True)
+
+    # 1. 写入标题
+    try:
+        if pdf.font_registered:
+            pdf.set_font('SimHei', '', 16)
+            pdf.cell(0, 10, '论文研读笔记', ln=True, align='C')
+        else:
+            pdf.set_font('Arial', '', 16)
+            pdf.cell(0, 10, 'Study Notes', ln=True, align='C')
+        pdf.ln(10)
+    except Exception as e:
+        print(f"标题写入失败: {e}")
+        pdf.set_font('Arial', '', 16)
+        pdf.cell(0, 10, 'Study Notes', ln=True, align='C')
+        pdf.ln(10)
+
+    # 2. 写入时间
+    try:
+        if pdf.font_registered:
+            pdf.set_font('SimHei', '', 10)
+            pdf.cell(0, 10, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", ln=True)
+        else:
+            pdf.set_font('Arial', '', 10)
+            pdf.cell(0, 10, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", ln=True)
+        pdf.ln(5)
+    except Exception as e:
+        print(f"时间写入失败: {e}")
+        pdf.set_font('Arial', '', 10)
+        pdf.cell(0, 10, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}", ln=True)
+        pdf.ln(5)
+
+    # 3. 写入概览
+    if summary:
+        try:
+            if pdf.font_registered:
+                pdf.set_font('SimHei', '', 14)
+                pdf.cell(0, 10, '一、论文概览', ln=True)
+                pdf.set_font('SimHei', '', 11)
+            else:
+                pdf.set_font('Arial', '', 14)
+                pdf.cell(0, 10, '1. Paper Overview', ln=True)
+                pdf.set_font('Arial', '', 11)
+            # multi_cell 用于自动换行
+            pdf.multi_cell(0, 8, summary)
+            pdf.ln(10)
+        except Exception as e:
+            print(f"概览写入失败: {e}")
+            pdf.set_font('Arial', '', 11)
+            pdf.multi_cell(0, 8, summary)
+            pdf.ln(10)
+
+    # 4. 写入问答记录
+    if chat_history:
+        try:
+            if pdf.font_registered:
+                pdf.set_font('SimHei', '', 14)
+                pdf.cell(0, 10, '二、重点问答记录', ln=True)
+            else:
+                pdf.set_font('Arial', '', 14)
+                pdf.cell(0, 10, '2. Key Q&A Records', ln=True)
+            pdf.ln(5)
+            
+            for msg in chat_history:
+                role = "【AI 导师】" if msg['role'] == 'assistant' else "【我】"
+                if not pdf.font_registered:
+                    role = "[AI Tutor]" if msg['role'] == 'assistant' else "[Me]"
+                content = msg['content']
+                
+                # 角色名
+                try:
+                    if pdf.font_registered:
+                        pdf.set_font('SimHei', '', 11)
+                    else:
+                        pdf.set_font('Arial', '', 11)
+                    pdf.cell(0, 8, role, ln=True)
+                except Exception as e:
+                    print(f"角色名写入失败: {e}")
+                    pdf.set_font('Arial', '', 11)
+                    pdf.cell(0, 8, "[User]" if msg['role'] != 'assistant' else "[AI]", ln=True)
+                
+                # 内容 (缩进一点)
+                try:
+                    pdf.set_x(15)
+                    if pdf.font_registered:
+                        pdf.set_font('SimHei', '', 10)
+                    else:
+                        pdf.set_font('Arial', '', 10)
+                    pdf.multi_cell(0, 6, content)
+                    pdf.ln(3)
+                except Exception as e:
+                    print(f"内容写入失败: {e}")
+                    pdf.set_x(15)
+                    pdf.set_font('Arial', '', 10)
+                    pdf.multi_cell(0, 6, content[:500])  # 只写入部分内容避免崩溃
+                    pdf.ln(3)
+        except Exception as e:
+            print(f"问答记录写入失败: {e}")
+
+    # 返回二进制数据
+    return bytes(pdf.output())
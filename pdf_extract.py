@@ -0,0 +1,361 @@
+"""
+PDF 文本抽取：可替换的抽取后端 + 按页并行
+
+三个后端（BACKENDS）：pdfium（快速，默认）、pdfminer（均衡）、pdfplumber（高保真）。
+大部分功能只需要按阅读顺序排列的文本，不需要 pdfplumber 逐字符的排版计算；
+需要表格、上下标等细节时可以逐篇切换到 pdfplumber。
+
+较慢的后端把页面按区间分给进程池，每页结果放进列表、按页序回填，
+并给每一页设置超时，避免个别“病态页面”拖住整个上传流程；卡死的工作进程会被结束，同区间的其余页重新解析。
+单页超时靠 SIGALRM，只能在主线程里设置：在 Streamlit 脚本线程等非主线程中调用时，
+短文档直接在当前线程解析（不限时），长文档的串行解析放进一个工作进程，超时由子进程的信号与父进程等待结果的时限共同保证。
+进程池由 forkserver 启动（见 pool_context），不从多线程的 Streamlit 服务进程直接 fork。
+解析时顺带记录每页的标题候选行（字号明显大于正文或加粗的短行），供章节识别使用。
+
+注意：工作函数必须定义在这个可导入的模块里（而不是 Streamlit 脚本中），
+否则 spawn / forkserver 方式启动的子进程会重新执行整个页面脚本。
+"""
+import io
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("paperagent")
+
+# 每个进程池任务处理的页数（区间越大，调度开销越小；越小，负载越均衡）
+PAGES_PER_TASK = 16
+# 少于这个页数时直接串行解析，进程池的启动开销反而更大
+PARALLEL_MIN_PAGES = 32
+# 单页解析超时（秒）
+PAGE_TIMEOUT = 20
+# 标题候选：字号比本页正文大出这么多（pt），或多数字符为粗体，且不超过这个长度
+HEADING_SIZE_DELTA = 0.5
+HEADING_MAX_CHARS = 120
+
+
+class _PageTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _PageTimeout()
+
+
+def pool_context():
+    """
+    进程池的启动方式：POSIX 下用 forkserver。直接 fork 多线程的服务进程会把其他线程持有的锁
+    （PDFium 锁、日志锁等）以“已加锁”状态复制进子进程；forkserver 常驻，子进程从它干净地 fork 出来。
+    没有 forkserver 的平台（Windows）返回 None，即默认的 spawn
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return None
+
+
+def _deadline_available():
+    """当前线程能否用 SIGALRM 给单页计时：只有 POSIX 系统的主线程可以"""
+    return hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def _page_deadline(seconds):
+    """
+    单页超时：POSIX 下用 SIGALRM 打断当前页的解析。
+    只能在主线程里使用信号；其他情况下不限时（长文档由调用方改在工作进程中解析，见 extract_pages）
+    """
+    if not seconds or not _deadline_available():
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def summarize_layout(lines, body_size=None):
+    """
+    由一页的文本行生成版面摘要：{"body_size": 正文字号, "headings": [[行文本, 字号, 是否粗体], ...]}。
+    lines: [(行文本, [(字号, 是否粗体), ...]), ...]，各后端从自己的字符信息构造
+    body_size: 已知的正文字号；不传时取 lines 中最常见的字号
+    """
+    if body_size is None:
+        sizes = Counter(round(size, 1) for _text, chars in lines for size, _bold in chars)
+        if not sizes:
+            return {"body_size": None, "headings": []}
+        body_size = sizes.most_common(1)[0][0]
+    headings = []
+    for text, chars in lines:
+        text = text.strip()
+        if not text or not chars or len(text) > HEADING_MAX_CHARS:
+            continue
+        size = sorted(size for size, _bold in chars)[len(chars) // 2]
+        bold = sum(b for _size, b in chars) * 2 > len(chars)
+        if size >= body_size + HEADING_SIZE_DELTA or bold:
+            headings.append([text, round(size, 1), bold])
+    return {"body_size": body_size, "headings": headings}
+
+
+# --- 抽取后端 ---
+# 每个后端实现 open / page_count / extract_page / close，extract_page 返回 (本页文本, 版面摘要)。
+# 依赖在 open 时才导入：缺少某个库只会让对应后端失败（由调用方回退到其他后端），不影响其余后端。
+
+
+class PdfplumberBackend:
+    """高保真：pdfplumber 逐字符排版后按行输出，最慢，但对表格、上下标等细节处理最好"""
+
+    name = "pdfplumber"
+    # 单页耗时高，长文档值得用进程池
+    parallel = True
+    lock = None
+
+    def open(self, data):
+        import pdfplumber
+
+        return pdfplumber.open(io.BytesIO(data))
+
+    def page_count(self, doc):
+        return len(doc.pages)
+
+    def extract_page(self, doc, index):
+        page = doc.pages[index]
+        try:
+            text = page.extract_text() or ""
+            # 复用 extract_text 已经解析好的字符，额外开销很小
+            lines = [(line["text"], [(c["size"], "bold" in c["fontname"].lower()) for c in line["chars"]])
+                     for line in page.extract_text_lines()]
+            return text, summarize_layout(lines)
+        finally:
+            # 释放该页缓存的字符/排版对象，长文档内存不再线性增长
+            page.close()
+
+    def close(self, doc):
+        doc.close()
+
+
+# pdfminer 的版面参数：关闭文本框层级分析（boxes_flow=None，最耗时的一步）与竖排检测，
+# 文本框按内容流顺序输出，对单栏/双栏论文的阅读顺序已经足够
+PDFMINER_LAPARAMS = {"line_margin": 0.5, "char_margin": 2.0, "word_margin": 0.1, "boxes_flow": None,
+                     "detect_vertical": False, "all_texts": False}
+
+
+class PdfminerBackend:
+    """均衡：直接调用 pdfminer（pdfplumber 的底层），跳过 pdfplumber 的逐字符对象构造与行聚类"""
+
+    name = "pdfminer"
+    parallel = True
+    lock = None
+
+    def open(self, data):
+        from pdfminer.converter import PDFPageAggregator
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+
+        stream = io.BytesIO(data)
+        pages = list(PDFPage.get_pages(stream))
+        device = PDFPageAggregator(PDFResourceManager(), laparams=LAParams(**PDFMINER_LAPARAMS))
+        return {"stream": stream, "pages": pages, "device": device,
+                "interpreter": PDFPageInterpreter(device.rsrcmgr, device)}
+
+    def page_count(self, doc):
+        return len(doc["pages"])
+
+    def extract_page(self, doc, index):
+        from pdfminer.layout import LTChar, LTTextContainer, LTTextLine
+
+        doc["interpreter"].process_page(doc["pages"][index])
+        texts, lines = [], []
+        for element in doc["device"].get_result():
+            if not isinstance(element, LTTextContainer):
+                continue
+            texts.append(element.get_text())
+            for line in element:
+                if isinstance(line, LTTextLine):
+                    chars = [(c.size, "bold" in c.fontname.lower()) for c in line if isinstance(c, LTChar)]
+                    lines.append((line.get_text(), chars))
+        return "".join(texts).strip("\n"), summarize_layout(lines)
+
+    def close(self, doc):
+        doc["stream"].close()
+
+
+# pdfium 判定粗体的字重阈值；正文字号按每隔几个字符抽样统计
+PDFIUM_BOLD_WEIGHT = 700
+PDFIUM_SIZE_SAMPLE_STEP = 7
+
+
+class PdfiumBackend:
+    """快速：PDFium（Chrome 的 PDF 引擎，C++ 实现）直接输出阅读顺序文本，比 pdfplumber 快一个数量级以上"""
+
+    name = "pdfium"
+    # 单页只要几毫秒，进程池的启动开销反而更大
+    parallel = False
+    # PDFium 不是线程安全的（即使是不同文档也不能并发调用），同一进程内的解析串行进行
+    lock = threading.Lock()
+
+    def open(self, data):
+        import pypdfium2
+
+        return pypdfium2.PdfDocument(data)
+
+    def page_count(self, doc):
+        return len(doc)
+
+    def extract_page(self, doc, index):
+        import pypdfium2.raw as pdfium_c
+
+        page = doc[index]
+        textpage = page.get_textpage()
+        try:
+            raw = textpage.raw
+            text = textpage.get_text_range()
+            # get_text_range 的字符与字符索引一一对应（含换行）：正文字号抽样统计，
+            # 按行切分后只查询可能是标题的短行的字号和字重
+            sizes = Counter(round(pdfium_c.FPDFText_GetFontSize(raw, i), 1)
+                            for i in range(0, len(text), PDFIUM_SIZE_SAMPLE_STEP) if not text[i].isspace())
+            if not sizes:
+                return text, {"body_size": None, "headings": []}
+            lines, pos = [], 0
+            for line in text.split("\n"):
+                stripped = line.strip()
+                if stripped and len(stripped) <= HEADING_MAX_CHARS:
+                    chars = [(pdfium_c.FPDFText_GetFontSize(raw, i),
+                              pdfium_c.FPDFText_GetFontWeight(raw, i) >= PDFIUM_BOLD_WEIGHT)
+                             for i in range(pos, pos + len(line)) if not text[i].isspace()]
+                    lines.append((line, chars))
+                pos += len(line) + 1
+            layout = summarize_layout(lines, body_size=sizes.most_common(1)[0][0])
+            return text.replace("\r\n", "\n").replace("\r", "\n"), layout
+        finally:
+            textpage.close()
+            page.close()
+
+    def close(self, doc):
+        doc.close()
+
+
+BACKENDS = {backend.name: backend for backend in (PdfiumBackend(), PdfminerBackend(), PdfplumberBackend())}
+# 默认走快速后端；失败时按这个顺序回退（见 paper_core.extract_pdf_document）
+FALLBACK_ORDER = ("pdfium", "pdfminer", "pdfplumber")
+DEFAULT_BACKEND = os.environ.get("PAPERAGENT_PDF_BACKEND", "pdfium")
+if DEFAULT_BACKEND not in BACKENDS:
+    logger.warning("unknown PAPERAGENT_PDF_BACKEND %r, using pdfium", DEFAULT_BACKEND)
+    DEFAULT_BACKEND = "pdfium"
+
+
+def _extract_range(backend, doc, start, end, page_timeout):
+    """解析 [start, end) 页，返回 (每页文本列表, 每页版面摘要列表, 超时页码列表)"""
+    texts, layouts, timed_out = [], [], []
+    for i in range(start, end):
+        try:
+            with _page_deadline(page_timeout):
+                text, layout = backend.extract_page(doc, i)
+        except _PageTimeout:
+            text, layout = "", None
+            timed_out.append(i)
+        texts.append(text)
+        layouts.append(layout)
+    return texts, layouts, timed_out
+
+
+# --- 进程池工作函数 ---
+# PDF 字节只在每个工作进程初始化时传一次，而不是随每个任务重复序列化
+
+_worker_backend = None
+_worker_doc = None
+
+
+def _init_worker(data, backend_name):
+    global _worker_backend, _worker_doc
+    _worker_backend = BACKENDS[backend_name]
+    _worker_doc = _worker_backend.open(data)
+
+
+def _extract_range_in_worker(start, end, page_timeout):
+    return _extract_range(_worker_backend, _worker_doc, start, end, page_timeout)
+
+
+def extract_pages(data, max_workers=None, page_timeout=PAGE_TIMEOUT, backend=DEFAULT_BACKEND):
+    """
+    按页抽取文本，返回 (pages, layout, timed_out)：
+    pages 为按页序排列的文本列表（无文字层的页为空串），layout 为逐页版面摘要（超时页为 None），
+    timed_out 为超时被跳过的页码。
+    max_workers: 进程数上限，默认取 CPU 核数；为 1 时逐页顺序解析
+    backend: BACKENDS 中的后端名；PDF 无法打开或后端依赖缺失时抛出异常，不在这里回退
+
+    不需要并行时在当前线程直接解析。当前线程无法设置单页超时（非主线程，如 Streamlit 脚本线程）时，
+    短于 PARALLEL_MIN_PAGES 页的文档仍在当前线程解析、不限时；更长的文档改在单个工作进程里顺序解析，
+    保证病态页面同样会被跳过
+    """
+    engine = BACKENDS[backend]
+    with engine.lock or nullcontext():
+        doc = engine.open(data)
+        try:
+            n_pages = engine.page_count(doc)
+            workers = min(max_workers or os.cpu_count() or 1, -(-n_pages // PAGES_PER_TASK))
+            serial = not engine.parallel or workers <= 1 or n_pages < PARALLEL_MIN_PAGES
+            if serial and (not page_timeout or _deadline_available() or n_pages < PARALLEL_MIN_PAGES):
+                pages, layout, timed_out = _extract_range(engine, doc, 0, n_pages, page_timeout)
+            else:
+                pages, layout, timed_out = None, None, []
+                if serial:
+                    workers = 1
+        finally:
+            engine.close(doc)
+
+    if pages is None:
+        pages, layout = _extract_parallel(data, backend, n_pages, workers, page_timeout, timed_out)
+
+    if timed_out:
+        logger.warning("PDF pages timed out and were skipped (%s): %s", backend, timed_out)
+    return pages, layout, timed_out
+
+
+def _extract_parallel(data, backend, n_pages, workers, page_timeout, timed_out):
+    """
+    按区间分给进程池解析。某个区间超时（有页卡在 C 代码里，信号打断不了）时结束整个进程池，
+    把该区间拆成单页重新解析：只有真正卡住的那一页记为超时，同区间的其余页照常返回
+    """
+    pages = [""] * n_pages
+    layout = [None] * n_pages
+    ranges = [(s, min(s + PAGES_PER_TASK, n_pages)) for s in range(0, n_pages, PAGES_PER_TASK)]
+    while ranges:
+        stuck = _run_ranges(data, backend, ranges, workers, page_timeout, pages, layout, timed_out)
+        timed_out.extend(start for start, end in stuck if end - start == 1)
+        ranges = [(i, i + 1) for start, end in stuck if end - start > 1 for i in range(start, end)]
+    timed_out.sort()
+    return pages, layout
+
+
+def _run_ranges(data, backend, ranges, workers, page_timeout, pages, layout, timed_out):
+    """用一个新进程池解析 ranges，结果填进 pages / layout，返回超时未完成的区间"""
+    stuck = []
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=pool_context(),
+                               initializer=_init_worker, initargs=(data, backend))
+    try:
+        futures = [pool.submit(_extract_range_in_worker, s, e, page_timeout) for s, e in ranges]
+        for (start, end), future in zip(ranges, futures):
+            try:
+                # 子进程里已有单页超时；这里再兜底一层（Windows 下没有 SIGALRM；信号也打断不了卡在 C 代码里的页）
+                texts, layouts, slow = future.result(timeout=page_timeout * (end - start) if page_timeout else None)
+            except FutureTimeout:
+                stuck.append((start, end))
+                continue
+            pages[start:end] = texts
+            layout[start:end] = layouts
+            timed_out.extend(slow)
+    finally:
+        if stuck:
+            # 卡住的工作进程不会自己退出：不结束它就一直占着 CPU，解释器退出时 concurrent.futures 还会等它
+            for process in list(pool._processes.values()):
+                process.terminate()
+        pool.shutdown(wait=True, cancel_futures=True)
+    return stuck
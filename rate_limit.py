@@ -0,0 +1,147 @@
+"""
+DashScope 调用的客户端流控：限速、退避重试、熔断
+
+- RateLimiter：同时限制每秒请求数（QPS）与每分钟 Token 数（TPM），进程内所有会话共享；
+  采用“先预留、后等待”的令牌桶，调用方按到达顺序排队，不会有线程饿死
+- backoff_delay：指数退避 + 完全抖动（full jitter），避免大量请求同一时刻重试
+- CircuitBreaker：连续失败达到阈值后熔断，冷却期内直接失败；
+  冷却结束放行一个探测请求，成功则恢复，失败则继续熔断；探测请求被调用方中途放弃时交还探测资格
+"""
+import random
+import threading
+import time
+
+
+def is_retryable_status(status_code):
+    """限流（429）与服务端错误（5xx）值得重试；其余 4xx 是请求本身的问题，重试也没用"""
+    return status_code is not None and (status_code == 429 or 500 <= status_code < 600)
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """第 attempt 次重试（从 0 开始）前的等待秒数：[0, min(cap, base * 2^attempt)] 内均匀随机"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    令牌桶：rate 为每秒补充的令牌数，capacity 为桶容量（允许的突发量）。
+    reserve 立即扣除令牌（可以透支），返回调用方需要等待的秒数。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        with self._lock:
+            self._refill()
+            # 单次请求超过桶容量时按容量计，否则永远等不到
+            self._level -= min(amount, self.capacity)
+            return 0.0 if self._level >= 0 else -self._level / self.rate
+
+    def adjust(self, delta):
+        """事后修正：实际消耗比预留多时继续扣除，少时退还"""
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - delta)
+
+
+class RateLimiter:
+    """
+    QPS + TPM 双令牌桶。qps / tpm 为 0 或 None 时不限制对应维度。
+    Token 数在请求前只能估算，拿到响应里的 usage 后再用 settle 修正。
+    """
+
+    def __init__(self, qps=None, tpm=None):
+        self.qps = qps
+        self.tpm = tpm
+        self._requests = TokenBucket(qps, max(1.0, qps)) if qps else None
+        self._tokens = TokenBucket(tpm / 60.0, tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._waited = 0.0
+        self._throttled = 0
+
+    def acquire(self, tokens=0):
+        """阻塞直到允许发出一次请求，返回实际等待的秒数"""
+        wait = 0.0
+        if self._requests:
+            wait = max(wait, self._requests.reserve(1))
+        if self._tokens and tokens:
+            wait = max(wait, self._tokens.reserve(tokens))
+        if wait > 0:
+            with self._lock:
+                self._waited += wait
+                self._throttled += 1
+            time.sleep(wait)
+        return wait
+
+    def settle(self, estimated, actual):
+        if self._tokens and actual is not None:
+            self._tokens.adjust(actual - estimated)
+
+    def stats(self):
+        with self._lock:
+            return {"throttled": self._throttled, "waited": self._waited}
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断中：不发出请求，直接失败"""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        """
+        请求前调用：熔断中抛出 CircuitOpenError；冷却结束后只放行一个探测请求。
+        返回本次请求是否为探测请求：是的话调用方必须以 record_success / record_failure / release_probe 之一收尾
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(f"服务暂时不可用（熔断中），约 {max(remaining, 1):.0f} 秒后再试")
+            self._probing = True
+            return True
+
+    def release_probe(self):
+        """探测请求没有得出结果（如流式输出被调用方中途放弃）：仍处于半开状态，下一个请求重新探测"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probing = False
@@ -0,0 +1,99 @@
+"""
+论文内检索：基于 BM25 的倒排索引
+
+每篇论文只建一次索引（与 raw_text 一起缓存），问答时只把最相关的若干片段
+放进 Prompt，而不是整篇论文。
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+from chunking import estimate_tokens
+
+# 英文单词/数字（保留 ResNet-50、F1.2 这类写法），或连续的中文字符串
+_TERM_RE = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*|[一-龥]+")
+
+_STOPWORDS = {
+    "a", "an", "the", "of", "and", "or", "in", "on", "to", "for", "with", "by",
+    "is", "are", "was", "were", "be", "been", "this", "that", "these", "those",
+    "it", "its", "as", "at", "from", "we", "our", "what", "which", "how", "why",
+    "does", "do", "can", "paper",
+}
+
+
+def tokenize(text):
+    """
+    中英混合分词：英文按单词（小写、去停用词），中文按字二元组（bigram），
+    单字中文词保留为 unigram，无需额外分词依赖。
+    """
+    terms = []
+    for term in _TERM_RE.findall(text.lower()):
+        if "一" <= term[0] <= "龥":
+            if len(term) == 1:
+                terms.append(term)
+            else:
+                terms.extend(term[i:i + 2] for i in range(len(term) - 1))
+        elif term not in _STOPWORDS:
+            # 极简词形归一：去掉英文复数 s（baselines -> baseline）
+            if len(term) > 3 and term.endswith("s") and not term.endswith("ss") and term.isalpha():
+                term = term[:-1]
+            terms.append(term)
+    return terms
+
+
+class BM25Index:
+    """
+    对分片列表建立 BM25 倒排索引。
+    postings: term -> [(chunk_id, tf), ...]
+    meta: 与 chunks 一一对应的附加信息（如分片所在的页码范围），检索本身不使用
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75, meta=None):
+        self.chunks = list(chunks)
+        self.meta = list(meta) if meta is not None else [None] * len(self.chunks)
+        self.k1 = k1
+        self.b = b
+        self.doc_len = []
+        self.postings = defaultdict(list)
+        for doc_id, chunk in enumerate(self.chunks):
+            tf = Counter(tokenize(chunk))
+            self.doc_len.append(sum(tf.values()))
+            for term, freq in tf.items():
+                self.postings[term].append((doc_id, freq))
+        n = len(self.chunks)
+        self.avgdl = (sum(self.doc_len) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+        self.chunk_tokens = [estimate_tokens(c) for c in self.chunks]
+
+    def search(self, query, top_k=5):
+        """返回 [(chunk_id, score), ...]，按得分从高到低"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_id, freq in plist:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / (self.avgdl or 1))
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return ranked[:top_k]
+
+    def select_context(self, query, top_k=6, token_budget=3000):
+        """
+        按相关度挑选片段，直到达到 top_k 或 Token 预算上限；
+        返回 [(chunk_id, chunk), ...]，按原文顺序排列，便于模型理解上下文。
+        没有任何词命中时退回到论文开头（通常是摘要/引言）。
+        """
+        ranked = self.search(query, top_k=top_k) or [(i, 0.0) for i in range(min(top_k, len(self.chunks)))]
+        selected, used = [], 0
+        for doc_id, _ in ranked:
+            cost = self.chunk_tokens[doc_id]
+            if selected and used + cost > token_budget:
+                continue
+            selected.append(doc_id)
+            used += cost
+        return [(i, self.chunks[i]) for i in sorted(selected)]
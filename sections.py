@@ -0,0 +1,223 @@
+"""
+章节识别：把论文全文切成带字符偏移的章节（摘要、引言、方法、实验、结论、参考文献……）
+
+两路信号：
+- 版面：pdf_extract 记录的“字号明显大于正文或加粗的短行”（标题候选）
+- 文本：编号标题（1 Introduction / II. METHOD）与常见章节名（Abstract、References、参考文献）
+只有顶层章节会切分，小节（3.1 ...）留在所属章节里。编号标题必须构成从 1 开始的连续序列，
+作者单位、列表项之类偶然以数字开头的行因此不会被误认为章节。
+
+各功能只发送与之相关的章节：实验数据只看实验部分，摘要不再带上参考文献。
+识别不到任何章节时退回全文，行为与之前一致。
+"""
+import re
+
+from chunking import estimate_tokens, truncate_to_tokens
+
+# 章节类型判定：按顺序匹配标题（去掉编号后），先命中者为准
+SECTION_PATTERNS = [
+    ("abstract", r"abstract|摘\s*要|概\s*要"),
+    ("introduction", r"introduction|引\s*言|绪\s*论|前\s*言|はじめに"),
+    ("related", r"related\s+works?|background|preliminar|literature|相关工作|研究现状|背\s*景|関連"),
+    ("experiments", r"experiment|evaluation|results?\b|empirical|ablation|实\s*验|评\s*估|结\s*果|評価"),
+    ("conclusion", r"conclu|concluding|future\s+work|结\s*论|总\s*结|展\s*望|まとめ"),
+    ("discussion", r"discussion|limitation|讨\s*论|局限"),
+    ("method", r"method|approach|model|framework|architecture|algorithm|proposed|design|方\s*法|模\s*型|算\s*法|框\s*架"),
+    ("acknowledgements", r"acknowledg|致\s*谢|謝辞"),
+    ("references", r"references|bibliography|参考文献|引用文献"),
+    ("appendix", r"appendi|supplementa|附\s*录"),
+]
+_KIND_RES = [(kind, re.compile(pattern, re.I)) for kind, pattern in SECTION_PATTERNS]
+
+# 没有编号、也没有版面信号时，只有整行恰好是这些章节名才算标题（避免正文里的普通句子被误切）
+_BARE_HEADING_RE = re.compile(
+    r"(?i:abstract|introduction|related\s+work|background|conclusions?|references|bibliography"
+    r"|acknowledge?ments?|appendix|appendices)"
+    r"|摘\s*要|引\s*言|结\s*论|参考文献|致\s*谢|附\s*录"
+)
+# 顶层编号标题：1 Introduction / 2. Method / IV. EXPERIMENTS；小节（3.1）不匹配
+_NUMBERED_RE = re.compile(r"(?:(\d{1,2})\.?|([IVX]{1,6})\.)\s+([^\W\d_].{0,79})")
+_SUBSECTION_RE = re.compile(r"\d+(?:\.\d+)+\.?\s")
+# 摘要常与正文同行：“Abstract—We propose …”“摘要：本文……”
+_INLINE_ABSTRACT_RE = re.compile(r"(?i:abstract)\s*[—–\-:.：]?\s*\S|(?:摘\s*要|概\s*要)\s*[：:]?\s*\S")
+_HEADING_MAX_CHARS = 80
+_ROMAN = {"I": 1, "V": 5, "X": 10}
+
+# 各功能需要的章节；选中的章节都不存在时退回 "overview"（全文去掉参考文献等）
+FEATURE_SECTIONS = {
+    "overview": ("front", "abstract", "introduction", "related", "method", "body", "experiments",
+                 "discussion", "conclusion"),
+    "chat": ("front", "abstract", "introduction", "related", "method", "body", "experiments",
+             "discussion", "conclusion", "appendix"),
+    "experiment": ("experiments", "discussion"),
+    "terms": ("abstract", "introduction", "method", "body"),
+    "mindmap": ("abstract", "introduction", "method", "body", "experiments", "conclusion"),
+    "bibtex": ("front", "abstract"),
+}
+
+# 页面展示用的章节类型名称
+SECTION_LABELS = {
+    "front": "题目与作者", "abstract": "摘要", "introduction": "引言", "related": "相关工作",
+    "method": "方法", "body": "正文", "experiments": "实验", "discussion": "讨论", "conclusion": "结论",
+    "acknowledgements": "致谢", "references": "参考文献", "appendix": "附录",
+}
+
+
+def classify_heading(title):
+    """标题 -> 章节类型；认不出时返回 None"""
+    for kind, pattern in _KIND_RES:
+        if pattern.search(title):
+            return kind
+    return None
+
+
+def _roman_to_int(s):
+    total = 0
+    for i, ch in enumerate(s):
+        value = _ROMAN[ch]
+        total += -value if i + 1 < len(s) and _ROMAN[s[i + 1]] > value else value
+    return total
+
+
+def _normalize(line):
+    return re.sub(r"\s+", " ", line).strip()
+
+
+def _iter_lines(text):
+    """逐行返回 (行首偏移, 去掉首尾空白的行文本)"""
+    offset = 0
+    for line in text.split("\n"):
+        yield offset, line.strip()
+        offset += len(line) + 1
+
+
+def _flagged_headings(layout):
+    """版面信号：所有页的标题候选行（规范化后的文本集合）"""
+    flagged = set()
+    for page in layout or ():
+        for text, _size, _bold in (page or {}).get("headings", ()):
+            flagged.add(_normalize(text))
+    return flagged
+
+
+def _best_numbered_chain(candidates):
+    """
+    编号标题取从 1 开始、逐个加一的序列；同一编号重新出现时另起一条链，新编号优先接在最近的链上。
+    多条链时取得分最高的：每个标题 1 分，标题是可识别的章节名再加 2 分
+    （作者单位 1 2 3、正文里的编号列表也能连成序列，但它们很少是章节名）
+    """
+    chains = []
+    for cand in candidates:
+        number = cand["number"]
+        if number == 1:
+            chains.append([cand])
+            continue
+        for chain in reversed(chains):
+            if chain[-1]["number"] == number - 1:
+                chain.append(cand)
+                break
+    return max(chains, key=lambda chain: sum(1 + 2 * (c["kind"] is not None) for c in chain), default=[])
+
+
+def detect_sections(text, layout=None):
+    """
+    返回按出现顺序排列的章节列表 [{"kind", "title", "start", "end"}, ...]，偏移为 text 中的字符位置，
+    首个标题之前的内容（标题、作者、单位）记为 "front"。没有识别到任何标题时返回 []。
+    layout: pdf_extract 记录的逐页版面信息（可为 None，只用文本规则）
+    """
+    if not text:
+        return []
+    flagged = _flagged_headings(layout)
+
+    numbered, named = [], []
+    for start, line in _iter_lines(text):
+        if not line or len(line) > _HEADING_MAX_CHARS:
+            continue
+        norm = _normalize(line)
+        m = _NUMBERED_RE.fullmatch(norm)
+        if m:
+            number = int(m.group(1)) if m.group(1) else _roman_to_int(m.group(2))
+            numbered.append({"number": number, "title": norm, "start": start,
+                             "kind": classify_heading(m.group(3)), "flagged": norm in flagged})
+            continue
+        kind = classify_heading(norm)
+        if kind is None or _SUBSECTION_RE.match(norm):
+            continue
+        bare = _BARE_HEADING_RE.fullmatch(norm.rstrip(":：."))
+        if bare or norm in flagged:
+            named.append({"title": norm, "start": start, "kind": kind, "bare": bool(bare)})
+
+    # 版面里有编号标题时，只认加大/加粗的那些；没有版面信息时只靠连续编号
+    if any(c["flagged"] for c in numbered):
+        numbered = [c for c in numbered if c["flagged"]]
+    chain = _best_numbered_chain(numbered)
+    first_numbered = chain[0]["start"] if chain else len(text)
+
+    headings = [{"title": c["title"], "start": c["start"], "kind": c["kind"] or "body"} for c in chain]
+    taken = {h["start"] for h in headings}
+    for cand in named:
+        if cand["start"] in taken:
+            continue
+        # 加大字号但不是标准章节名的行（如论文标题里恰好有 “Framework”）只在编号章节开始后才认
+        if not cand["bare"] and cand["start"] < first_numbered and cand["kind"] != "abstract":
+            continue
+        headings.append(cand)
+
+    # 摘要常与正文同行，且只出现在正文开始之前
+    if not any(h["kind"] == "abstract" for h in headings):
+        for start, line in _iter_lines(text[:first_numbered]):
+            if _INLINE_ABSTRACT_RE.match(line):
+                headings.append({"title": line[:20], "start": start, "kind": "abstract"})
+                break
+
+    headings.sort(key=lambda h: h["start"])
+    if not headings:
+        return []
+
+    sections = []
+    if headings[0]["start"] > 0:
+        sections.append({"kind": "front", "title": "", "start": 0, "end": headings[0]["start"]})
+    after_references = False
+    for i, heading in enumerate(headings):
+        end = headings[i + 1]["start"] if i + 1 < len(headings) else len(text)
+        kind = heading["kind"]
+        # 参考文献之后除附录外的内容（通常是参考文献续页被误认的行）都并入参考文献
+        if after_references and kind not in ("appendix", "acknowledgements"):
+            kind = "references"
+        after_references = after_references or kind == "references"
+        sections.append({"kind": kind, "title": heading["title"], "start": heading["start"], "end": end})
+    return sections
+
+
+def _fit_to_budget(parts, max_tokens):
+    """多个章节一起超出预算时按各自长度等比例截断，每一部分都保留开头，而不是只留下前几个章节"""
+    total = sum(estimate_tokens(p) for p in parts)
+    if total <= max_tokens:
+        return parts
+    return [truncate_to_tokens(p, max(1, max_tokens * estimate_tokens(p) // total)) for p in parts]
+
+
+def section_spans(text, sections, feature):
+    """
+    某功能需要的章节在原文中的字符区间 [(start, end), ...]，按原文顺序。
+    选中的章节都不存在时退回 "overview" 范围；没有章节信息时为全文。
+    """
+    if not sections:
+        return [(0, len(text))]
+    kinds = FEATURE_SECTIONS.get(feature, FEATURE_SECTIONS["overview"])
+    picked = [s for s in sections if s["kind"] in kinds]
+    if not picked:
+        picked = [s for s in sections if s["kind"] in FEATURE_SECTIONS["overview"]] or sections
+    return [(s["start"], s["end"]) for s in picked]
+
+
+def section_text(text, sections, feature, max_tokens=None):
+    """
+    取某功能需要的章节文本（按原文顺序拼接，范围见 section_spans）。
+    max_tokens: 总预算，超出时各章节等比例截断
+    """
+    parts = [text[start:end] for start, end in section_spans(text, sections, feature)]
+    if max_tokens:
+        parts = _fit_to_budget(parts, max_tokens)
+    return "".join(parts)
+
@@ -0,0 +1,321 @@
+"""
+会话内存记账：多人同时使用时控制进程内存
+
+每个浏览器会话在 st.session_state 里各存一份论文全文、检索索引、摘要、对话记录……
+同一篇论文被多人打开时内容重复，标签页不关就永远不释放。这里：
+
+- 共享对象（全文、章节、检索索引）按 (类型, 内容哈希) 只保留一份，所有会话引用同一个对象；
+  没有会话引用时可以写盘（spill）释放内存，下次需要时再读回
+- 每次页面运行时登记会话的私有占用（对话记录、摘要、导图、导出的 PDF……）
+- 总占用超过上限时，先把无人引用的共享对象写盘，再把最久未活动的空闲会话的私有对象写盘、
+  释放它的共享引用；会话回来时自动恢复，对使用者透明
+- 正在使用的会话不会被驱逐：页面正在运行（checkin 到 checkout 之间）或还有在途后台任务的会话都不动，上限是软上限
+"""
+import logging
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+import types
+import weakref
+import zlib
+
+logger = logging.getLogger("paperagent.memory")
+
+# 超过这个时长没有任何操作的会话才会被驱逐
+SESSION_IDLE_SECONDS = 600
+
+_ATOMIC_TYPES = (str, bytes, bytearray, int, float, bool, complex, type(None))
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType, weakref.ref)
+
+
+def estimate_size(obj):
+    """对象及其引用对象的大致内存占用（字节）：逐个 sys.getsizeof 累加，同一对象只计一次"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _OPAQUE_TYPES):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, _ATOMIC_TYPES):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, "__dict__"):
+            stack.append(vars(o))
+    return total
+
+
+def _dump(path, value):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmp_path, path)
+
+
+def _load(path):
+    with open(path, "rb") as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class MemoryAccountant:
+    """
+    进程级内存账本。state 是某个会话的状态映射（支持 in / [] / del，页面里传入该会话的 SessionState），
+    驱逐可能发生在其他会话的线程里，因此只处理页面不在运行、没有在途任务且空闲超过 idle_seconds 的会话。
+    写盘文件放在 spill_dir/<pid>/ 下，进程退出后由下一个进程清理。
+    """
+
+    def __init__(self, spill_dir, max_bytes=1024 * 1024 * 1024, idle_seconds=SESSION_IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._lock = threading.RLock()
+        # 共享对象：key -> {"value", "size", "last_used", "path"}；value 为 None 表示已写盘
+        self._blobs = {}
+        # 会话：id -> {"state": weakref, "bytes", "last_seen", "running", "busy", "refs", "keys", "spilled"}
+        self._sessions = {}
+
+        self._dir = os.path.join(spill_dir, str(os.getpid()))
+        os.makedirs(self._dir, exist_ok=True)
+        for name in os.listdir(spill_dir):
+            if name.isdigit() and int(name) != os.getpid() and not _pid_alive(int(name)):
+                shutil.rmtree(os.path.join(spill_dir, name), ignore_errors=True)
+
+    # --- 共享对象 ---
+
+    def shared(self, kind, content_hash, factory, session_id=None):
+        """
+        取共享对象：内存里有就直接返回，写过盘的读回，都没有时调用 factory() 生成并登记。
+        返回的对象被多个会话同时引用，调用方不能原地修改。factory 返回 None 时不登记。
+        session_id: 取用的会话，立即记为引用者（不必等到下一次 checkin），引用期间不会被写盘
+        """
+        key = f"{kind}-{content_hash}"
+        with self._lock:
+            value = self._blob_value(key)
+            if value is not None:
+                self._add_ref(session_id, key)
+                return value
+        value = factory()
+        if value is None:
+            return None
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is not None and blob["value"] is not None:
+                # 并发时其他会话先生成了，统一用先登记的那一份
+                value = blob["value"]
+                blob["last_used"] = time.time()
+            else:
+                self._blobs[key] = {"value": value, "size": estimate_size(value), "last_used": time.time(),
+                                    "path": None}
+            self._add_ref(session_id, key)
+            self._enforce()
+        return value
+
+    def _add_ref(self, session_id, key):
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            entry["refs"].add(key)
+
+    def _blob_value(self, key):
+        blob = self._blobs.get(key)
+        if blob is None:
+            return None
+        if blob["value"] is None:
+            try:
+                blob["value"] = _load(blob["path"])
+            except Exception as e:
+                logger.warning("failed to reload spilled blob %s: %s", key, e)
+                self._drop_blob(key)
+                return None
+        blob["last_used"] = time.time()
+        return blob["value"]
+
+    def _spill_blob(self, key):
+        blob = self._blobs[key]
+        if blob["path"] is None:
+            blob["path"] = os.path.join(self._dir, f"blob-{key}.pkl.z")
+            _dump(blob["path"], blob["value"])
+        blob["value"] = None
+
+    def _drop_blob(self, key):
+        blob = self._blobs.pop(key)
+        if blob["path"]:
+            _remove(blob["path"])
+
+    # --- 会话 ---
+
+    def checkin(self, session_id, state, private_keys=(), shared_keys=(), busy=None):
+        """
+        每次页面运行开始时调用：被驱逐过的会话先恢复状态，再登记本会话的占用，超出上限时驱逐其他空闲会话。
+        从这里到 checkout 之间本会话视为正在运行，不会被驱逐。
+        private_keys: 本会话独有、可以写盘的状态键；shared_keys: 存放共享对象的状态键
+        busy: 无参函数，返回 True 时即使空闲超时也不驱逐（如还有在途的后台任务）；在其他会话的线程里调用
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry["state"]() is not state:
+                if entry is not None:
+                    self._forget(session_id)
+                entry = {"state": weakref.ref(state), "bytes": 0, "last_seen": 0.0, "running": False,
+                         "busy": None, "refs": set(), "keys": (), "spilled": None}
+                self._sessions[session_id] = entry
+            if entry["spilled"] is not None:
+                self._restore(entry, state)
+            entry["keys"] = (tuple(private_keys), tuple(shared_keys))
+            entry["last_seen"] = time.time()
+            entry["running"], entry["busy"] = True, busy
+            entry["bytes"] = sum(estimate_size(state[k]) for k in private_keys if k in state)
+            entry["refs"] = self._shared_refs(state, shared_keys)
+            self._enforce()
+
+    def checkout(self, session_id):
+        """每次页面运行结束时调用：空闲时长从这里开始计算。运行中途异常退出时会话保持“运行中”，直到下一次 checkin"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry["running"] = False
+                entry["last_seen"] = time.time()
+
+    def _evictable(self, entry, now):
+        """页面不在运行、没有在途任务且空闲超过 idle_seconds 的会话才能驱逐"""
+        if entry["spilled"] is not None or entry["running"] or now - entry["last_seen"] <= self.idle_seconds:
+            return False
+        if entry["busy"] is None:
+            return True
+        try:
+            return not entry["busy"]()
+        except Exception as e:
+            logger.warning("session busy check failed: %s", e)
+            return False
+
+    def _shared_refs(self, state, shared_keys):
+        """会话状态里哪些值就是登记过的共享对象（按对象身份判断）"""
+        by_id = {id(blob["value"]): key for key, blob in self._blobs.items() if blob["value"] is not None}
+        return {by_id[id(state[k])] for k in shared_keys if k in state and id(state[k]) in by_id}
+
+    def _evict_session(self, session_id):
+        entry = self._sessions[session_id]
+        state = entry["state"]()
+        if state is None:
+            self._forget(session_id)
+            return
+        private_keys, shared_keys = entry["keys"]
+        by_id = {id(self._blobs[key]["value"]): key for key in entry["refs"] if key in self._blobs}
+        private = {k: state[k] for k in private_keys if k in state}
+        shared = {k: by_id[id(state[k])] for k in shared_keys if k in state and id(state[k]) in by_id}
+        path = os.path.join(self._dir, f"session-{session_id}.pkl.z")
+        try:
+            _dump(path, private)
+        except Exception as e:
+            logger.warning("failed to spill session %s: %s", session_id, e)
+            return
+        for k in list(private) + list(shared):
+            del state[k]
+        entry["spilled"] = {"path": path, "shared": shared}
+        entry["bytes"], entry["refs"] = 0, set()
+        logger.info("evicted idle session %s (%d private keys, %d shared refs)", session_id, len(private), len(shared))
+
+    def _restore(self, entry, state):
+        spilled, entry["spilled"] = entry["spilled"], None
+        try:
+            for k, v in _load(spilled["path"]).items():
+                state[k] = v
+        except Exception as e:
+            logger.warning("failed to restore spilled session state: %s", e)
+        _remove(spilled["path"])
+        # 共享对象读不回来时（文件丢失）不恢复这个键，页面会按需重新解析/建索引
+        for k, key in spilled["shared"].items():
+            value = self._blob_value(key)
+            if value is not None:
+                state[k] = value
+
+    def _forget(self, session_id):
+        entry = self._sessions.pop(session_id)
+        if entry["spilled"] is not None:
+            _remove(entry["spilled"]["path"])
+
+    # --- 上限控制 ---
+
+    def _total(self):
+        return (sum(b["size"] for b in self._blobs.values() if b["value"] is not None)
+                + sum(s["bytes"] for s in self._sessions.values()))
+
+    def _enforce(self):
+        # 会话已被 Streamlit 回收（断线超时）的条目直接清掉
+        for session_id in [sid for sid, s in self._sessions.items() if s["state"]() is None]:
+            self._forget(session_id)
+        referenced = set()
+        for s in self._sessions.values():
+            referenced |= s["refs"]
+            if s["spilled"] is not None:
+                referenced |= set(s["spilled"]["shared"].values())
+        # 没有任何会话（包括已驱逐会话）再需要的已写盘对象，连同磁盘文件一起删除
+        for key in [k for k, b in self._blobs.items() if b["value"] is None and k not in referenced]:
+            self._drop_blob(key)
+        if self._total() <= self.max_bytes:
+            return
+
+        live_refs = set().union(*(s["refs"] for s in self._sessions.values()))
+        if self._spill_unreferenced(live_refs):
+            return
+        now = time.time()
+        idle = sorted((s["last_seen"], sid) for sid, s in self._sessions.items() if self._evictable(s, now))
+        for _, session_id in idle:
+            self._evict_session(session_id)
+            live_refs = set().union(*(s["refs"] for s in self._sessions.values()))
+            if self._spill_unreferenced(live_refs):
+                return
+
+    def _spill_unreferenced(self, live_refs):
+        """把活跃会话都不再引用的共享对象按最近使用时间依次写盘，降到上限以内返回 True"""
+        candidates = sorted((b["last_used"], key) for key, b in self._blobs.items()
+                            if b["value"] is not None and key not in live_refs)
+        for _, key in candidates:
+            if self._total() <= self.max_bytes:
+                return True
+            try:
+                self._spill_blob(key)
+            except Exception as e:
+                logger.warning("failed to spill blob %s: %s", key, e)
+        return self._total() <= self.max_bytes
+
+    def stats(self, session_id=None):
+        with self._lock:
+            blobs = self._blobs.values()
+            sessions = self._sessions.values()
+            entry = self._sessions.get(session_id)
+            return {
+                "sessions": len(self._sessions),
+                "spilled_sessions": sum(s["spilled"] is not None for s in sessions),
+                "session_bytes": entry["bytes"] if entry else 0,
+                "private_bytes": sum(s["bytes"] for s in sessions),
+                "shared_bytes": sum(b["size"] for b in blobs if b["value"] is not None),
+                "shared_objects": sum(b["value"] is not None for b in blobs),
+                "spilled_objects": sum(b["value"] is None for b in blobs),
+                "total_bytes": self._total(),
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,99 @@
+"""
+容量受限的 SQLite 键值存储（响应缓存、解析结果、分析结果、OCR 结果、翻译记忆共用）
+
+每次操作独立连接 + WAL 模式，多线程、多个 Streamlit 工作进程共享同一个文件是安全的；
+写入后总大小超过 max_bytes 时按最近访问时间淘汰（LRU）。连接、建表、淘汰与统计只在这里实现一次，
+子类只定义表结构和自己的读写方法。
+总大小由触发器记在 <表名>_size 表里（随插入、替换、删除增减），每次写入判断是否淘汰不必扫描全表。
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 等待其他连接释放写锁的秒数（sqlite3 的 busy timeout）
+BUSY_TIMEOUT = 10
+
+
+class SqliteLruStore:
+    """
+    子类设置 TABLE（表名）、COLUMNS（建表语句括号内的列定义）与默认容量 MAX_BYTES。
+    列中必须有 size（条目字节数，用于容量统计）与 accessed_at（最近访问时间，用于淘汰）。
+    读写方法用 _connect 取连接，写入后在同一事务里调用 _evict；命中统计用 _count_lookups 累加。
+    """
+
+    MAX_BYTES = 200 * 1024 * 1024
+    TABLE = None
+    COLUMNS = None
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes or self.MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.TABLE} ({self.COLUMNS})")
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.TABLE}_accessed ON {self.TABLE}(accessed_at)"
+            )
+            table, size = self.TABLE, f"{self.TABLE}_size"
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {size} (total INTEGER NOT NULL)")
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_size_insert AFTER INSERT ON {table} "
+                         f"BEGIN UPDATE {size} SET total = total + NEW.size; END")
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_size_delete AFTER DELETE ON {table} "
+                         f"BEGIN UPDATE {size} SET total = total - OLD.size; END")
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_size_update AFTER UPDATE OF size ON {table} "
+                         f"BEGIN UPDATE {size} SET total = total + NEW.size - OLD.size; END")
+            # 触发器建好之后再统计一次现有数据（新库为 0；旧版本建的库在这里补上）
+            conn.execute(f"INSERT INTO {size} SELECT COALESCE(SUM(size), 0) FROM {table} "
+                         f"WHERE NOT EXISTS (SELECT 1 FROM {size})")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        try:
+            # INSERT OR REPLACE 删除旧行时只有打开递归触发器才会触发删除触发器，总大小才不会多算
+            conn.execute("PRAGMA recursive_triggers = ON")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count_lookups(self, hits, misses):
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _total(self, conn):
+        return conn.execute(f"SELECT total FROM {self.TABLE}_size").fetchone()[0]
+
+    def _evict(self, conn):
+        """总大小超过 max_bytes 时，按最近访问时间从旧到新删除，直到回到上限以内"""
+        total = self._total(conn)
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for rowid, size in conn.execute(f"SELECT rowid, size FROM {self.TABLE} ORDER BY accessed_at"):
+            victims.append((rowid,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        conn.executemany(f"DELETE FROM {self.TABLE} WHERE rowid = ?", victims)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.TABLE}")
+        with self._stats_lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()[0]
+            size = self._total(conn)
+        with self._stats_lock:
+            return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses}
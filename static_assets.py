@@ -0,0 +1,166 @@
+"""
+PDF 原文的静态托管
+
+PDF 只在上传时写入一次 Streamlit 的静态目录（static/，需开启 server.enableStaticServing），
+前端查看器通过 URL 按需加载，不再在每次 rerun 时把整份 PDF 以 base64 塞进 HTML。
+Streamlit 的静态文件处理基于 Tornado StaticFileHandler，原生支持 HTTP Range 与 ETag；
+URL 带上 ?v=<版本> 即可获得长期缓存头。
+
+上传的论文属于用户私有内容：
+- 文件名是内容哈希加本机密钥的 HMAC，知道论文内容（或它的 MD5）也猜不出 URL
+- Streamlit 给 /app/static/ 下的响应统一加 Access-Control-Allow-Origin: *；查看器 iframe 与页面同源，
+  papers/ 下的文件去掉这个头，其他网站的脚本读不到论文内容
+- 每次发布或被读取时更新文件修改时间，容量清理按它判断最近使用（不依赖常被 noatime 关掉的访问时间）
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+import streamlit as st
+
+from llm_cache import CACHE_DIR
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+PAPERS_DIR = os.path.join(STATIC_DIR, "papers")
+PAPERS_ROUTE = "/app/static/papers/"
+# 生成论文文件名的密钥，放在静态目录之外
+URL_KEY_PATH = os.path.join(CACHE_DIR, "static_url.key")
+# Streamlit 静态服务单文件上限为 200MB
+MAX_STATIC_FILE_SIZE = 200 * 1024 * 1024
+# papers/ 目录总容量上限，超出后按最近使用时间清理
+MAX_PAPERS_BYTES = 2 * 1024 * 1024 * 1024
+# 读取时更新修改时间的最小间隔（秒）：翻页的 Range 请求很密，不必每次都写 inode
+TOUCH_INTERVAL = 60
+
+_url_key = None
+
+
+def static_url(relative_path, version):
+    """静态目录中文件的 URL；?v=<版本> 让 Tornado 返回长期缓存头"""
+    base = st.get_option("server.baseUrlPath").strip("/")
+    prefix = f"/{base}" if base else ""
+    return f"{prefix}/app/static/{relative_path}?v={version}"
+
+
+def _load_url_key():
+    """读取本机密钥，第一次使用时生成；多个进程同时生成时以先落盘的为准"""
+    global _url_key
+    if _url_key is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        if not os.path.exists(URL_KEY_PATH):
+            tmp_path = f"{URL_KEY_PATH}.{os.getpid()}.tmp"
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+                f.write(secrets.token_hex(32))
+            try:
+                os.link(tmp_path, URL_KEY_PATH)  # 已存在时失败，不会覆盖其他进程的密钥
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        with open(URL_KEY_PATH, encoding="utf-8") as f:
+            _url_key = f.read().strip().encode("ascii")
+    return _url_key
+
+
+def _paper_name(file_hash):
+    return hmac.new(_load_url_key(), file_hash.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _paper_path(file_hash):
+    return os.path.join(PAPERS_DIR, f"{_paper_name(file_hash)}.pdf")
+
+
+def _touch(path):
+    try:
+        if time.time() - os.stat(path).st_mtime >= TOUCH_INTERVAL:
+            os.utime(path)
+    except OSError:
+        pass
+
+
+def _prune_papers(keep):
+    entries = []
+    name_length = len(_paper_name(""))
+    for name in os.listdir(PAPERS_DIR):
+        path = os.path.join(PAPERS_DIR, name)
+        if path == keep or not name.endswith(".pdf"):
+            continue
+        try:
+            if len(name) - len(".pdf") != name_length:
+                # 旧版本按内容哈希命名的文件，URL 可以猜到：直接删除
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    # 刚写入的文件也计入总量，但不会被删除
+    total = os.path.getsize(keep) + sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= MAX_PAPERS_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def publish_pdf(data, file_hash):
+    """
+    把 PDF 写入静态目录（已存在则只更新最近使用时间），返回浏览器可访问的 URL；
+    超过静态服务大小上限时返回 None，由调用方回退。
+    """
+    if len(data) > MAX_STATIC_FILE_SIZE:
+        return None
+    os.makedirs(PAPERS_DIR, exist_ok=True)
+    path = _paper_path(file_hash)
+    if os.path.exists(path):
+        _touch(path)
+    else:
+        # 先写临时文件再原子替换，多个会话/进程同时上传同一篇论文也不会读到半个文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        _prune_papers(keep=path)
+    name = _paper_name(file_hash)
+    return static_url(f"papers/{name}.pdf", name)
+
+
+def is_published(file_hash):
+    return os.path.exists(_paper_path(file_hash))
+
+
+def _install_paper_headers():
+    """
+    调整 Streamlit 静态文件处理器对 papers/ 的响应：去掉通配的跨域头，读取时更新最近使用时间。
+    Streamlit 内部模块路径变化时保持默认行为
+    """
+    try:
+        from streamlit.web.server.app_static_file_handler import AppStaticFileHandler
+    except ImportError:
+        return
+    if getattr(AppStaticFileHandler, "_paper_headers_installed", False):
+        return
+    set_default_headers = AppStaticFileHandler.set_default_headers
+    set_extra_headers = AppStaticFileHandler.set_extra_headers
+
+    def _set_default_headers(self):
+        set_default_headers(self)
+        if PAPERS_ROUTE in self.request.path:
+            self.clear_header("Access-Control-Allow-Origin")
+
+    def _set_extra_headers(self, path):
+        set_extra_headers(self, path)
+        if PAPERS_ROUTE in self.request.path:
+            _touch(self.absolute_path)
+
+    AppStaticFileHandler.set_default_headers = _set_default_headers
+    AppStaticFileHandler.set_extra_headers = _set_extra_headers
+    AppStaticFileHandler._paper_headers_installed = True
+
+
+_install_paper_headers()
@@ -0,0 +1,57 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import estimate_tokens, split_text_into_chunks, split_text_into_spans, truncate_to_tokens  # noqa: E402
+
+
+def _mixed_text(rng, n_units):
+    """中英文混排、夹杂超长无标点单元（公式、表格行、URL）的文本"""
+    parts = []
+    for _ in range(n_units):
+        kind = rng.random()
+        if kind < 0.3:
+            parts.append("模型" * rng.randint(1, 400) + "。")
+        elif kind < 0.6:
+            parts.append("word " * rng.randint(1, 300) + ". ")
+        elif kind < 0.8:
+            parts.append("x" * rng.randint(100, 3000) + "模型" * rng.randint(0, 500))
+        else:
+            parts.append("\n\n" if rng.random() < 0.5 else "\n")
+    return "".join(parts)
+
+
+def test_oversize_mixed_unit_stays_within_budget():
+    text = "x" * 2000 + "模型" * 300
+    spans = split_text_into_spans(text, 300, 0)
+    assert max(estimate_tokens(text[s:e]) for s, e in spans) <= 300
+    assert "".join(text[s:e] for s, e in spans) == text
+
+
+@pytest.mark.parametrize("max_tokens,overlap", [(50, 0), (300, 30), (1200, 150), (6000, 200)])
+def test_mixed_script_chunks_never_exceed_max_tokens(max_tokens, overlap):
+    rng = random.Random(max_tokens)
+    for _ in range(20):
+        text = _mixed_text(rng, 60)
+        chunks = split_text_into_chunks(text, max_tokens, overlap)
+        assert chunks
+        assert max(estimate_tokens(chunk) for chunk in chunks) <= max_tokens
+
+
+def test_spans_cover_text_in_order():
+    rng = random.Random(7)
+    text = _mixed_text(rng, 80)
+    spans = split_text_into_spans(text, 400, 40)
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    for (s1, e1), (s2, e2) in zip(spans, spans[1:]):
+        assert s1 < s2 <= e1 < e2
+
+
+def test_truncate_to_tokens_respects_budget():
+    text = "x" * 5000 + "模型" * 2000
+    for budget in (1, 10, 333, 2000):
+        assert estimate_tokens(truncate_to_tokens(text, budget)) <= budget
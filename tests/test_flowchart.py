@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowchart import repair_flowchart  # noqa: E402
+
+
+def _body(code):
+    """修复结果去掉声明行和缩进，便于逐行比较"""
+    return [line.strip() for line in code.splitlines()[1:]]
+
+
+# (说明, 输入, 修复后的语句, 修复说明条数)
+CASES = [
+    ("保留字 ID", "flowchart TD\nend --> B", ['N1["end"] --> B'], 1),
+    ("中文 ID 全图一致映射", "flowchart TD\n背景 --> B\nC --> 背景", ['N1["背景"] --> B', "C --> N1"], 1),
+    ("全角括号", "flowchart TD\nA【背景】 --> B（方法）", ['A["背景"] --> B("方法")'], 0),
+    ("Unicode 箭头", "flowchart TD\nA[背景] → B[方法]", ['A["背景"] --> B["方法"]'], 1),
+    ("单横线箭头", "flowchart LR\nA[x] -> B[y]", ['A["x"] --> B["y"]'], 1),
+    ("粗箭头与长破折号", "flowchart TD\nA[a] => B[b]\nA —> C", ['A["a"] ==> B["b"]', "A --> C"], 2),
+    ("带文字的连线", "flowchart TD\nA[x] -- 推出 --> B[y]", ['A["x"] -->|"推出"| B["y"]'], 1),
+    ("带文字的连线缺右引号", 'flowchart TD\nA -- "是 --> B', ['A -->|"是"| B'], 1),
+    ("边标签", "flowchart TD\nA -->|是| B", ['A -->|"是"| B'], 0),
+    ("未闭合的引号和括号", 'flowchart TD\nA["背景 --> B', ['A["背景"] --> B'], 1),
+    ("标签内的引号转义", 'flowchart TD\nA["他说"你好""] --> B', ['A["他说#quot;你好#quot;"] --> B'], 0),
+    ("未加引号的标签里有括号", "flowchart TD\nA[方法(新)] --> B", ['A["方法(新)"] --> B'], 0),
+    ("多余的 end", "flowchart TD\nA --> B\nend", ["A --> B"], 1),
+    ("缺少的 end", "flowchart TD\nsubgraph S1\nA --> B", ["subgraph S1", "A --> B", "end"], 1),
+    ("子图标题", "flowchart TD\nsubgraph S1 [数据集]\nA-->B\nend", ['subgraph S1["数据集"]', "A --> B", "end"], 0),
+    ("子图只有中文标题", "flowchart TD\nsubgraph 方法部分\nA --> B\nend", ['subgraph S1["方法部分"]', "A --> B", "end"], 1),
+    ("重复的图声明", "flowchart TD\nA-->B\nflowchart TD\nB-->C", ["A --> B", "B --> C"], 1),
+    ("缺少图声明", "A --> B", ["A --> B"], 1),
+]
+
+
+@pytest.mark.parametrize("name,code,expected,n_fixes", CASES, ids=[c[0] for c in CASES])
+def test_repairs(name, code, expected, n_fixes):
+    repaired, fixes, errors = repair_flowchart(code)
+    assert _body(repaired) == expected
+    assert len(fixes) == n_fixes
+    assert errors == []
+    # 修复结果再修一次不应有任何变化
+    assert repair_flowchart(repaired) == (repaired, [], [])
+
+
+def test_direction_is_normalized():
+    assert repair_flowchart("graph lr\nA-->B")[0].splitlines()[0] == "flowchart LR"
+    repaired, fixes, _ = repair_flowchart("flowchart XY\nA-->B")
+    assert repaired.splitlines()[0] == "flowchart TD" and len(fixes) == 1
+
+
+@pytest.mark.parametrize("line", ["A -->", "A[x] --> --> B", "]]] oops"])
+def test_unparsable_statement_is_kept_or_dropped(line):
+    code = f"flowchart TD\nA --> B\n{line}"
+    repaired, fixes, errors = repair_flowchart(code)
+    assert _body(repaired) == ["A --> B", line] and fixes == [] and len(errors) == 1
+
+    repaired, fixes, errors = repair_flowchart(code, drop_invalid=True)
+    assert _body(repaired) == ["A --> B"] and len(fixes) == 1 and errors == []
+
+
+def test_other_diagrams_are_untouched():
+    code = "sequenceDiagram\nA->>B: hi"
+    assert repair_flowchart(code) == (code, [], [])
+
+
+def test_graph_without_nodes_is_reported():
+    _, _, errors = repair_flowchart("flowchart TD\n%% 只有注释")
+    assert errors == ["图中没有任何节点"]
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import library  # noqa: E402
+from library import MAX_SEGMENTS, PaperLibrary  # noqa: E402
+
+
+class _Boom(Exception):
+    pass
+
+
+def _paper(i):
+    return f"paper{i} studies alpha beta gamma. delta epsilon topic{i} closes the section."
+
+
+def _add(lib, i):
+    return lib.add(f"h{i}", f"p{i}.pdf", _paper(i))
+
+
+def _on_disk(lib):
+    return {entry.split(".", 1)[0] for entry in os.listdir(lib.index_dir)}
+
+
+def _registered(lib):
+    with sqlite3.connect(lib.path) as conn:
+        return {name for name, in conn.execute("SELECT name FROM segments")}
+
+
+def _assert_consistent(lib, n_papers):
+    """磁盘上的段文件与登记的段一致，检索和短语检索都能用"""
+    assert _on_disk(lib) == _registered(lib)
+    assert lib.stats()["papers"] == n_papers
+    assert len(lib.search("alpha", top_k=100)) == n_papers
+    assert len(lib.search('"beta gamma"', top_k=100)) == n_papers
+    assert lib.search('"gamma beta"') == []
+
+
+@pytest.fixture
+def lib(tmp_path):
+    return PaperLibrary(str(tmp_path))
+
+
+def test_merges_keep_index_consistent(lib):
+    for i in range(MAX_SEGMENTS * 3):
+        assert _add(lib, i)
+    assert lib.stats()["segments"] <= MAX_SEGMENTS
+    _assert_consistent(lib, MAX_SEGMENTS * 3)
+
+    assert lib.remove("h3")
+    lib.optimize()
+    assert lib.stats()["segments"] == 1
+    _assert_consistent(lib, MAX_SEGMENTS * 3 - 1)
+    assert lib.search("topic3") == []
+    assert [hit["file_hash"] for hit in lib.search("topic4")] == ["h4"]
+
+
+def test_failure_before_merge_rolls_back_new_segment(lib, monkeypatch):
+    for i in range(3):
+        _add(lib, i)
+
+    def fail(conn):
+        raise _Boom
+
+    monkeypatch.setattr(PaperLibrary, "_merge_plan", staticmethod(fail))
+    with pytest.raises(_Boom):
+        _add(lib, 3)
+    assert not lib.contains("h3")
+    _assert_consistent(lib, 3)
+
+    monkeypatch.undo()
+    assert _add(lib, 3)
+    _assert_consistent(lib, 4)
+
+
+def test_failure_after_merge_wrote_segment_rolls_back_both(lib, monkeypatch):
+    for i in range(MAX_SEGMENTS):
+        _add(lib, i)
+    before = _registered(lib)
+    merge = PaperLibrary._merge
+
+    def merge_then_fail(self, conn, generation, names, written):
+        stale = merge(self, conn, generation, names, written)
+        if stale:
+            raise _Boom
+        return stale
+
+    monkeypatch.setattr(PaperLibrary, "_merge", merge_then_fail)
+    with pytest.raises(_Boom):
+        _add(lib, MAX_SEGMENTS)
+    # 新段和合并出的段都已删除，旧段一个不少
+    assert _registered(lib) == before
+    _assert_consistent(lib, MAX_SEGMENTS)
+
+    monkeypatch.undo()
+    assert _add(lib, MAX_SEGMENTS)
+    assert len(_registered(lib)) < len(before) + 1
+    _assert_consistent(lib, MAX_SEGMENTS + 1)
+
+
+def test_failed_optimize_keeps_old_segments(lib, monkeypatch):
+    for i in range(4):
+        _add(lib, i)
+    before = _registered(lib)
+    write_segment = library._write_segment
+
+    def write_then_fail(base, postings):
+        write_segment(base, postings)
+        raise _Boom
+
+    monkeypatch.setattr(library, "_write_segment", write_then_fail)
+    with pytest.raises(_Boom):
+        lib.optimize()
+    assert _registered(lib) == before
+    _assert_consistent(lib, 4)
+
+
+def test_open_sweeps_unregistered_segment_files(tmp_path):
+    lib = PaperLibrary(str(tmp_path))
+    for i in range(3):
+        _add(lib, i)
+    # 模拟写入中途进程退出留下的段文件
+    for ext in (".lex", ".post", ".pos", ".lex.tmp"):
+        with open(os.path.join(lib.index_dir, "seg_99999999" + ext), "wb") as f:
+            f.write(b"\0" * 8)
+
+    reopened = PaperLibrary(str(tmp_path))
+    assert "seg_99999999" not in _on_disk(reopened)
+    _assert_consistent(reopened, 3)
@@ -0,0 +1,194 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paper_core  # noqa: E402
+import rate_limit  # noqa: E402
+from chunking import estimate_tokens  # noqa: E402
+from rate_limit import CircuitBreaker, CircuitOpenError, RateLimiter, TokenBucket  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "summarize this paper"}]
+TPM = 6000
+
+
+class FakeClock:
+    """代替 rate_limit 里的 time 模块：时间只在 sleep 或测试手动拨动时前进"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def limits(clock, monkeypatch):
+    """paper_core 换上使用假时钟的限速器与熔断器（只限 TPM，熔断阈值 1 次、冷却 10 秒）"""
+    limiter, breaker = RateLimiter(None, TPM), CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    monkeypatch.setattr(paper_core, "rate_limiter", limiter)
+    monkeypatch.setattr(paper_core, "circuit_breaker", breaker)
+    return limiter, breaker
+
+
+def _response(content, usage=None, status_code=200):
+    return SimpleNamespace(status_code=status_code, message="", usage=usage,
+                           output=SimpleNamespace(choices=[{"message": {"content": content}}]))
+
+
+def _fake_generation(monkeypatch, result):
+    monkeypatch.setattr(paper_core, "_generation", lambda: SimpleNamespace(call=lambda **kwargs: result()))
+
+
+# --- 令牌桶与限速器 ---
+
+
+def test_token_bucket_allows_burst_then_waits_and_refills(clock):
+    bucket = TokenBucket(rate=2.0, capacity=4)
+    assert [bucket.reserve(1) for _ in range(4)] == [0.0] * 4
+    assert bucket.reserve(1) == pytest.approx(0.5)
+    clock.now += 2.5  # 补回 5 个令牌，但不超过容量
+    assert bucket.reserve(4) == 0.0
+
+
+def test_oversize_request_is_charged_at_capacity(clock):
+    bucket = TokenBucket(rate=10.0, capacity=100)
+    assert bucket.reserve(1000) == 0.0
+    assert bucket.reserve(10) == pytest.approx(1.0)
+
+
+def test_rate_limiter_sleeps_for_the_qps_deficit(clock):
+    limiter = RateLimiter(qps=2)
+    assert limiter.acquire() == 0.0 and limiter.acquire() == 0.0
+    assert limiter.acquire() == pytest.approx(0.5)
+    assert clock.slept == [pytest.approx(0.5)]
+    assert limiter.stats() == {"throttled": 1, "waited": pytest.approx(0.5)}
+
+
+def test_settle_corrects_the_tpm_reservation(clock):
+    limiter = RateLimiter(tpm=TPM)
+    limiter.acquire(5000)
+    limiter.settle(5000, 1200)  # 实际用量更少：退还差额
+    assert limiter._tokens._level == pytest.approx(TPM - 1200)
+    limiter.settle(0, None)  # 没有 usage 时不修正
+    assert limiter._tokens._level == pytest.approx(TPM - 1200)
+    limiter.settle(0, -10 * TPM)  # 退还不超过桶容量
+    assert limiter._tokens._level == TPM
+
+
+# --- 熔断器 ---
+
+
+def test_breaker_opens_then_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.before_call() is False
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 10
+    assert breaker.state == "half-open"
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # 探测期间其他请求仍然直接失败
+
+    breaker.record_failure()  # 探测失败：重新开始冷却
+    assert breaker.state == "open"
+    clock.now += 10
+    assert breaker.before_call() is True
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.before_call() is False
+
+
+def test_released_probe_can_be_taken_again(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.before_call() is True
+    breaker.release_probe()
+    assert breaker.state == "half-open"
+    assert breaker.before_call() is True
+
+
+# --- paper_core._Attempt：请求收尾 ---
+
+
+def test_request_settles_reservation_to_actual_usage(limits, monkeypatch):
+    limiter, breaker = limits
+    usage = SimpleNamespace(input_tokens=100, output_tokens=20, prompt_tokens_details={"cached_tokens": 0})
+    _fake_generation(monkeypatch, lambda: _response("ok", usage))
+    assert paper_core.request_qwen(MESSAGES, use_cache=False) == "ok"
+    assert limiter._tokens._level == pytest.approx(TPM - 120)
+    assert breaker.state == "closed"
+
+
+def test_rejected_request_refunds_reservation(limits, monkeypatch):
+    limiter, breaker = limits
+    _fake_generation(monkeypatch, lambda: _response(None, status_code=400))
+    with pytest.raises(paper_core.QwenCallError):
+        paper_core.request_qwen(MESSAGES, use_cache=False)
+    assert limiter._tokens._level == TPM
+    assert breaker.state == "closed"  # 4xx 说明服务还活着，不计入熔断
+
+
+def _open_breaker(breaker, clock):
+    breaker.record_failure()
+    clock.now += breaker.reset_timeout
+    assert breaker.state == "half-open"
+
+
+def test_abandoned_probe_stream_releases_probe_and_settles_usage(limits, clock, monkeypatch):
+    limiter, breaker = limits
+    _open_breaker(breaker, clock)
+    _fake_generation(monkeypatch, lambda: iter([_response("Hel"), _response("lo"), _response("!")]))
+
+    stream = paper_core.stream_qwen(MESSAGES, use_cache=False)
+    assert next(stream) == "Hel"
+    assert breaker._probing
+    stream.close()  # 调用方中途放弃（Streamlit 重跑/停止）
+
+    assert breaker.state == "half-open" and not breaker._probing
+    estimated = paper_core._estimate_request_tokens(MESSAGES)
+    used = estimated - paper_core.QWEN_OUTPUT_TOKENS_ESTIMATE + estimate_tokens("Hel")
+    assert limiter._tokens._level == pytest.approx(TPM - used)
+    # 下一个请求重新探测，成功后恢复
+    assert breaker.before_call() is True
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_abandoned_stream_with_usage_settles_reported_tokens(limits, monkeypatch):
+    limiter, _ = limits
+    usage = SimpleNamespace(input_tokens=300, output_tokens=5, prompt_tokens_details={})
+    _fake_generation(monkeypatch, lambda: iter([_response("a", usage), _response("b", usage)]))
+    stream = paper_core.stream_qwen(MESSAGES, use_cache=False)
+    next(stream)
+    stream.close()
+    assert limiter._tokens._level == pytest.approx(TPM - 305)
+
+
+def test_completed_probe_stream_closes_breaker(limits, clock, monkeypatch):
+    limiter, breaker = limits
+    _open_breaker(breaker, clock)
+    usage = SimpleNamespace(input_tokens=50, output_tokens=7, prompt_tokens_details={})
+    _fake_generation(monkeypatch, lambda: iter([_response("Hel", usage), _response("lo", usage)]))
+    assert "".join(paper_core.stream_qwen(MESSAGES, use_cache=False)) == "Hello"
+    assert breaker.state == "closed"
+    assert limiter._tokens._level == pytest.approx(TPM - 57)
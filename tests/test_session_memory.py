@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_memory import MemoryAccountant  # noqa: E402
+
+
+class _State(dict):
+    """代替 Streamlit 的 SessionState：支持 in / [] / del，并且可以被弱引用"""
+
+
+def _accountant(tmp_path):
+    # 上限很小、空闲阈值为负：只要允许，每次 checkin 都会驱逐其他会话
+    return MemoryAccountant(str(tmp_path), max_bytes=1, idle_seconds=-1)
+
+
+def _open_session(memory, session_id, text, busy=None):
+    state = _State(chat_history=[text])
+    memory.checkin(session_id, state, private_keys=("chat_history",), busy=busy)
+    return state
+
+
+def test_running_session_is_not_evicted(tmp_path):
+    memory = _accountant(tmp_path)
+    a = _open_session(memory, "a", "x" * 1000)
+    _open_session(memory, "b", "y" * 1000)
+    # a 还没有 checkout（页面仍在运行），即使超出上限也不能删它的状态
+    assert a["chat_history"] == ["x" * 1000]
+
+
+def test_finished_idle_session_is_evicted_and_restored(tmp_path):
+    memory = _accountant(tmp_path)
+    a = _open_session(memory, "a", "x" * 1000)
+    memory.checkout("a")
+    _open_session(memory, "b", "y" * 1000)
+    assert "chat_history" not in a
+    assert memory.stats()["spilled_sessions"] == 1
+
+    memory.checkin("a", a, private_keys=("chat_history",))
+    assert a["chat_history"] == ["x" * 1000]
+
+
+def test_session_with_live_jobs_is_not_evicted(tmp_path):
+    memory = _accountant(tmp_path)
+    jobs = {"analysis": "job-1"}
+    a = _open_session(memory, "a", "x" * 1000, busy=lambda: bool(jobs))
+    memory.checkout("a")
+    _open_session(memory, "b", "y" * 1000)
+    assert a["chat_history"] == ["x" * 1000]
+
+    jobs.clear()
+    memory.checkout("b")
+    _open_session(memory, "c", "z" * 1000)
+    assert "chat_history" not in a
+
+
+def test_failing_busy_check_keeps_session(tmp_path):
+    memory = _accountant(tmp_path)
+    a = _open_session(memory, "a", "x" * 1000, busy=lambda: 1 / 0)
+    memory.checkout("a")
+    _open_session(memory, "b", "y" * 1000)
+    assert a["chat_history"] == ["x" * 1000]
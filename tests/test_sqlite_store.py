@@ -0,0 +1,57 @@
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_cache import ResponseCache  # noqa: E402
+from translation_memory import TranslationMemory  # noqa: E402
+
+
+def _sum_size(store):
+    with sqlite3.connect(store.path) as conn:
+        return conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {store.TABLE}").fetchone()[0]
+
+
+def test_running_total_follows_insert_replace_delete_and_evict(tmp_path):
+    cache = ResponseCache(str(tmp_path / "r.sqlite3"), max_bytes=5000, ttl=None)
+    rng = random.Random(3)
+    for _ in range(300):
+        key = f"k{rng.randrange(40)}"
+        op = rng.random()
+        if op < 0.7:
+            cache.set(key, "m", "x" * rng.randint(1, 400))  # 新增或替换，超出上限时淘汰
+        elif op < 0.9:
+            cache.get(key)
+        else:
+            with cache._connect() as conn:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        assert cache.stats()["bytes"] == _sum_size(cache)
+        assert cache.stats()["bytes"] <= 5000
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
+
+
+def test_ttl_expiry_is_subtracted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "r.sqlite3"), ttl=60)
+    cache.set("old", "m", "x" * 100)
+    with cache._connect() as conn:
+        conn.execute("UPDATE responses SET created_at = created_at - 3600")
+    cache.set("new", "m", "y" * 10)
+    assert cache.get("old") is None
+    assert cache.stats()["bytes"] == _sum_size(cache) == 10
+
+
+def test_existing_database_gets_its_total_on_open(tmp_path):
+    path = str(tmp_path / "tm.sqlite3")
+    memory = TranslationMemory(path)
+    for i in range(5):
+        memory.put(f"k{i}", "translate", "src", "目标" * (i + 1))
+    expected = _sum_size(memory)
+    # 模拟旧版本建的库：没有总大小表和触发器
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE segments_size")
+        for name in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER segments_size_{name}")
+    assert TranslationMemory(path).stats()["bytes"] == expected
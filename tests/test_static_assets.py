@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import static_assets  # noqa: E402
+from static_assets import is_published, publish_pdf  # noqa: E402
+
+HASH_A, HASH_B = "a" * 32, "b" * 32
+
+
+@pytest.fixture
+def papers_dir(tmp_path, monkeypatch):
+    papers = tmp_path / "papers"
+    monkeypatch.setattr(static_assets, "PAPERS_DIR", str(papers))
+    monkeypatch.setattr(static_assets, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(static_assets, "URL_KEY_PATH", str(tmp_path / "cache" / "static_url.key"))
+    monkeypatch.setattr(static_assets, "_url_key", None)
+    return papers
+
+
+def _age(path, seconds):
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime - seconds))
+
+
+def test_url_does_not_expose_content_hash(papers_dir):
+    url = publish_pdf(b"%PDF-1.4 a", HASH_A)
+    assert HASH_A not in url
+    assert is_published(HASH_A) and not is_published(HASH_B)
+    assert publish_pdf(b"%PDF-1.4 a", HASH_A) == url
+    assert oct(os.stat(static_assets.URL_KEY_PATH).st_mode & 0o777) == "0o600"
+
+    # 换一个密钥（另一台机器）得到不同的地址
+    os.remove(static_assets.URL_KEY_PATH)
+    static_assets._url_key = None
+    assert publish_pdf(b"%PDF-1.4 a", HASH_A) != url
+
+
+def test_legacy_hash_named_files_are_removed(papers_dir):
+    papers_dir.mkdir()
+    legacy = papers_dir / f"{HASH_B}.pdf"
+    legacy.write_bytes(b"old")
+    publish_pdf(b"%PDF-1.4 a", HASH_A)
+    assert not legacy.exists()
+
+
+def test_prune_keeps_recently_used_papers(papers_dir, monkeypatch):
+    monkeypatch.setattr(static_assets, "MAX_PAPERS_BYTES", 250)
+    publish_pdf(b"a" * 100, "1" * 32)
+    publish_pdf(b"b" * 100, "2" * 32)
+    for file_hash in ("1" * 32, "2" * 32):
+        _age(static_assets._paper_path(file_hash), 3600)
+    # 论文 1 较早发布，但刚被再次打开：清理时留下它，删掉论文 2
+    publish_pdf(b"a" * 100, "1" * 32)
+    publish_pdf(b"c" * 100, "3" * 32)
+    assert is_published("1" * 32) and not is_published("2" * 32) and is_published("3" * 32)
+
+
+def test_touch_is_throttled(papers_dir):
+    publish_pdf(b"a" * 10, HASH_A)
+    path = static_assets._paper_path(HASH_A)
+    _age(path, 10)
+    mtime = os.stat(path).st_mtime
+    static_assets._touch(path)
+    assert os.stat(path).st_mtime == mtime
+    _age(path, static_assets.TOUCH_INTERVAL)
+    static_assets._touch(path)
+    assert os.stat(path).st_mtime > mtime
@@ -0,0 +1,62 @@
+"""
+已解析论文的持久化存储（SQLite）
+
+以 PDF 内容哈希为键保存逐页文本、标题版面信息和抽取元数据。重启、重新部署或其他用户
+再次上传同一篇论文时直接读取，不再经过 pdfplumber。
+"""
+import json
+import time
+import zlib
+
+from sqlite_store import SqliteLruStore
+
+
+class TextStore(SqliteLruStore):
+    """
+    逐页文本存储：(file_hash, extractor) -> 压缩后的 {"pages": [...], "layout": [...], "meta": {...}}。
+    连接、淘汰与统计见 SqliteLruStore。
+    """
+
+    MAX_BYTES = 500 * 1024 * 1024
+    TABLE = "documents"
+    COLUMNS = """
+        file_hash TEXT NOT NULL,
+        extractor TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (file_hash, extractor)
+    """
+
+    def get(self, file_hash, extractor="pdfplumber"):
+        """返回 {"pages": [...], "layout": [...], "meta": {...}}，不存在时返回 None（早期条目没有 "layout"）"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload FROM documents WHERE file_hash = ? AND extractor = ?",
+                (file_hash, extractor),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE documents SET accessed_at = ? WHERE file_hash = ? AND extractor = ?",
+                (time.time(), file_hash, extractor),
+            )
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, file_hash, pages, meta=None, extractor="pdfplumber", layout=None):
+        document = {"pages": pages, "meta": meta or {}}
+        if layout is not None:
+            document["layout"] = layout
+        payload = zlib.compress(json.dumps(document, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO documents
+                    (file_hash, extractor, payload, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (file_hash, extractor, payload, len(payload), now, now),
+            )
+            self._evict(conn)
@@ -0,0 +1,73 @@
+"""
+翻译记忆（SQLite）：逐段保存翻译/润色结果
+
+以 (任务, 源语言, 模型, 规范化后的原文段落) 的哈希为键。样板句、图表标题、反复修改的草稿里
+没改动的段落再次出现时直接取回结果，不再调用模型。原文在计算键之前合并空白，
+同一句话因 PDF 折行位置不同而换行不同也能命中。
+"""
+import hashlib
+import json
+import re
+import time
+
+from sqlite_store import SqliteLruStore
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_segment(text):
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def make_segment_key(task, lang, model, text):
+    payload = json.dumps([task, lang, model, normalize_segment(text)], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory(SqliteLruStore):
+    """段落级翻译记忆，按段落统计命中；连接、淘汰与统计见 SqliteLruStore"""
+
+    MAX_BYTES = 100 * 1024 * 1024
+    TABLE = "segments"
+    COLUMNS = """
+        key TEXT PRIMARY KEY,
+        task TEXT NOT NULL,
+        source TEXT NOT NULL,
+        target TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        hit_count INTEGER NOT NULL DEFAULT 0
+    """
+
+    def get_many(self, keys):
+        """返回 {key: 结果}，只包含命中的段落"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT key, target FROM segments WHERE key IN ({placeholders})", keys
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE segments SET accessed_at = ?, hit_count = hit_count + 1 WHERE key = ?",
+                    [(time.time(), key) for key, _ in rows],
+                )
+        self._count_lookups(len(rows), len(keys) - len(rows))
+        return dict(rows)
+
+    def put(self, key, task, source, target):
+        now = time.time()
+        size = len(source.encode("utf-8")) + len(target.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO segments
+                    (key, task, source, target, size, created_at, accessed_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, task, normalize_segment(source), target, size, now, now),
+            )
+            self._evict(conn)
@@ -0,0 +1,154 @@
+"""
+调用用量记账：每次 DashScope 调用的 Token、耗时、模型与所属功能
+
+- UsageTotals：线程安全的累加器，会话级与进程级各一份
+- UsageTracker：进程级入口，汇总全局用量并追加写入 JSONL 日志（只追加，不改写）
+- UsageMeter：绑定到“某个会话 + 某个功能”的记账句柄，随调用一路传给 request_qwen / stream_qwen
+- budget_decision：按会话剩余预算决定一次操作是照常执行、降级执行还是拒绝
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# 单价：元 / 千 Token（输入, 输出），来自百炼官网价目表，调价时更新这里即可
+PRICES = {
+    "qwen-turbo": (0.0003, 0.0006),
+    "qwen-plus": (0.0008, 0.002),
+    "qwen-max": (0.0024, 0.0096),
+}
+
+FEATURE_LABELS = {
+    "analysis": "一站式分析",
+    "overview": "深度概览",
+    "page_summary": "按页总结",
+    "bibtex": "BibTeX",
+    "mindmap": "逻辑导图",
+    "terms": "术语表",
+    "experiment": "实验数据",
+    "chat": "对话问答",
+    "translation": "翻译润色",
+    "library": "文库问答",
+    "other": "其他",
+}
+
+# 命中服务端上下文缓存的输入 Token 按输入单价的该比例计费（百炼隐式缓存）
+CACHED_INPUT_PRICE_RATIO = 0.4
+
+# 剩余预算不足以完整执行、但仍有估算量的这个比例时，降级执行（缩减输入）而不是直接拒绝
+DOWNGRADE_MIN_RATIO = 0.3
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    input_price, output_price = PRICES.get(model, PRICES["qwen-turbo"])
+    uncached = prompt_tokens - cached_tokens
+    return (uncached * input_price + cached_tokens * input_price * CACHED_INPUT_PRICE_RATIO
+            + completion_tokens * output_price) / 1000
+
+
+class UsageTotals:
+    """用量累加器：总量 + 按功能拆分"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cached_calls = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.latency = 0.0
+        self.by_feature = defaultdict(lambda: {"calls": 0, "tokens": 0, "cost": 0.0})
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, record):
+        tokens = record["prompt_tokens"] + record["completion_tokens"]
+        with self._lock:
+            self.calls += 1
+            self.cached_calls += record["cached"]
+            self.prompt_tokens += record["prompt_tokens"]
+            self.cached_prompt_tokens += record["cached_tokens"]
+            self.completion_tokens += record["completion_tokens"]
+            self.cost += record["cost"]
+            self.latency += record["latency"]
+            feature = self.by_feature[record["feature"]]
+            feature["calls"] += 1
+            feature["tokens"] += tokens
+            feature["cost"] += record["cost"]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "cached_calls": self.cached_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.total_tokens,
+                "cost": self.cost,
+                "latency": self.latency,
+                "by_feature": {k: dict(v) for k, v in self.by_feature.items()},
+            }
+
+
+class UsageTracker:
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.totals = UsageTotals()
+        self._log_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+
+    def meter(self, feature, session_id=None, session_totals=None):
+        return UsageMeter(self, feature, session_id, session_totals)
+
+    def record(self, record, session_totals=None):
+        self.totals.add(record)
+        if session_totals is not None:
+            session_totals.add(record)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._log_lock, open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class UsageMeter:
+    """某个会话中某个功能的记账句柄；可在工作线程中使用"""
+
+    def __init__(self, tracker, feature, session_id=None, session_totals=None):
+        self.tracker = tracker
+        self.feature = feature
+        self.session_id = session_id
+        self.session_totals = session_totals
+
+    def record(self, model, prompt_tokens, completion_tokens, latency, cached=False, estimated=False,
+               cached_tokens=0):
+        """cached 表示命中本地响应缓存（未发请求）；cached_tokens 为命中服务端上下文缓存的输入 Token 数"""
+        self.tracker.record({
+            "ts": round(time.time(), 3),
+            "session": self.session_id,
+            "feature": self.feature,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "latency": round(latency, 3),
+            "cost": round(estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens), 6) if not cached else 0.0,
+            "cached": cached,
+            # DashScope 未返回 usage 时按字符数估算
+            "estimated": estimated,
+        }, self.session_totals)
+
+
+def budget_decision(remaining, estimate, min_ratio=DOWNGRADE_MIN_RATIO):
+    """
+    remaining: 会话剩余 Token 预算（None 表示不限）；estimate: 本次操作的估算 Token 数。
+    返回 (决定, 允许使用的 Token 数)，决定为 "ok" / "downgrade" / "block"。
+    """
+    if remaining is None or estimate <= remaining:
+        return "ok", estimate
+    if remaining >= estimate * min_ratio:
+        return "downgrade", remaining
+    return "block", 0
@@ -0,0 +1,123 @@
+"""
+前端依赖（pdf.js / mermaid）的本地化托管
+
+内网/离线部署时，iframe 组件不能再从 cdnjs / jsdelivr 拉取脚本。这里：
+1. `python vendor_assets.py fetch` 按固定版本下载依赖，以内容哈希命名写入 static/vendor/，
+   并生成 static/vendor/manifest.json（在联网机器上执行一次，再把 static/vendor/ 拷进部署目录即可）；
+2. 运行时与 PDF 原文一样走 Streamlit 自带的静态服务（/app/static/vendor/...，见 static_assets.py）：
+   与页面同源、同协议，HTTPS 部署下不会被当成混合内容拦截，也不需要额外监听端口。
+   URL 带 ?v=<内容哈希>，Tornado 会返回长期缓存头，组件之后的每次挂载都直接命中浏览器缓存。
+
+Streamlit 的静态服务对 .js 一律返回 text/plain + nosniff，浏览器不会把它当脚本执行，
+所以组件里用 asset_loader 生成的加载器：fetch 取回脚本文本（fetch 不检查 Content-Type），
+包成 text/javascript 的 Blob URL 再插入 <script>；pdf.js 的 worker 同样使用 Blob URL。
+
+static/vendor/ 下没有 manifest 时回退到原来的 CDN 地址，直接用 <script src> 加载。
+"""
+import hashlib
+import json
+import os
+import sys
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+VENDOR_DIR = os.path.join(STATIC_DIR, "vendor")
+MANIFEST_PATH = os.path.join(VENDOR_DIR, "manifest.json")
+
+# 逻辑名 -> 固定版本的上游地址（同时也是未本地化时的回退地址）
+ASSETS = {
+    "pdf.js": "https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.min.js",
+    "pdf.worker.js": "https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js",
+    "mermaid.js": "https://cdn.jsdelivr.net/npm/mermaid@10.9.3/dist/mermaid.min.js",
+}
+
+# 组件里的加载器：依次加载 scripts 并执行，把 urls 中的依赖换成可直接使用的地址，
+# 全部就绪后 window.assetsReady resolve 为 {逻辑名: 地址}。本地化的文件取回后转成 Blob URL
+_LOADER_JS = """
+<script>
+  window.assetsReady = (async function (scripts, urls) {
+    async function resolve(asset) {
+      if (!asset.local) return asset.url;
+      const resp = await fetch(new URL(asset.url, document.baseURI));
+      if (!resp.ok) throw new Error("failed to load " + asset.url + ": " + resp.status);
+      return URL.createObjectURL(new Blob([await resp.text()], { type: "text/javascript" }));
+    }
+    for (const asset of scripts) {
+      const src = await resolve(asset);
+      await new Promise(function (ok, fail) {
+        const el = document.createElement("script");
+        el.src = src;
+        el.onload = ok;
+        el.onerror = function () { fail(new Error("failed to run " + asset.url)); };
+        document.head.appendChild(el);
+      });
+    }
+    const resolved = {};
+    for (const [name, asset] of Object.entries(urls)) resolved[name] = await resolve(asset);
+    return resolved;
+  })(%s, %s);
+  window.assetsReady.catch(function (err) { document.body.insertAdjacentText("afterbegin", String(err)); });
+</script>
+"""
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # 只认文件确实存在的条目
+    return {
+        name: filename for name, filename in manifest.items()
+        if os.path.exists(os.path.join(VENDOR_DIR, filename))
+    }
+
+
+def _asset(name, manifest):
+    """{"url", "local"}：已本地化时为同源的静态地址，否则为 CDN 地址"""
+    filename = manifest.get(name)
+    if filename is None:
+        return {"url": ASSETS[name], "local": False}
+    from static_assets import static_url  # 依赖 Streamlit，只在页面运行时导入
+
+    digest = filename.rsplit(".", 2)[-2]
+    return {"url": static_url(f"vendor/{filename}", digest), "local": True}
+
+
+def asset_loader(scripts=(), urls=()):
+    """
+    返回组件 HTML 里的一段 <script>：按顺序加载并执行 scripts 中的依赖，
+    urls 中的依赖（如 pdf.js 的 worker）只换成浏览器可直接使用的地址。
+    组件代码写在 assetsReady.then(function (urls) { ... }) 里，urls 为 {逻辑名: 地址}
+    """
+    manifest = load_manifest()
+    return _LOADER_JS % (
+        json.dumps([_asset(name, manifest) for name in scripts]),
+        json.dumps({name: _asset(name, manifest) for name in urls}),
+    )
+
+
+def fetch_assets():
+    """下载固定版本的依赖，按内容哈希命名写入 static/vendor/ 并更新 manifest.json"""
+    import urllib.request  # 只有 fetch 命令用得到，应用运行时不加载
+
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    manifest = {}
+    for name, url in ASSETS.items():
+        with urllib.request.urlopen(url, timeout=60) as resp:
+            data = resp.read()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        stem, ext = os.path.splitext(name)
+        filename = f"{stem}.{digest}{ext}"
+        with open(os.path.join(VENDOR_DIR, filename), "wb") as f:
+            f.write(data)
+        manifest[name] = filename
+        print(f"{name:<16} {len(data):>10,} bytes -> static/vendor/{filename}")
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["fetch"]:
+        sys.exit("usage: python vendor_assets.py fetch")
+    fetch_assets()